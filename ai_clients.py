@@ -0,0 +1,346 @@
+"""
+TaxGuard AI - AI provider clients
+
+Provider SDK objects are created once and reused for every request instead
+of being rebuilt per message. Conversations are sent as structured
+multi-turn contents rather than one concatenated string, and the system
+prompt goes in the provider's system-instruction slot so the static
+prefix is identical on every call:
+
+- OpenAI caches repeated prompt prefixes automatically, so the system
+  prompt is always the first message.
+- Gemini models are built once per system prompt with system_instruction.
+  With GEMINI_CONTEXT_CACHE=true the system prompt is also stored as a
+  Gemini cached content and referenced instead of re-sent (needs a model
+  version that supports context caching; falls back silently otherwise).
+  The cached content is recreated shortly before its TTL runs out, and a
+  call that finds it gone (NotFound) is retried with the prompt inline.
+
+Constructing a client does not import its SDK: openai and
+google.generativeai (several hundred ms and tens of MB) are imported, and
+genai.configure() called, on the first request. A missing package still
+raises ImportError from the constructor. Under gunicorn with preload_app
+(gunicorn.conf.py) preload_sdks() imports them once in the master so the
+workers share those pages copy-on-write; the SDK clients themselves (HTTP
+pools, gRPC channels) are still created in each worker, after the fork.
+
+acomplete() is the asyncio counterpart of complete(), used by the ASGI
+serving mode (asgi.py).
+
+A message may carry an "image": {"mime_type", "data"} next to its text
+(receipt photos, see media.py). OpenAI requests with an image go to
+OPENAI_VISION_MODEL; Gemini models read images natively.
+
+Environment Variables (.env file):
+OPENAI_MODEL=chat model (default: gpt-4)
+GEMINI_MODEL=model name (default: gemini-2.0-flash-exp)
+GEMINI_CONTEXT_CACHE=true or false (default: false)
+GEMINI_CONTEXT_CACHE_TTL=seconds the cached prompt is kept (default: 3600)
+OPENAI_VISION_MODEL=model for messages with an image (default: gpt-4o-mini)
+OPENAI_BASE_URL=OpenAI-compatible API root (optional - e.g. the bench/ fake server)
+GEMINI_API_ENDPOINT=Gemini API host (optional - switches to the REST transport)
+"""
+
+import base64
+import datetime
+import importlib
+import importlib.util
+import logging
+import threading
+import time
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+# Every client created in this process, for preload_sdks()
+_clients = []
+
+# Generation settings shared by both providers
+TEMPERATURE = 0.7
+MAX_OUTPUT_TOKENS = 500
+
+# Gemini cached contents are recreated this long before their TTL ends
+CONTEXT_CACHE_REFRESH_MARGIN = 60
+
+# A built Gemini model; expires (on the client's clock) is None when it never does
+GeminiModel = namedtuple("GeminiModel", "model expires cached")
+
+
+def _require(module):
+    """ImportError if module is not installed, without importing it"""
+    try:
+        found = importlib.util.find_spec(module) is not None
+    except ModuleNotFoundError:  # parent package missing
+        found = False
+    if not found:
+        raise ImportError(f"No module named {module!r}")
+
+
+def preload_sdks():
+    """Import the SDKs of every client created so far (no clients or connections)"""
+    for module in sorted({client.module for client in _clients}):
+        started = time.perf_counter()
+        importlib.import_module(module)
+        log.info("AI SDK preloaded", extra={"module": module, "ms": round((time.perf_counter() - started) * 1000, 1)})
+
+
+class OpenAIClient:
+    """One OpenAI client (and its HTTP connection pool) for the whole process"""
+
+    name = "openai"
+
+    module = "openai"
+
+    def __init__(self, api_key, model="gpt-4", base_url=None, vision_model="gpt-4o-mini"):
+        _require(self.module)
+        self.model = model
+        self.vision_model = vision_model
+        self._api_key = api_key
+        self._base_url = base_url
+        self._calls = None  # (create, acreate), built on first use
+        self._lock = threading.Lock()
+        _clients.append(self)
+
+    def _connect(self):
+        with self._lock:
+            if self._calls is not None:
+                return self._calls
+            import openai
+            if hasattr(openai, "OpenAI"):
+                client = openai.OpenAI(api_key=self._api_key, base_url=self._base_url)
+                # Separate pooled client for the asyncio serving mode
+                async_client = openai.AsyncOpenAI(api_key=self._api_key, base_url=self._base_url)
+                self._calls = (client.chat.completions.create, async_client.chat.completions.create)
+            else:
+                # openai<1.0 module-level API
+                openai.api_key = self._api_key
+                if self._base_url:
+                    openai.api_base = self._base_url
+                self._calls = (openai.ChatCompletion.create, openai.ChatCompletion.acreate)
+            log.info("OpenAI client created")
+            return self._calls
+
+    @property
+    def _create(self):
+        return (self._calls or self._connect())[0]
+
+    @property
+    def _acreate(self):
+        return (self._calls or self._connect())[1]
+
+    def prepare(self, messages):
+        """(model, messages) for the API; messages with an image use the vision model"""
+        if not any("image" in msg for msg in messages):
+            return self.model, messages
+
+        prepared = []
+        for msg in messages:
+            image = msg.get("image")
+            if image is None:
+                prepared.append(msg)
+                continue
+            data = base64.b64encode(image["data"]).decode("ascii")
+            prepared.append({"role": msg["role"], "content": [
+                {"type": "text", "text": msg["content"]},
+                {"type": "image_url", "image_url": {"url": f"data:{image['mime_type']};base64,{data}"}},
+            ]})
+        return self.vision_model, prepared
+
+    def complete(self, messages):
+        model, messages = self.prepare(messages)
+        response = self._create(
+            model=model,
+            messages=messages,
+            temperature=TEMPERATURE,
+            max_tokens=MAX_OUTPUT_TOKENS
+        )
+        return response.choices[0].message.content
+
+    async def acomplete(self, messages):
+        model, messages = self.prepare(messages)
+        response = await self._acreate(
+            model=model,
+            messages=messages,
+            temperature=TEMPERATURE,
+            max_tokens=MAX_OUTPUT_TOKENS
+        )
+        return response.choices[0].message.content
+
+    def stream(self, messages):
+        """Yield the answer as it is generated"""
+        model, messages = self.prepare(messages)
+        response = self._create(
+            model=model,
+            messages=messages,
+            temperature=TEMPERATURE,
+            max_tokens=MAX_OUTPUT_TOKENS,
+            stream=True
+        )
+        for chunk in response:
+            if chunk.choices:
+                text = getattr(chunk.choices[0].delta, "content", None)
+                if text:
+                    yield text
+
+
+class GeminiClient:
+    """Gemini models built once per system prompt, fed structured contents"""
+
+    name = "gemini"
+
+    module = "google.generativeai"
+
+    def __init__(self, api_key, model="gemini-2.0-flash-exp", context_cache=False,
+                 context_cache_ttl=3600, api_endpoint=None, clock=time.monotonic):
+        _require(self.module)
+        self._api_key = api_key
+        self._api_endpoint = api_endpoint
+        self._genai_module = None  # configured on first use
+        self.model = model
+        self.context_cache = context_cache
+        self.context_cache_ttl = context_cache_ttl
+        self._clock = clock  # for cached content expiry; injectable in tests
+        self._models = {}  # system prompt -> GeminiModel
+        self._lock = threading.RLock()
+        self._generation_config = {
+            "temperature": TEMPERATURE,
+            "max_output_tokens": MAX_OUTPUT_TOKENS,
+        }
+        _clients.append(self)
+
+    @property
+    def _genai(self):
+        if self._genai_module is None:
+            with self._lock:
+                if self._genai_module is None:
+                    import google.generativeai as genai
+                    if self._api_endpoint:
+                        # The REST transport accepts plain http:// hosts (local fakes)
+                        genai.configure(api_key=self._api_key, transport="rest",
+                                        client_options={"api_endpoint": self._api_endpoint})
+                    else:
+                        genai.configure(api_key=self._api_key)
+                    log.info("Gemini client configured")
+                    self._genai_module = genai
+        return self._genai_module
+
+    def _usable(self, entry):
+        return entry is not None and (entry.expires is None or entry.expires > self._clock())
+
+    def _model_for(self, system_prompt):
+        entry = self._models.get(system_prompt)
+        if self._usable(entry):
+            return entry.model
+
+        with self._lock:
+            entry = self._models.get(system_prompt)
+            if not self._usable(entry):
+                entry = self._models[system_prompt] = self._build_model(system_prompt)
+            return entry.model
+
+    def _build_model(self, system_prompt):
+        if self.context_cache:
+            try:
+                cached = self._genai.caching.CachedContent.create(
+                    model=self.model,
+                    system_instruction=system_prompt,
+                    ttl=datetime.timedelta(seconds=self.context_cache_ttl)
+                )
+                log.info("Gemini system prompt stored as cached content")
+                model = self._genai.GenerativeModel.from_cached_content(
+                    cached, generation_config=self._generation_config
+                )
+                margin = min(CONTEXT_CACHE_REFRESH_MARGIN, self.context_cache_ttl / 10)
+                return GeminiModel(model, self._clock() + self.context_cache_ttl - margin, True)
+            except Exception as e:
+                log.warning("Gemini context caching unavailable, sending prompt inline", extra={"error": str(e)})
+
+        return GeminiModel(self._inline_model(system_prompt), None, False)
+
+    def _inline_model(self, system_prompt):
+        return self._genai.GenerativeModel(
+            self.model,
+            system_instruction=system_prompt,
+            generation_config=self._generation_config
+        )
+
+    def _replacement(self, system_prompt, model, error):
+        """Inline model to retry with when model's cached content is gone, else None"""
+        if getattr(error, "code", None) != 404 and type(error).__name__ != "NotFound":
+            return None
+
+        with self._lock:
+            entry = self._models.get(system_prompt)
+            if entry is not None and entry.model is model:
+                if not entry.cached:
+                    return None
+                log.warning("Gemini cached content not found, sending prompt inline", extra={"error": str(error)})
+                # Caching is tried again once the old entry would have expired
+                entry = self._models[system_prompt] = GeminiModel(
+                    self._inline_model(system_prompt), entry.expires, False
+                )
+            return entry.model if entry is not None else None
+
+    @staticmethod
+    def to_contents(messages):
+        """Chat messages -> Gemini contents (extra system notes become user context)"""
+        contents = []
+        for msg in messages[1:]:  # messages[0] is the system instruction
+            role = "model" if msg["role"] == "assistant" else "user"
+            text = msg["content"]
+            if msg["role"] == "system":
+                text = f"[Context] {text}"
+            parts = [text]
+            if "image" in msg:
+                parts.append({"mime_type": msg["image"]["mime_type"], "data": msg["image"]["data"]})
+            if contents and contents[-1]["role"] == role:
+                # Gemini expects alternating turns; merge consecutive ones
+                contents[-1]["parts"].extend(parts)
+            else:
+                contents.append({"role": role, "parts": parts})
+        return contents
+
+    def complete(self, messages):
+        system_prompt = messages[0]["content"]
+        model = self._model_for(system_prompt)
+        contents = self.to_contents(messages)
+        try:
+            response = model.generate_content(contents)
+        except Exception as e:
+            model = self._replacement(system_prompt, model, e)
+            if model is None:
+                raise
+            response = model.generate_content(contents)
+        return response.text
+
+    async def acomplete(self, messages):
+        system_prompt = messages[0]["content"]
+        model = self._model_for(system_prompt)
+        contents = self.to_contents(messages)
+        try:
+            response = await model.generate_content_async(contents)
+        except Exception as e:
+            model = self._replacement(system_prompt, model, e)
+            if model is None:
+                raise
+            response = await model.generate_content_async(contents)
+        return response.text
+
+    def stream(self, messages):
+        """Yield the answer as it is generated"""
+        system_prompt = messages[0]["content"]
+        model = self._model_for(system_prompt)
+        contents = self.to_contents(messages)
+        started = False
+        try:
+            for chunk in model.generate_content(contents, stream=True):
+                if chunk.text:
+                    started = True
+                    yield chunk.text
+        except Exception as e:
+            model = None if started else self._replacement(system_prompt, model, e)
+            if model is None:
+                raise
+            for chunk in model.generate_content(contents, stream=True):
+                if chunk.text:
+                    yield chunk.text
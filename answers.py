@@ -0,0 +1,84 @@
+"""
+TaxGuard AI - Steps of an AI answer shared by every serving mode
+
+The Flask apps (app.py, app_cloud_api.py) and the asyncio serving mode
+(asgi.py) answer a question the same way; only the provider call in the
+middle differs (blocking or awaited):
+
+1. prepare() loads the history, picks the reply language, serves repeated
+   opening questions from the response cache and builds the prompt
+2. the provider call
+3. finish() records tokens, caches the answer and saves both turns, or
+   fail() saves the question alone and returns the apology
+
+prepare(), finish() and fail() read and write the session store and the
+response cache (SQLite or Redis), so the asyncio mode runs them with
+asyncio.to_thread() instead of on the event loop.
+"""
+
+import time
+from collections import namedtuple
+
+from language import conversation_language
+from metrics import record_ai_tokens
+from session_store import Turn
+
+NOT_CONFIGURED_MESSAGE = "معذرت / Sorry, AI service is not configured. Please contact administrator."
+ERROR_MESSAGE = "معذرت / Sorry, I'm experiencing technical difficulties. Please try again. Error: {}"
+
+# An answer between prepare() and finish(); cached is set when it came from
+# the response cache and there is nothing left to do
+PendingAnswer = namedtuple(
+    "PendingAnswer", "user_id question user_turn language messages cacheable cached started"
+)
+
+
+class AnswerSteps:
+    """Session, cache and prompt handling around one provider call"""
+
+    def __init__(self, sessions, response_cache, system_prompts, history_windows, cache_enabled=True):
+        self.sessions = sessions
+        self.response_cache = response_cache
+        self.system_prompts = system_prompts  # language -> system prompt
+        self.history_windows = history_windows  # provider -> HistoryWindow
+        self.cache_enabled = cache_enabled
+
+    def prepare(self, user_message, user_id, provider):
+        """PendingAnswer for user_message, with the messages to send to provider"""
+        # Load history once; both turns are saved together after the reply
+        user_turn = Turn("user", user_message)
+        history = self.sessions.history(user_id)
+
+        # Reply language, detected locally (saved by local_reply)
+        language = conversation_language(self.sessions, user_id, user_message, remember=False)
+
+        # Serve repeated opening questions from the cache
+        cacheable = self.cache_enabled and self.response_cache.cacheable(user_message, history)
+        if cacheable:
+            cached = self.response_cache.get(user_message, variant=language)
+            if cached is not None:
+                self.sessions.extend(user_id, [user_turn, ("assistant", cached)])
+                return PendingAnswer(user_id, user_message, user_turn, language, None, False, cached, None)
+
+        messages = self.sessions.messages(
+            user_id, user_turn, window=self.history_windows[provider], history=history,
+            system_prompt=self.system_prompts[language]
+        )
+        return PendingAnswer(user_id, user_message, user_turn, language, messages, cacheable, None,
+                             time.perf_counter())
+
+    def finish(self, pending, provider, answer):
+        """Record and save the provider's answer; returns it"""
+        record_ai_tokens(provider, pending.messages, answer)
+        if pending.cacheable:
+            self.response_cache.put(pending.question, answer, time.perf_counter() - pending.started,
+                                    variant=pending.language)
+
+        # Add AI response to history
+        self.sessions.extend(pending.user_id, [pending.user_turn, ("assistant", answer)])
+        return answer
+
+    def fail(self, pending, error):
+        """Save the unanswered question; returns the apology for the user"""
+        self.sessions.extend(pending.user_id, [pending.user_turn])
+        return ERROR_MESSAGE.format(error)
@@ -10,18 +10,41 @@ TWILIO_ACCOUNT_SID=your_account_sid
 TWILIO_AUTH_TOKEN=your_auth_token
 OPENAI_API_KEY=your_openai_key (optional - use either this or Gemini)
 GEMINI_API_KEY=your_gemini_key (optional - use either this or OpenAI)
+TWILIO_REPLY_MODE=sync or async (optional - async replies via the REST API)
 """
 
-from flask import Flask, request
+from flask import Flask, Response, request, jsonify
 from twilio.twiml.messaging_response import MessagingResponse
-from twilio.rest import Client
 import os
 from dotenv import load_dotenv
 import json
+import logging
+import threading
+import time
+
+from ai_clients import GeminiClient, OpenAIClient
+from answers import NOT_CONFIGURED_MESSAGE, AnswerSteps
+from dedup import MessageDeduplicator
+from dispatcher import WebhookDispatcher
+from history import HistoryWindow
+from intents import IntentRouter
+from language import DEFAULT_LANGUAGE, LANGUAGES, PROMPT_INSTRUCTIONS, conversation_language, localized
+from metrics import CONTENT_TYPE, REGISTRY, record_send
+from provider_router import ProviderRouter
+from rate_limit import AdmissionControl
+from response_cache import ResponseCache, prompt_version
+from session_store import create_session_store
+from structured_log import log_stats, setup_logging
+from tax_engine import TAX_TABLES, TAX_YEAR, bracket_prompt_text, calculate_tax_batch
+from tax_query import format_tax_reply, parse_tax_query
 
 # Load environment variables
 load_dotenv()
 
+# Structured logs, written off the request path
+setup_logging()
+log = logging.getLogger(__name__)
+
 app = Flask(__name__)
 
 # Configuration
@@ -29,41 +52,160 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
-
-# Determine which AI provider to use
-AI_PROVIDER = None
-genai = None
+TWILIO_WHATSAPP_NUMBER = os.getenv('TWILIO_WHATSAPP_NUMBER')
+
+# Reply mode: "sync" answers in the TwiML response, "async" returns right away
+# and sends the AI answer later through the Twilio REST API
+TWILIO_REPLY_MODE = os.getenv('TWILIO_REPLY_MODE', 'sync').lower()
+TWILIO_ACK_MESSAGE = os.getenv('TWILIO_ACK_MESSAGE', '')
+TWILIO_WORKERS = int(os.getenv('TWILIO_WORKERS', '4'))
+TWILIO_QUEUE_SIZE = int(os.getenv('TWILIO_QUEUE_SIZE', '500'))
+TWILIO_MAX_PER_SENDER = int(os.getenv('TWILIO_MAX_PER_SENDER', '50'))
+TWILIO_HTTP_TIMEOUT = float(os.getenv('TWILIO_HTTP_TIMEOUT', '10'))
+TWILIO_API_BASE_URL = os.getenv('TWILIO_API_BASE_URL')  # e.g. the bench/ fake server
+
+# Largest payroll accepted by /api/tax/batch in one call
+TAX_BATCH_MAX = int(os.getenv('TAX_BATCH_MAX', '100000'))
+# Largest income accepted per row (Rs. 1 trillion); also rejects NaN and inf
+TAX_BATCH_MAX_INCOME = 10 ** 12
+
+# Conversation memory limits
+SESSION_MAX_USERS = int(os.getenv('SESSION_MAX_USERS', '10000'))
+SESSION_IDLE_TTL = int(os.getenv('SESSION_IDLE_TTL', '86400'))
+SESSION_MAX_MB = float(os.getenv('SESSION_MAX_MB', '64'))
+SESSION_MAX_TURNS = int(os.getenv('SESSION_MAX_TURNS', '20'))
+
+# Tokens of conversation history sent with each request, per provider
+HISTORY_TOKEN_BUDGET_OPENAI = int(os.getenv('HISTORY_TOKEN_BUDGET_OPENAI', '2500'))
+HISTORY_TOKEN_BUDGET_GEMINI = int(os.getenv('HISTORY_TOKEN_BUDGET_GEMINI', '6000'))
+HISTORY_SUMMARY = os.getenv('HISTORY_SUMMARY', 'false').lower() == 'true'
+
+# Cached answers for FAQ-style questions
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '2000'))
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '21600'))
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH')
+
+# Redelivered webhooks are dropped by MessageSid
+DEDUP_TTL_SECONDS = int(os.getenv('DEDUP_TTL_SECONDS', '86400'))
+DEDUP_MAX_IDS = int(os.getenv('DEDUP_MAX_IDS', '100000'))
+DEDUP_REDIS_URL = os.getenv('DEDUP_REDIS_URL')
+
+# AI requests allowed per sender (per minute) and overall (per second); with
+# more than RATE_LIMIT_SHED_DEPTH messages queued or in flight, questions are
+# answered from cached/static replies instead of the AI
+RATE_LIMIT_PER_SENDER = float(os.getenv('RATE_LIMIT_PER_SENDER', '10'))
+RATE_LIMIT_SENDER_BURST = int(os.getenv('RATE_LIMIT_SENDER_BURST', '5'))
+RATE_LIMIT_GLOBAL = float(os.getenv('RATE_LIMIT_GLOBAL', '10'))
+RATE_LIMIT_GLOBAL_BURST = int(os.getenv('RATE_LIMIT_GLOBAL_BURST', '20'))
+RATE_LIMIT_SHED_DEPTH = int(os.getenv('RATE_LIMIT_SHED_DEPTH', '100'))
+
+# Models (created once and reused for every request)
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash-exp')
+GEMINI_CONTEXT_CACHE = os.getenv('GEMINI_CONTEXT_CACHE', 'false').lower() == 'true'
+GEMINI_CONTEXT_CACHE_TTL = int(os.getenv('GEMINI_CONTEXT_CACHE_TTL', '3600'))
+
+# Alternative API hosts (e.g. the local fakes in bench/); unset = the real APIs
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')
+GEMINI_API_ENDPOINT = os.getenv('GEMINI_API_ENDPOINT')
+
+# Failover, hedging and circuit breaking between AI providers
+AI_HEDGE_ENABLED = os.getenv('AI_HEDGE_ENABLED', 'true').lower() == 'true'
+AI_HEDGE_BUDGET = float(os.getenv('AI_HEDGE_BUDGET', '0.1'))
+AI_HEDGE_MIN_DELAY = float(os.getenv('AI_HEDGE_MIN_DELAY', '1.5'))
+AI_HEDGE_DEFAULT_DELAY = float(os.getenv('AI_HEDGE_DEFAULT_DELAY', '6'))
+AI_BREAKER_FAILURES = int(os.getenv('AI_BREAKER_FAILURES', '5'))
+AI_BREAKER_COOLDOWN = float(os.getenv('AI_BREAKER_COOLDOWN', '30'))
+AI_REQUEST_TIMEOUT = float(os.getenv('AI_REQUEST_TIMEOUT', '60'))
+
+# Determine which AI providers to use (the first one is the primary,
+# the others are used for failover and hedged requests)
+AI_PROVIDERS = []
+ai_clients = {}
 
 if OPENAI_API_KEY:
     try:
-        import openai
-        openai.api_key = OPENAI_API_KEY
-        AI_PROVIDER = "openai"
-        print("🤖 Using OpenAI API")
+        ai_clients["openai"] = OpenAIClient(OPENAI_API_KEY, model=OPENAI_MODEL, base_url=OPENAI_BASE_URL)
+        AI_PROVIDERS.append("openai")
+        log.info("Using OpenAI API")
     except ImportError:
-        print("⚠️ Warning: openai package not installed. Run: pip3 install openai")
+        log.warning("openai package not installed. Run: pip3 install openai")
 
-if not AI_PROVIDER and GEMINI_API_KEY:
+if GEMINI_API_KEY:
     try:
-        import google.generativeai as genai
-        genai.configure(api_key=GEMINI_API_KEY)
-        AI_PROVIDER = "gemini"
-        print("🤖 Using Google Gemini API")
+        ai_clients["gemini"] = GeminiClient(
+            GEMINI_API_KEY,
+            model=GEMINI_MODEL,
+            context_cache=GEMINI_CONTEXT_CACHE,
+            context_cache_ttl=GEMINI_CONTEXT_CACHE_TTL,
+            api_endpoint=GEMINI_API_ENDPOINT
+        )
+        AI_PROVIDERS.append("gemini")
+        log.info("Using Google Gemini API")
     except ImportError:
-        print("⚠️ Warning: google-generativeai package not installed. Run: pip3 install google-generativeai")
-
-if not AI_PROVIDER:
-    print("⚠️ Warning: No AI API key configured or packages missing. Please set OPENAI_API_KEY or GEMINI_API_KEY and install required packages.")
-
-# Initialize Twilio client
-twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+        log.warning("google-generativeai package not installed. Run: pip3 install google-generativeai")
 
-# User conversation history (in production, use database)
-user_sessions = {}
+AI_PROVIDER = AI_PROVIDERS[0] if AI_PROVIDERS else None
 
-# System prompt for TaxGuard AI
-SYSTEM_PROMPT = """You are TaxGuard AI, Pakistan's intelligent tax compliance assistant. You help Pakistani citizens with:
-1. Tax filing guidance in Urdu and English
+if not AI_PROVIDER:
+    log.warning("No AI API key configured or packages missing. Please set OPENAI_API_KEY or GEMINI_API_KEY and install required packages.")
+
+# Twilio REST client (keep-alive connection pool, bounded timeouts), created
+# on the first outbound message: sync replies travel in the TwiML response
+# and never need it
+twilio_client = None
+_twilio_client_lock = threading.Lock()
+
+
+def get_twilio_client():
+    global twilio_client
+    if twilio_client is None:
+        with _twilio_client_lock:
+            if twilio_client is None:
+                from twilio.http.http_client import TwilioHttpClient
+                from twilio.rest import Client
+                client = Client(
+                    TWILIO_ACCOUNT_SID,
+                    TWILIO_AUTH_TOKEN,
+                    http_client=TwilioHttpClient(pool_connections=True, timeout=TWILIO_HTTP_TIMEOUT)
+                )
+                if TWILIO_API_BASE_URL:
+                    client.api.base_url = TWILIO_API_BASE_URL.rstrip('/')
+                twilio_client = client
+    return twilio_client
+
+
+# Sender-sharded workers for AI answers: each sender's messages are answered
+# one at a time, in order (also collects per-stage latency)
+dispatcher = WebhookDispatcher(
+    name="twilio",
+    workers=TWILIO_WORKERS,
+    max_queue=TWILIO_QUEUE_SIZE,
+    max_per_sender=TWILIO_MAX_PER_SENDER
+)
+dispatcher.start()
+
+# Per-sender and global AI rate limits, load shedding on deep queues
+admission_control = AdmissionControl(
+    per_sender_rate=RATE_LIMIT_PER_SENDER / 60,
+    per_sender_burst=RATE_LIMIT_SENDER_BURST,
+    global_rate=RATE_LIMIT_GLOBAL,
+    global_burst=RATE_LIMIT_GLOBAL_BURST,
+    shed_depth=RATE_LIMIT_SHED_DEPTH,
+    depth_fn=dispatcher.depth
+)
+
+# Recently seen MessageSids (Twilio retries on slow responses)
+deduplicator = MessageDeduplicator(
+    ttl=DEDUP_TTL_SECONDS,
+    max_size=DEDUP_MAX_IDS,
+    redis_url=DEDUP_REDIS_URL
+)
+
+# System prompt for TaxGuard AI; one variant per reply language
+SYSTEM_PROMPT_TEMPLATE = """You are TaxGuard AI, Pakistan's intelligent tax compliance assistant. You help Pakistani citizens with:
+1. Tax filing guidance
 2. Tax calculations based on Pakistani tax laws
 3. Deduction recommendations
 4. Answering FBR-related questions
@@ -71,7 +213,7 @@ SYSTEM_PROMPT = """You are TaxGuard AI, Pakistan's intelligent tax compliance as
 
 Guidelines:
 - Be helpful, friendly, and professional
-- Support both Urdu and English (detect language automatically)
+- {language_instruction}
 - Provide specific guidance for Pakistani tax system
 - Keep responses concise for WhatsApp (under 1500 characters)
 - Use simple language, avoid jargon
@@ -79,13 +221,7 @@ Guidelines:
 - Suggest legitimate deductions based on profession
 - If asked about receipts/documents, explain you can process them via photo upload
 
-Pakistani Tax Brackets 2024-25:
-- Up to Rs. 600,000: 0%
-- Rs. 600,001 to 1,200,000: 5%
-- Rs. 1,200,001 to 2,400,000: 15%
-- Rs. 2,400,001 to 3,600,000: 25%
-- Rs. 3,600,001 to 6,000,000: 30%
-- Above Rs. 6,000,000: 35%
+{brackets}
 
 Common deductions:
 - Zakat/charitable donations (up to 30% of taxable income)
@@ -95,158 +231,312 @@ Common deductions:
 - Life insurance premiums
 """
 
+SYSTEM_PROMPTS = {
+    language: SYSTEM_PROMPT_TEMPLATE.format(
+        language_instruction=PROMPT_INSTRUCTIONS[language],
+        brackets=bracket_prompt_text(TAX_YEAR)
+    )
+    for language in LANGUAGES
+}
+SYSTEM_PROMPT = SYSTEM_PROMPTS[DEFAULT_LANGUAGE]
+
+# Replies used when AI requests are limited or shed, per template language
+RATE_LIMITED_MESSAGE = {
+    "en": "⏳ You're sending messages faster than I can answer. Please wait a minute and ask again.",
+    "ur": "⏳ آپ بہت تیزی سے پیغامات بھیج رہے ہیں۔ براہ کرم ایک منٹ انتظار کریں اور دوبارہ پوچھیں۔",
+}
+
+BUSY_MESSAGE = {
+    "en": """⏳ TaxGuard AI is very busy right now. Please ask again in a few minutes.
+
+Meanwhile, send your monthly income, profession and city for an instant tax calculation.
+Example: "Monthly income 80000, software engineer, Islamabad\"""",
+    "ur": """⏳ ہم اس وقت مصروف ہیں، براہ کرم کچھ دیر بعد دوبارہ پوچھیں۔
+
+اس دوران فوری ٹیکس حساب کے لیے اپنی ماہانہ آمدن، پیشہ اور شہر بھیجیں۔
+مثال: "ماہانہ آمدن 80000، سافٹ ویئر انجینئر، اسلام آباد\"""",
+}
+
+# Reply to empty or very short messages
+INCOMPLETE_MESSAGE = {
+    "en": "Please send a complete message.",
+    "ur": "براہ کرم مکمل پیغام بھیجیں۔",
+}
+
+# Greetings, calculation prompt and common FBR questions answered locally
+intent_router = IntentRouter(year=TAX_YEAR)
+
+# User conversation history (memory, SQLite or Redis - see SESSION_BACKEND)
+user_sessions = create_session_store(
+    SYSTEM_PROMPT,
+    max_sessions=SESSION_MAX_USERS,
+    idle_ttl=SESSION_IDLE_TTL,
+    max_bytes=int(SESSION_MAX_MB * 1024 * 1024),
+    max_turns=SESSION_MAX_TURNS
+)
+
+# Answers to repeated questions; the key includes the prompt version and language
+response_cache = ResponseCache(
+    prompt_version(*SYSTEM_PROMPTS.values()),
+    max_entries=RESPONSE_CACHE_SIZE,
+    ttl=RESPONSE_CACHE_TTL,
+    path=RESPONSE_CACHE_PATH
+)
+
+# Newest turns that fit each provider's history budget go into the prompt
+history_windows = {
+    "openai": HistoryWindow(HISTORY_TOKEN_BUDGET_OPENAI, summarize=HISTORY_SUMMARY),
+    "gemini": HistoryWindow(HISTORY_TOKEN_BUDGET_GEMINI, summarize=HISTORY_SUMMARY)
+}
+
+# History, language, response cache and prompt around each provider call
+answer_steps = AnswerSteps(
+    user_sessions, response_cache, SYSTEM_PROMPTS, history_windows, cache_enabled=RESPONSE_CACHE_ENABLED
+)
+
+# Gauges read when /metrics is scraped
+REGISTRY.callback("taxguard_queue_depth", "Messages waiting for a worker", dispatcher.depth)
+REGISTRY.callback("taxguard_sessions", "Stored conversations", lambda: user_sessions.stats().get("sessions"))
+REGISTRY.callback(
+    "taxguard_admission_total", "AI requests by admission result",
+    lambda: {result: admission_control.stats()[result] for result in ("admitted", "limited", "shed")},
+    labelnames=("result",), kind="counter"
+)
+REGISTRY.callback(
+    "taxguard_response_cache_total", "Response cache lookups by result",
+    lambda: {result: response_cache.stats()[key] for result, key in (("hit", "hits"), ("miss", "misses"))},
+    labelnames=("result",), kind="counter"
+)
+
+# Provider clients used by the router, in AI_PROVIDERS order
+
+ai_router = ProviderRouter(
+    [(name, ai_clients[name].complete) for name in AI_PROVIDERS],
+    hedge=AI_HEDGE_ENABLED,
+    hedge_budget=AI_HEDGE_BUDGET,
+    hedge_min_delay=AI_HEDGE_MIN_DELAY,
+    hedge_default_delay=AI_HEDGE_DEFAULT_DELAY,
+    failure_threshold=AI_BREAKER_FAILURES,
+    cooldown=AI_BREAKER_COOLDOWN,
+    timeout=AI_REQUEST_TIMEOUT
+)
+
 def get_ai_response(user_message, user_id):
     """Get response from AI provider (OpenAI or Gemini)"""
 
     if AI_PROVIDER is None:
-        return "معذرت / Sorry, AI service is not configured. Please contact administrator."
-
-    # Initialize or retrieve conversation history
-    if user_id not in user_sessions:
-        user_sessions[user_id] = [
-            {"role": "system", "content": SYSTEM_PROMPT}
-        ]
-
-    # Add user message to history
-    user_sessions[user_id].append({"role": "user", "content": user_message})
+        return NOT_CONFIGURED_MESSAGE
 
-    # Keep only last 10 messages to manage token limits
-    if len(user_sessions[user_id]) > 11:  # 1 system + 10 messages
-        user_sessions[user_id] = [user_sessions[user_id][0]] + user_sessions[user_id][-10:]
+    pending = answer_steps.prepare(user_message, user_id, AI_PROVIDER)
+    if pending.cached is not None:
+        return pending.cached
 
     try:
-        if AI_PROVIDER == "openai":
-            # Call OpenAI API
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=user_sessions[user_id],
-                temperature=0.7,
-                max_tokens=500
-            )
-            ai_message = response.choices[0].message.content
-
-        elif AI_PROVIDER == "gemini":
-            # Call Gemini API (using the latest model name)
-            model = genai.GenerativeModel('gemini-2.0-flash-exp')
-
-            # Convert message history to Gemini format
-            # Combine system prompt with conversation history
-            conversation_text = SYSTEM_PROMPT + "\n\n"
-            for msg in user_sessions[user_id][1:]:  # Skip system message
-                if msg["role"] == "user":
-                    conversation_text += f"User: {msg['content']}\n"
-                elif msg["role"] == "assistant":
-                    conversation_text += f"Assistant: {msg['content']}\n"
-
-            # Generate response
-            response = model.generate_content(conversation_text)
-            ai_message = response.text
-
-        # Add AI response to history
-        user_sessions[user_id].append({"role": "assistant", "content": ai_message})
-
-        return ai_message
+        # Primary provider, with failover/hedging to the others
+        provider, ai_message = ai_router.complete(pending.messages)
+        return answer_steps.finish(pending, provider, ai_message)
 
     except Exception as e:
-        return f"معذرت / Sorry, I'm experiencing technical difficulties. Please try again. Error: {str(e)}"
-
-def calculate_tax(annual_income):
-    """Calculate Pakistani income tax"""
-    tax = 0
-
-    if annual_income <= 600000:
-        tax = 0
-    elif annual_income <= 1200000:
-        tax = (annual_income - 600000) * 0.05
-    elif annual_income <= 2400000:
-        tax = 30000 + (annual_income - 1200000) * 0.15
-    elif annual_income <= 3600000:
-        tax = 210000 + (annual_income - 2400000) * 0.25
-    elif annual_income <= 6000000:
-        tax = 510000 + (annual_income - 3600000) * 0.30
-    else:
-        tax = 1230000 + (annual_income - 6000000) * 0.35
+        return answer_steps.fail(pending, e)
 
-    return round(tax, 2)
+def local_reply(incoming_msg, sender_number):
+    """Reply that needs no AI call, or None if the message should go to the AI"""
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    """Handle incoming WhatsApp messages"""
-
-    # Get incoming message details
-    incoming_msg = request.values.get('Body', '').strip()
-    sender_number = request.values.get('From', '')
-
-    # Create response object
-    resp = MessagingResponse()
-    msg = resp.message()
+    # Income/profession/city details can be answered without the AI
+    tax_query = parse_tax_query(incoming_msg)
 
-    # Log incoming message
-    print(f"📩 Received from {sender_number}: {incoming_msg}")
+    # Reply language, detected locally and remembered for short follow-ups
+    language = conversation_language(user_sessions, sender_number, incoming_msg)
 
-    # Handle welcome message
-    if incoming_msg.lower() in ['start', 'شروع', 'hello', 'hi', 'السلام علیکم']:
-        welcome_text = """🇵🇰 *TaxGuard AI - خوش آمدید*
+    # Greetings, calculation prompt, filer status, NTN, deadlines...
+    intent = intent_router.match(incoming_msg, language)
 
-Welcome to Pakistan's intelligent tax assistant!
+    # Handle welcome and other whole-message replies
+    if intent and intent.exact:
+        return intent.reply
 
-I can help you with:
-✅ Tax calculations / ٹیکس کا حساب
-✅ Filing guidance / فائلنگ کی رہنمائی
-✅ Deduction tips / کٹوتیوں کی تجاویز
-✅ FBR questions / ایف بی آر کے سوالات
+    # Answer tax calculations with income details locally, without the AI
+    if tax_query:
+        response_text = f"{format_tax_reply(tax_query, language)}\n\n_- TaxGuard AI 🤖_"
+        user_sessions.extend(sender_number, [("user", incoming_msg), ("assistant", response_text)])
+        return response_text
 
-Try asking:
-• "Mera tax calculate karo" (میرا ٹیکس)
-• "How do I file tax return?"
-• "What deductions can I claim?"
+    # Handle tax calculation requests and common FBR questions
+    if intent:
+        return intent.reply
 
-*Type your question in Urdu or English!* 🤖"""
+    # Handle empty or very short messages
+    if len(incoming_msg) < 3:
+        return localized(INCOMPLETE_MESSAGE, language)
+
+    # Over the sender's or the global AI rate, or too much work queued:
+    # answer from cached/static replies so latency stays low for everyone
+    admission = admission_control.check(sender_number)
+    if admission != "ok":
+        log.info("AI request not admitted", extra={"sender": sender_number, "admission": admission})
+        return shed_response(incoming_msg, admission, language, user_sessions.history(sender_number))
+
+    return None
+
+def shed_response(user_message, reason, language=DEFAULT_LANGUAGE, history=()):
+    """Reply without the AI when the sender is limited or the bot is overloaded"""
+    if reason == "limited":
+        return localized(RATE_LIMITED_MESSAGE, language)
+
+    # A cached answer is still better than a slow one
+    if RESPONSE_CACHE_ENABLED and response_cache.cacheable(user_message, history):
+        cached = response_cache.get(user_message, variant=language)
+        if cached is not None:
+            return f"{cached}\n\n_- TaxGuard AI 🤖_"
+    return localized(BUSY_MESSAGE, language)
+
+def send_twilio_message(recipient_number, message_text, from_number=None):
+    """Send a WhatsApp message through the Twilio REST API"""
+    started = time.perf_counter()
+    try:
+        get_twilio_client().messages.create(
+            from_=from_number or TWILIO_WHATSAPP_NUMBER,
+            to=recipient_number,
+            body=message_text
+        )
+        record_send("twilio", True, time.perf_counter() - started)
+        log.info("Message sent", extra={"recipient": recipient_number})
+        return True
+    except Exception as e:
+        record_send("twilio", False, time.perf_counter() - started)
+        log.error("Exception while sending message", extra={"recipient": recipient_number, "error": str(e)})
+        return False
 
-        msg.body(welcome_text)
+def answer_with_ai(incoming_msg, sender_number):
+    """AI answer with signature (runs on the sender's dispatcher shard)"""
+    with dispatcher.timed("ai_response"), admission_control.track():
+        ai_response = get_ai_response(incoming_msg, sender_number)
 
-    # Handle tax calculation requests
-    elif any(keyword in incoming_msg.lower() for keyword in ['calculate', 'حساب', 'tax kitna', 'کتنا ٹیکس']):
-        calculation_prompt = """💰 *Tax Calculation*
+    # Add TaxGuard AI signature
+    return f"{ai_response}\n\n_- TaxGuard AI 🤖_"
 
-Please provide:
-1️⃣ Your monthly salary (e.g., "50000")
-2️⃣ Your profession (e.g., "software engineer")
-3️⃣ Your city (e.g., "Karachi")
+def reply_with_ai(incoming_msg, sender_number, from_number):
+    """Get the AI answer and send it as a separate message (async mode)"""
+    response_text = answer_with_ai(incoming_msg, sender_number)
+    with dispatcher.timed("send"):
+        send_twilio_message(sender_number, response_text, from_number)
+    log.info("Response sent", extra={"sender": sender_number, "chars": len(response_text)})
 
-Example: "Monthly income 80000, software engineer, Islamabad"
+@app.route('/webhook', methods=['POST'])
+def webhook():
+    """Handle incoming WhatsApp messages"""
 
-براہ کرم بتائیں:
-ماہانہ تنخواہ، پیشہ، شہر"""
+    # Get incoming message details
+    received_at = time.perf_counter()
+    incoming_msg = request.values.get('Body', '').strip()
+    sender_number = request.values.get('From', '')
+    message_sid = request.values.get('MessageSid', '')
 
-        msg.body(calculation_prompt)
+    # Ignore Twilio retries of a message we already answered
+    if deduplicator.seen(message_sid):
+        log.info("Duplicate message ignored", extra={"message_sid": message_sid})
+        return str(MessagingResponse())
 
-    # Handle empty or very short messages
-    elif len(incoming_msg) < 3:
-        msg.body("Please send a complete message. / براہ کرم مکمل پیغام بھیجیں۔")
+    # Create response object
+    resp = MessagingResponse()
+    msg = resp.message()
 
-    # Handle all other queries with AI
+    # Log incoming message (the text itself only at DEBUG, redacted)
+    log.info("Message received", extra={"sender": sender_number, "chars": len(incoming_msg)})
+    log.debug("Message text", extra={"sender": sender_number, "text": incoming_msg})
+
+    # Greetings, tax calculations, FBR questions and shed load need no AI
+    with dispatcher.timed("local_reply"):
+        local_text = local_reply(incoming_msg, sender_number)
+    if local_text is not None:
+        msg.body(local_text)
+
+    # Async mode: acknowledge now, answer through the REST API when ready
+    elif TWILIO_REPLY_MODE == 'async' and dispatcher.submit(
+            sender_number, reply_with_ai, incoming_msg, sender_number, request.values.get('To')):
+        ack = MessagingResponse()
+        if TWILIO_ACK_MESSAGE:
+            ack.message(TWILIO_ACK_MESSAGE)
+        dispatcher.record("ack", time.perf_counter() - received_at)
+        return str(ack)
+
+    # Handle all other queries with AI, after the sender's earlier messages
     else:
-        # Get AI response
-        ai_response = get_ai_response(incoming_msg, sender_number)
-
-        # Add TaxGuard AI signature
-        response_text = f"{ai_response}\n\n_- TaxGuard AI 🤖_"
+        future = dispatcher.call(sender_number, answer_with_ai, incoming_msg, sender_number)
+        if future is not None:
+            response_text = future.result()
+        else:
+            language = conversation_language(user_sessions, sender_number, incoming_msg, remember=False)
+            response_text = localized(BUSY_MESSAGE, language)
 
         msg.body(response_text)
-        print(f"📤 Sent response: {response_text[:100]}...")
+        log.info("Response sent", extra={"sender": sender_number, "chars": len(response_text)})
 
     return str(resp)
 
+@app.route('/api/tax/batch', methods=['POST'])
+def tax_batch():
+    """Calculate income tax for many employees in one call
+
+    Body: {"incomes": [960000, 2500000, ...], "period": "annual" or "monthly",
+           "year": "2024-25" (optional)}
+    """
+    data = request.get_json(silent=True) or {}
+    incomes = data.get('incomes')
+    period = data.get('period', 'annual')
+    year = data.get('year') or TAX_YEAR
+
+    if not isinstance(incomes, list) or not incomes:
+        return jsonify({"error": "incomes must be a non-empty list of numbers"}), 400
+    if len(incomes) > TAX_BATCH_MAX:
+        return jsonify({"error": f"at most {TAX_BATCH_MAX} incomes per request"}), 400
+    if period not in ('annual', 'monthly'):
+        return jsonify({"error": "period must be 'annual' or 'monthly'"}), 400
+    if not isinstance(year, str) or year not in TAX_TABLES:
+        return jsonify({"error": f"unknown tax year: {year!r} (one of {', '.join(TAX_TABLES)})"}), 400
+    for i, income in enumerate(incomes):
+        if isinstance(income, bool) or not isinstance(income, (int, float)):
+            return jsonify({"error": f"incomes[{i}] must be a number"}), 400
+        # Comparisons are exact even for huge ints, and false for NaN
+        if not 0 <= income <= TAX_BATCH_MAX_INCOME:
+            return jsonify({"error": f"incomes[{i}] must be between 0 and {TAX_BATCH_MAX_INCOME}"}), 400
+
+    if period == 'monthly':
+        incomes = [income * 12 for income in incomes]
+    taxes = calculate_tax_batch(incomes, year)
+
+    return jsonify({
+        "year": year,
+        "period": period,
+        "count": len(taxes),
+        "annual_tax": taxes,
+        "total_annual_tax": round(sum(taxes), 2)
+    })
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
     return {
         "status": "healthy",
         "service": "TaxGuard AI WhatsApp Bot",
-        "ai_provider": AI_PROVIDER or "not_configured"
+        "ai_provider": AI_PROVIDER or "not_configured",
+        "ai_providers": AI_PROVIDERS,
+        "ai_router": ai_router.stats(),
+        "dedup": deduplicator.stats(),
+        "sessions": user_sessions.stats(),
+        "response_cache": response_cache.stats(),
+        "intents": intent_router.stats(),
+        "admission": admission_control.stats(),
+        "logging": log_stats(),
+        "reply_mode": TWILIO_REPLY_MODE,
+        "dispatcher": dispatcher.stats()
     }
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics (per-stage latency, providers, tokens, sends, queues)"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 @app.route('/', methods=['GET'])
 def home():
     """Home page with setup instructions"""
@@ -269,7 +559,7 @@ def home():
 
         <h3>Features:</h3>
         <ul>
-            <li>✅ Bilingual support (Urdu & English)</li>
+            <li>✅ Replies in English, Urdu or Roman Urdu</li>
             <li>✅ Tax calculations</li>
             <li>✅ Filing guidance</li>
             <li>✅ Deduction recommendations</li>
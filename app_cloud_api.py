@@ -11,17 +11,42 @@ META_PHONE_NUMBER_ID=your_phone_number_id
 META_WEBHOOK_VERIFY_TOKEN=your_webhook_verify_token (create your own secret)
 OPENAI_API_KEY=your_openai_key (optional - use either this or Gemini)
 GEMINI_API_KEY=your_gemini_key (optional - use either this or OpenAI)
+WEBHOOK_DISPATCH_MODE=inline or background (optional - see dispatcher.py)
 """
 
-from flask import Flask, request, jsonify
-import requests
+from flask import Flask, Response, request, jsonify
+from concurrent.futures import wait
 import os
 from dotenv import load_dotenv
-import json
+import logging
+import time
+
+from ai_clients import GeminiClient, OpenAIClient
+from answers import NOT_CONFIGURED_MESSAGE, AnswerSteps
+from dedup import MessageDeduplicator
+from history import HistoryWindow
+from intents import IntentRouter
+from language import DEFAULT_LANGUAGE, LANGUAGES, PROMPT_INSTRUCTIONS, conversation_language, localized
+from media import MediaError, MediaPipeline
+from metrics import CONTENT_TYPE, REGISTRY, record_ai_tokens
+from provider_router import ProviderRouter
+from rate_limit import AdmissionControl
+from response_cache import ResponseCache, prompt_version
+from session_store import create_session_store
+from streaming import ParagraphChunker
+from structured_log import log_payload, log_stats, setup_logging
+from tax_engine import TAX_TABLES, TAX_YEAR, bracket_prompt_text, calculate_tax_batch
+from tax_query import format_tax_reply, parse_tax_query
+from dispatcher import WebhookDispatcher
+from whatsapp_sender import WhatsAppSender
 
 # Load environment variables
 load_dotenv()
 
+# Structured logs, written off the request path
+setup_logging()
+log = logging.getLogger(__name__)
+
 app = Flask(__name__)
 
 # Configuration
@@ -31,41 +56,190 @@ META_ACCESS_TOKEN = os.getenv('META_ACCESS_TOKEN')
 META_PHONE_NUMBER_ID = os.getenv('META_PHONE_NUMBER_ID')
 META_WEBHOOK_VERIFY_TOKEN = os.getenv('META_WEBHOOK_VERIFY_TOKEN', 'taxguard_secret_token_123')
 META_API_VERSION = os.getenv('META_API_VERSION', 'v21.0')
+META_GRAPH_URL = os.getenv('META_GRAPH_URL', 'https://graph.facebook.com').rstrip('/')
+
+# Webhook dispatch: "inline" processes inside the request, "background" acks
+# Meta immediately and processes on a worker pool
+WEBHOOK_DISPATCH_MODE = os.getenv('WEBHOOK_DISPATCH_MODE', 'inline').lower()
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '500'))
+WEBHOOK_MAX_PER_SENDER = int(os.getenv('WEBHOOK_MAX_PER_SENDER', '50'))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', '25'))
+
+# Stream AI answers and send complete paragraphs as they arrive
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'false').lower() == 'true'
+STREAM_MIN_CHARS = int(os.getenv('STREAM_MIN_CHARS', '300'))
+
+# Largest payroll accepted by /api/tax/batch in one call
+TAX_BATCH_MAX = int(os.getenv('TAX_BATCH_MAX', '100000'))
+# Largest income accepted per row (Rs. 1 trillion); also rejects NaN and inf
+TAX_BATCH_MAX_INCOME = 10 ** 12
+
+# Conversation memory limits
+SESSION_MAX_USERS = int(os.getenv('SESSION_MAX_USERS', '10000'))
+SESSION_IDLE_TTL = int(os.getenv('SESSION_IDLE_TTL', '86400'))
+SESSION_MAX_MB = float(os.getenv('SESSION_MAX_MB', '64'))
+SESSION_MAX_TURNS = int(os.getenv('SESSION_MAX_TURNS', '20'))
+
+# Tokens of conversation history sent with each request, per provider
+HISTORY_TOKEN_BUDGET_OPENAI = int(os.getenv('HISTORY_TOKEN_BUDGET_OPENAI', '2500'))
+HISTORY_TOKEN_BUDGET_GEMINI = int(os.getenv('HISTORY_TOKEN_BUDGET_GEMINI', '6000'))
+HISTORY_SUMMARY = os.getenv('HISTORY_SUMMARY', 'false').lower() == 'true'
+
+# Cached answers for FAQ-style questions
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '2000'))
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '21600'))
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH')
+
+# Redelivered webhooks are dropped by message ID
+DEDUP_TTL_SECONDS = int(os.getenv('DEDUP_TTL_SECONDS', '86400'))
+DEDUP_MAX_IDS = int(os.getenv('DEDUP_MAX_IDS', '100000'))
+DEDUP_REDIS_URL = os.getenv('DEDUP_REDIS_URL')
+
+# AI requests allowed per sender (per minute) and overall (per second); with
+# more than RATE_LIMIT_SHED_DEPTH messages queued or in flight, questions are
+# answered from cached/static replies instead of the AI
+RATE_LIMIT_PER_SENDER = float(os.getenv('RATE_LIMIT_PER_SENDER', '10'))
+RATE_LIMIT_SENDER_BURST = int(os.getenv('RATE_LIMIT_SENDER_BURST', '5'))
+RATE_LIMIT_GLOBAL = float(os.getenv('RATE_LIMIT_GLOBAL', '10'))
+RATE_LIMIT_GLOBAL_BURST = int(os.getenv('RATE_LIMIT_GLOBAL_BURST', '20'))
+RATE_LIMIT_SHED_DEPTH = int(os.getenv('RATE_LIMIT_SHED_DEPTH', '100'))
 
 # WhatsApp Cloud API endpoint
-WHATSAPP_API_URL = f"https://graph.facebook.com/{META_API_VERSION}/{META_PHONE_NUMBER_ID}/messages"
-
-# Determine which AI provider to use
-AI_PROVIDER = None
-genai = None
+WHATSAPP_API_URL = f"{META_GRAPH_URL}/{META_API_VERSION}/{META_PHONE_NUMBER_ID}/messages"
+
+# Outbound Graph API connection pool, timeouts, retries and pacing
+WHATSAPP_POOL_SIZE = int(os.getenv('WHATSAPP_POOL_SIZE', '10'))
+WHATSAPP_CONNECT_TIMEOUT = float(os.getenv('WHATSAPP_CONNECT_TIMEOUT', '3.05'))
+WHATSAPP_READ_TIMEOUT = float(os.getenv('WHATSAPP_READ_TIMEOUT', '10'))
+WHATSAPP_MAX_RETRIES = int(os.getenv('WHATSAPP_MAX_RETRIES', '3'))
+WHATSAPP_RATE_LIMIT = float(os.getenv('WHATSAPP_RATE_LIMIT', '80'))
+WHATSAPP_SEND_WORKERS = int(os.getenv('WHATSAPP_SEND_WORKERS', '4'))
+
+# Receipt/document photos (see media.py)
+MEDIA_ENABLED = os.getenv('MEDIA_ENABLED', 'true').lower() == 'true'
+MEDIA_MAX_BYTES = int(os.getenv('MEDIA_MAX_BYTES', str(10 * 1024 * 1024)))
+MEDIA_MAX_DIMENSION = int(os.getenv('MEDIA_MAX_DIMENSION', '1600'))
+MEDIA_JPEG_QUALITY = int(os.getenv('MEDIA_JPEG_QUALITY', '80'))
+MEDIA_WORKERS = int(os.getenv('MEDIA_WORKERS', '2'))
+MEDIA_CACHE_SIZE = int(os.getenv('MEDIA_CACHE_SIZE', '1000'))
+MEDIA_TEMP_DIR = os.getenv('MEDIA_TEMP_DIR') or None
+
+# Models (created once and reused for every request)
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4')
+OPENAI_VISION_MODEL = os.getenv('OPENAI_VISION_MODEL', 'gpt-4o-mini')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash-exp')
+GEMINI_CONTEXT_CACHE = os.getenv('GEMINI_CONTEXT_CACHE', 'false').lower() == 'true'
+GEMINI_CONTEXT_CACHE_TTL = int(os.getenv('GEMINI_CONTEXT_CACHE_TTL', '3600'))
+
+# Alternative API hosts (e.g. the local fakes in bench/); unset = the real APIs
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')
+GEMINI_API_ENDPOINT = os.getenv('GEMINI_API_ENDPOINT')
+
+# Failover, hedging and circuit breaking between AI providers
+AI_HEDGE_ENABLED = os.getenv('AI_HEDGE_ENABLED', 'true').lower() == 'true'
+AI_HEDGE_BUDGET = float(os.getenv('AI_HEDGE_BUDGET', '0.1'))
+AI_HEDGE_MIN_DELAY = float(os.getenv('AI_HEDGE_MIN_DELAY', '1.5'))
+AI_HEDGE_DEFAULT_DELAY = float(os.getenv('AI_HEDGE_DEFAULT_DELAY', '6'))
+AI_BREAKER_FAILURES = int(os.getenv('AI_BREAKER_FAILURES', '5'))
+AI_BREAKER_COOLDOWN = float(os.getenv('AI_BREAKER_COOLDOWN', '30'))
+AI_REQUEST_TIMEOUT = float(os.getenv('AI_REQUEST_TIMEOUT', '60'))
+
+# Determine which AI providers to use (the first one is the primary,
+# the others are used for failover and hedged requests)
+AI_PROVIDERS = []
+ai_clients = {}
 
 if OPENAI_API_KEY:
     try:
-        import openai
-        openai.api_key = OPENAI_API_KEY
-        AI_PROVIDER = "openai"
-        print("🤖 Using OpenAI API")
+        ai_clients["openai"] = OpenAIClient(
+            OPENAI_API_KEY, model=OPENAI_MODEL, base_url=OPENAI_BASE_URL, vision_model=OPENAI_VISION_MODEL
+        )
+        AI_PROVIDERS.append("openai")
+        log.info("Using OpenAI API")
     except ImportError:
-        print("⚠️ Warning: openai package not installed. Run: pip3 install openai")
+        log.warning("openai package not installed. Run: pip3 install openai")
 
-if not AI_PROVIDER and GEMINI_API_KEY:
+if GEMINI_API_KEY:
     try:
-        import google.generativeai as genai
-        genai.configure(api_key=GEMINI_API_KEY)
-        AI_PROVIDER = "gemini"
-        print("🤖 Using Google Gemini API")
+        ai_clients["gemini"] = GeminiClient(
+            GEMINI_API_KEY,
+            model=GEMINI_MODEL,
+            context_cache=GEMINI_CONTEXT_CACHE,
+            context_cache_ttl=GEMINI_CONTEXT_CACHE_TTL,
+            api_endpoint=GEMINI_API_ENDPOINT
+        )
+        AI_PROVIDERS.append("gemini")
+        log.info("Using Google Gemini API")
     except ImportError:
-        print("⚠️ Warning: google-generativeai package not installed. Run: pip3 install google-generativeai")
-
-if not AI_PROVIDER:
-    print("⚠️ Warning: No AI API key configured or packages missing. Please set OPENAI_API_KEY or GEMINI_API_KEY and install required packages.")
+        log.warning("google-generativeai package not installed. Run: pip3 install google-generativeai")
 
-# User conversation history (in production, use database)
-user_sessions = {}
+AI_PROVIDER = AI_PROVIDERS[0] if AI_PROVIDERS else None
 
-# System prompt for TaxGuard AI
-SYSTEM_PROMPT = """You are TaxGuard AI, Pakistan's intelligent tax compliance assistant. You help Pakistani citizens with:
-1. Tax filing guidance in Urdu and English
+if not AI_PROVIDER:
+    log.warning("No AI API key configured or packages missing. Please set OPENAI_API_KEY or GEMINI_API_KEY and install required packages.")
+
+# Shared keep-alive sender for all replies
+whatsapp_sender = WhatsAppSender(
+    WHATSAPP_API_URL,
+    META_ACCESS_TOKEN,
+    phone_number_id=META_PHONE_NUMBER_ID,
+    pool_size=WHATSAPP_POOL_SIZE,
+    connect_timeout=WHATSAPP_CONNECT_TIMEOUT,
+    read_timeout=WHATSAPP_READ_TIMEOUT,
+    max_retries=WHATSAPP_MAX_RETRIES,
+    rate_per_second=WHATSAPP_RATE_LIMIT,
+    send_workers=WHATSAPP_SEND_WORKERS
+)
+
+# Receipt photos: streamed download, downscaling in worker processes,
+# answers cached by content hash
+media_pipeline = MediaPipeline(
+    META_GRAPH_URL,
+    META_ACCESS_TOKEN,
+    api_version=META_API_VERSION,
+    max_bytes=MEDIA_MAX_BYTES,
+    max_dimension=MEDIA_MAX_DIMENSION,
+    jpeg_quality=MEDIA_JPEG_QUALITY,
+    workers=MEDIA_WORKERS,
+    cache_size=MEDIA_CACHE_SIZE,
+    temp_dir=MEDIA_TEMP_DIR,
+    connect_timeout=WHATSAPP_CONNECT_TIMEOUT,
+    read_timeout=AI_REQUEST_TIMEOUT
+)
+
+# Recently seen message IDs (Meta redelivers on slow acks)
+deduplicator = MessageDeduplicator(
+    ttl=DEDUP_TTL_SECONDS,
+    max_size=DEDUP_MAX_IDS,
+    redis_url=DEDUP_REDIS_URL
+)
+
+# Sender-sharded workers: each sender's messages run one at a time, in order
+# (also collects per-stage latency)
+dispatcher = WebhookDispatcher(
+    name="cloud-api",
+    workers=WEBHOOK_WORKERS,
+    max_queue=WEBHOOK_QUEUE_SIZE,
+    max_per_sender=WEBHOOK_MAX_PER_SENDER,
+    drain_timeout=WEBHOOK_DRAIN_TIMEOUT
+)
+dispatcher.start()
+
+# Per-sender and global AI rate limits, load shedding on deep queues
+admission_control = AdmissionControl(
+    per_sender_rate=RATE_LIMIT_PER_SENDER / 60,
+    per_sender_burst=RATE_LIMIT_SENDER_BURST,
+    global_rate=RATE_LIMIT_GLOBAL,
+    global_burst=RATE_LIMIT_GLOBAL_BURST,
+    shed_depth=RATE_LIMIT_SHED_DEPTH,
+    depth_fn=dispatcher.depth
+)
+
+# System prompt for TaxGuard AI; one variant per reply language
+SYSTEM_PROMPT_TEMPLATE = """You are TaxGuard AI, Pakistan's intelligent tax compliance assistant. You help Pakistani citizens with:
+1. Tax filing guidance
 2. Tax calculations based on Pakistani tax laws
 3. Deduction recommendations
 4. Answering FBR-related questions
@@ -73,7 +247,7 @@ SYSTEM_PROMPT = """You are TaxGuard AI, Pakistan's intelligent tax compliance as
 
 Guidelines:
 - Be helpful, friendly, and professional
-- Support both Urdu and English (detect language automatically)
+- {language_instruction}
 - Provide specific guidance for Pakistani tax system
 - Keep responses concise for WhatsApp (under 1500 characters)
 - Use simple language, avoid jargon
@@ -81,13 +255,7 @@ Guidelines:
 - Suggest legitimate deductions based on profession
 - If asked about receipts/documents, explain you can process them via photo upload
 
-Pakistani Tax Brackets 2024-25:
-- Up to Rs. 600,000: 0%
-- Rs. 600,001 to 1,200,000: 5%
-- Rs. 1,200,001 to 2,400,000: 15%
-- Rs. 2,400,001 to 3,600,000: 25%
-- Rs. 3,600,001 to 6,000,000: 30%
-- Above Rs. 6,000,000: 35%
+{brackets}
 
 Common deductions:
 - Zakat/charitable donations (up to 30% of taxable income)
@@ -97,170 +265,399 @@ Common deductions:
 - Life insurance premiums
 """
 
+SYSTEM_PROMPTS = {
+    language: SYSTEM_PROMPT_TEMPLATE.format(
+        language_instruction=PROMPT_INSTRUCTIONS[language],
+        brackets=bracket_prompt_text(TAX_YEAR)
+    )
+    for language in LANGUAGES
+}
+SYSTEM_PROMPT = SYSTEM_PROMPTS[DEFAULT_LANGUAGE]
+
+# Replies used when AI requests are limited or shed, per template language
+RATE_LIMITED_MESSAGE = {
+    "en": "⏳ You're sending messages faster than I can answer. Please wait a minute and ask again.",
+    "ur": "⏳ آپ بہت تیزی سے پیغامات بھیج رہے ہیں۔ براہ کرم ایک منٹ انتظار کریں اور دوبارہ پوچھیں۔",
+}
+
+BUSY_MESSAGE = {
+    "en": """⏳ TaxGuard AI is very busy right now. Please ask again in a few minutes.
+
+Meanwhile, send your monthly income, profession and city for an instant tax calculation.
+Example: "Monthly income 80000, software engineer, Islamabad\"""",
+    "ur": """⏳ ہم اس وقت مصروف ہیں، براہ کرم کچھ دیر بعد دوبارہ پوچھیں۔
+
+اس دوران فوری ٹیکس حساب کے لیے اپنی ماہانہ آمدن، پیشہ اور شہر بھیجیں۔
+مثال: "ماہانہ آمدن 80000، سافٹ ویئر انجینئر، اسلام آباد\"""",
+}
+
+# Reply to empty or very short messages
+INCOMPLETE_MESSAGE = {
+    "en": "Please send a complete message.",
+    "ur": "براہ کرم مکمل پیغام بھیجیں۔",
+}
+
+# Instruction sent with a receipt/document photo
+RECEIPT_PROMPT = """This is a photo of a receipt or tax document. Reply with:
+1. What the document is (e.g. salary slip, utility bill, bank certificate, Zakat or donation receipt)
+2. The date, the amounts and any tax withheld or paid that you can read
+3. How it matters for the user's income tax return (withholding tax credit, deductible allowance, Zakat or donation deduction), or that it does not
+
+If the photo is unreadable or not a tax document, say so briefly and ask for a clearer photo."""
+
+# Greetings, calculation prompt and common FBR questions answered locally
+intent_router = IntentRouter(year=TAX_YEAR)
+
+# User conversation history (memory, SQLite or Redis - see SESSION_BACKEND)
+user_sessions = create_session_store(
+    SYSTEM_PROMPT,
+    max_sessions=SESSION_MAX_USERS,
+    idle_ttl=SESSION_IDLE_TTL,
+    max_bytes=int(SESSION_MAX_MB * 1024 * 1024),
+    max_turns=SESSION_MAX_TURNS
+)
+
+# Answers to repeated questions; the key includes the prompt version and language
+response_cache = ResponseCache(
+    prompt_version(*SYSTEM_PROMPTS.values()),
+    max_entries=RESPONSE_CACHE_SIZE,
+    ttl=RESPONSE_CACHE_TTL,
+    path=RESPONSE_CACHE_PATH
+)
+
+# Newest turns that fit each provider's history budget go into the prompt
+history_windows = {
+    "openai": HistoryWindow(HISTORY_TOKEN_BUDGET_OPENAI, summarize=HISTORY_SUMMARY),
+    "gemini": HistoryWindow(HISTORY_TOKEN_BUDGET_GEMINI, summarize=HISTORY_SUMMARY)
+}
+
+# History, language, response cache and prompt around each provider call
+answer_steps = AnswerSteps(
+    user_sessions, response_cache, SYSTEM_PROMPTS, history_windows, cache_enabled=RESPONSE_CACHE_ENABLED
+)
+
+# Gauges read when /metrics is scraped
+REGISTRY.callback("taxguard_queue_depth", "Messages waiting for a worker", dispatcher.depth)
+REGISTRY.callback("taxguard_sessions", "Stored conversations", lambda: user_sessions.stats().get("sessions"))
+REGISTRY.callback(
+    "taxguard_admission_total", "AI requests by admission result",
+    lambda: {result: admission_control.stats()[result] for result in ("admitted", "limited", "shed")},
+    labelnames=("result",), kind="counter"
+)
+REGISTRY.callback(
+    "taxguard_response_cache_total", "Response cache lookups by result",
+    lambda: {result: response_cache.stats()[key] for result, key in (("hit", "hits"), ("miss", "misses"))},
+    labelnames=("result",), kind="counter"
+)
+
 def send_whatsapp_message(recipient_phone, message_text):
-    """Send message using WhatsApp Cloud API"""
+    """Send message using WhatsApp Cloud API (waits for the result)"""
 
     if not META_ACCESS_TOKEN or not META_PHONE_NUMBER_ID:
-        print("⚠️ Error: WhatsApp Cloud API credentials not configured")
+        log.error("WhatsApp Cloud API credentials not configured")
         return False
 
-    headers = {
-        "Authorization": f"Bearer {META_ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
+    return whatsapp_sender.send_text(recipient_phone, message_text)
 
-    payload = {
-        "messaging_product": "whatsapp",
-        "recipient_type": "individual",
-        "to": recipient_phone,
-        "type": "text",
-        "text": {
-            "preview_url": False,
-            "body": message_text
-        }
-    }
+def submit_whatsapp_message(recipient_phone, message_text):
+    """Queue message for background delivery (per-recipient order is kept)"""
+
+    if not META_ACCESS_TOKEN or not META_PHONE_NUMBER_ID:
+        log.error("WhatsApp Cloud API credentials not configured")
+        return None
+
+    return whatsapp_sender.submit(recipient_phone, message_text)
+
+# Provider clients used by the router, in AI_PROVIDERS order
+
+ai_router = ProviderRouter(
+    [(name, ai_clients[name].complete) for name in AI_PROVIDERS],
+    hedge=AI_HEDGE_ENABLED,
+    hedge_budget=AI_HEDGE_BUDGET,
+    hedge_min_delay=AI_HEDGE_MIN_DELAY,
+    hedge_default_delay=AI_HEDGE_DEFAULT_DELAY,
+    failure_threshold=AI_BREAKER_FAILURES,
+    cooldown=AI_BREAKER_COOLDOWN,
+    timeout=AI_REQUEST_TIMEOUT
+)
+
+def stream_ai_response(messages, on_chunk):
+    """Stream an answer, passing each ready paragraph to on_chunk(text, is_last)
+
+    Streams from the first healthy provider. If it fails before anything
+    was sent, the request falls back to the router (failover/hedging).
+    """
+    chunker = ParagraphChunker(min_chars=STREAM_MIN_CHARS)
+    provider = ai_router.first_available()
+    parts = []
+    sent = False
+    started = time.perf_counter()
 
     try:
-        response = requests.post(WHATSAPP_API_URL, headers=headers, json=payload)
+        for text in ai_clients[provider].stream(messages):
+            parts.append(text)
+            for chunk in chunker.feed(text):
+                on_chunk(chunk, False)
+                sent = True
+        ai_router.record(provider, True, time.perf_counter() - started)
 
-        if response.status_code == 200:
-            print(f"✅ Message sent successfully to {recipient_phone}")
-            return True
+    except Exception as e:
+        ai_router.record(provider, False, time.perf_counter() - started)
+        if not sent:
+            provider, ai_message = ai_router.complete(messages)
+            chunker = ParagraphChunker(min_chars=STREAM_MIN_CHARS)
+            parts = [ai_message]
+            for chunk in chunker.feed(ai_message):
+                on_chunk(chunk, False)
         else:
-            print(f"❌ Error sending message: {response.status_code}")
-            print(f"Response: {response.text}")
-            return False
+            # Part of the answer is already with the user; close it off
+            log.error("Stream failed midway", extra={"provider": provider, "error": str(e)})
+            for chunk in chunker.feed("\n\n_(Answer interrupted. Please ask again for the rest.)_"):
+                on_chunk(chunk, False)
 
-    except Exception as e:
-        print(f"❌ Exception while sending message: {str(e)}")
-        return False
+    chunks = chunker.flush()
+    for i, chunk in enumerate(chunks):
+        on_chunk(chunk, i == len(chunks) - 1)
 
-def get_ai_response(user_message, user_id):
-    """Get response from AI provider (OpenAI or Gemini)"""
+    return provider, "".join(parts)
+
+def get_ai_response(user_message, user_id, on_chunk=None):
+    """Get response from AI provider (OpenAI or Gemini)
+
+    With on_chunk the answer is streamed and delivered paragraph by
+    paragraph through on_chunk(text, is_last) instead of all at once.
+    """
 
     if AI_PROVIDER is None:
-        return "معذرت / Sorry, AI service is not configured. Please contact administrator."
+        return NOT_CONFIGURED_MESSAGE
 
-    # Initialize or retrieve conversation history
-    if user_id not in user_sessions:
-        user_sessions[user_id] = [
-            {"role": "system", "content": SYSTEM_PROMPT}
-        ]
+    pending = answer_steps.prepare(user_message, user_id, AI_PROVIDER)
+    if pending.cached is not None:
+        return pending.cached
 
-    # Add user message to history
-    user_sessions[user_id].append({"role": "user", "content": user_message})
+    try:
+        if on_chunk is not None:
+            # Paragraphs go out while the rest is still being generated
+            provider, ai_message = stream_ai_response(pending.messages, on_chunk)
+        else:
+            # Primary provider, with failover/hedging to the others
+            provider, ai_message = ai_router.complete(pending.messages)
+        return answer_steps.finish(pending, provider, ai_message)
 
-    # Keep only last 10 messages to manage token limits
-    if len(user_sessions[user_id]) > 11:  # 1 system + 10 messages
-        user_sessions[user_id] = [user_sessions[user_id][0]] + user_sessions[user_id][-10:]
+    except Exception as e:
+        return answer_steps.fail(pending, e)
+
+def shed_response(user_message, reason, language=DEFAULT_LANGUAGE, history=()):
+    """Reply without the AI when the sender is limited or the bot is overloaded"""
+    if reason == "limited":
+        return localized(RATE_LIMITED_MESSAGE, language)
+
+    # A cached answer is still better than a slow one
+    if RESPONSE_CACHE_ENABLED and response_cache.cacheable(user_message, history):
+        cached = response_cache.get(user_message, variant=language)
+        if cached is not None:
+            return f"{cached}\n\n_- TaxGuard AI 🤖_"
+    return localized(BUSY_MESSAGE, language)
+
+def extract_receipt(data, mime_type, caption, language=DEFAULT_LANGUAGE):
+    """Vision answer for a prepared receipt photo"""
+    prompt = RECEIPT_PROMPT
+    if caption:
+        prompt = f"{prompt}\n\nThe user wrote: {caption}"
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPTS[language]},
+        {"role": "user", "content": prompt, "image": {"mime_type": mime_type, "data": data}}
+    ]
+    provider, answer = ai_router.complete(messages)
+    record_ai_tokens(provider, messages, answer)
+    return answer
+
+def media_reply(message, sender_phone):
+    """Reply to an image or document message (a receipt or tax document)"""
+    media = message.get(message['type']) or {}
+    caption = (media.get('caption') or '').strip()
+    log.info("Media received", extra={"sender": sender_phone, "media_type": message['type'],
+                                       "mime_type": media.get('mime_type')})
+
+    if not MEDIA_ENABLED or AI_PROVIDER is None:
+        return "Sorry, I can only process text messages at the moment."
+
+    # The caption, if any, decides the reply language
+    language = conversation_language(user_sessions, sender_phone, caption)
+
+    # Reading a photo costs a (vision) AI call like any other question
+    admission = admission_control.check(sender_phone)
+    if admission != "ok":
+        return localized(RATE_LIMITED_MESSAGE if admission == "limited" else BUSY_MESSAGE, language)
 
     try:
-        if AI_PROVIDER == "openai":
-            # Call OpenAI API
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=user_sessions[user_id],
-                temperature=0.7,
-                max_tokens=500
+        with dispatcher.timed("media"), admission_control.track():
+            answer = media_pipeline.process(
+                media.get('id'), lambda data, mime_type: extract_receipt(data, mime_type, caption, language),
+                variant=(caption, language)
             )
-            ai_message = response.choices[0].message.content
+    except MediaError as e:
+        return str(e)
+    except Exception:
+        log.exception("Error reading media")
+        return "معذرت / Sorry, I couldn't read that file. Please try again or type your question."
+
+    user_sessions.extend(sender_phone, [
+        ("user", f"[Sent a receipt photo] {caption}".strip()),
+        ("assistant", answer)
+    ])
+    return f"{answer}\n\n_- TaxGuard AI 🤖_"
+
+def iter_webhook_messages(message_data):
+    """Yield every message in a webhook delivery (all entries and changes)"""
+    if message_data.get('object') != 'whatsapp_business_account':
+        return
+
+    for entry in message_data.get('entry') or []:
+        for change in entry.get('changes') or []:
+            if change.get('field') != 'messages':
+                continue
+            for message in (change.get('value') or {}).get('messages') or []:
+                yield message
+
+def group_messages_by_sender(messages):
+    """Group messages by sender, keeping each sender's messages in arrival order"""
+    groups = {}
+    for message in messages:
+        groups.setdefault(message.get('from'), []).append(message)
+    return groups
+
+def process_sender_messages(messages):
+    """Process one sender's messages strictly in order"""
+    for message in messages:
+        handle_whatsapp_message(message)
 
-        elif AI_PROVIDER == "gemini":
-            # Call Gemini API
-            model = genai.GenerativeModel('gemini-2.0-flash-exp')
-
-            # Convert message history to Gemini format
-            conversation_text = SYSTEM_PROMPT + "\n\n"
-            for msg in user_sessions[user_id][1:]:  # Skip system message
-                if msg["role"] == "user":
-                    conversation_text += f"User: {msg['content']}\n"
-                elif msg["role"] == "assistant":
-                    conversation_text += f"Assistant: {msg['content']}\n"
+def process_whatsapp_message(message_data):
+    """Process every message in a webhook delivery, one sender per thread
 
-            # Generate response
-            response = model.generate_content(conversation_text)
-            ai_message = response.text
+    Returns the messages that were not processed because the queue was full.
+    """
+    return process_message_groups(group_messages_by_sender(iter_webhook_messages(message_data)))
 
-        # Add AI response to history
-        user_sessions[user_id].append({"role": "assistant", "content": ai_message})
+def process_message_groups(groups):
+    """Process sender groups on their shards and wait; each sender stays in order
 
-        return ai_message
+    Returns the messages of senders whose queue was full. They are not
+    processed here: run on this thread they could overtake the sender's
+    messages still queued on the shard.
+    """
+    futures = []
+    rejected = []
+    for sender, messages in groups.items():
+        future = dispatcher.call(sender, process_sender_messages, messages)
+        if future is None:
+            rejected.extend(messages)
+        else:
+            futures.append(future)
+    wait(futures)
+    return rejected
 
-    except Exception as e:
-        return f"معذرت / Sorry, I'm experiencing technical difficulties. Please try again. Error: {str(e)}"
+def local_reply(incoming_msg, sender_phone):
+    """Reply that needs no AI call, or None if the message should go to the AI"""
 
-def process_whatsapp_message(message_data):
-    """Process incoming WhatsApp message"""
+    # Income/profession/city details can be answered without the AI
+    tax_query = parse_tax_query(incoming_msg)
 
-    try:
-        # Extract message details
-        message = message_data['entry'][0]['changes'][0]['value']['messages'][0]
-        sender_phone = message['from']
-        message_type = message['type']
+    # Reply language, detected locally and remembered for short follow-ups
+    language = conversation_language(user_sessions, sender_phone, incoming_msg)
 
-        # Only handle text messages for now
-        if message_type != 'text':
-            send_whatsapp_message(sender_phone, "Sorry, I can only process text messages at the moment.")
-            return
+    # Greetings, calculation prompt, filer status, NTN, deadlines...
+    intent = intent_router.match(incoming_msg, language)
 
-        incoming_msg = message['text']['body'].strip()
+    # Handle welcome and other whole-message replies
+    if intent and intent.exact:
+        return intent.reply
 
-        # Log incoming message
-        print(f"📩 Received from {sender_phone}: {incoming_msg}")
+    # Answer tax calculations with income details locally, without the AI
+    if tax_query:
+        response_text = f"{format_tax_reply(tax_query, language)}\n\n_- TaxGuard AI 🤖_"
+        user_sessions.extend(sender_phone, [("user", incoming_msg), ("assistant", response_text)])
+        return response_text
 
-        # Generate response based on message content
-        response_text = None
+    # Handle tax calculation requests and common FBR questions
+    if intent:
+        return intent.reply
 
-        # Handle welcome message
-        if incoming_msg.lower() in ['start', 'شروع', 'hello', 'hi', 'السلام علیکم']:
-            response_text = """🇵🇰 *TaxGuard AI - خوش آمدید*
+    # Handle empty or very short messages
+    if len(incoming_msg) < 3:
+        return localized(INCOMPLETE_MESSAGE, language)
 
-Welcome to Pakistan's intelligent tax assistant!
+    # Over the sender's or the global AI rate, or too much work queued:
+    # answer from cached/static replies so latency stays low for everyone
+    admission = admission_control.check(sender_phone)
+    if admission != "ok":
+        log.info("AI request not admitted", extra={"sender": sender_phone, "admission": admission})
+        return shed_response(incoming_msg, admission, language, user_sessions.history(sender_phone))
 
-I can help you with:
-✅ Tax calculations / ٹیکس کا حساب
-✅ Filing guidance / فائلنگ کی رہنمائی
-✅ Deduction tips / کٹوتیوں کی تجاویز
-✅ FBR questions / ایف بی آر کے سوالات
+    return None
 
-Try asking:
-• "Mera tax calculate karo" (میرا ٹیکس)
-• "How do I file tax return?"
-• "What deductions can I claim?"
+def handle_whatsapp_message(message):
+    """Process a single incoming WhatsApp message"""
 
-*Type your question in Urdu or English!* 🤖"""
+    try:
+        # Extract message details
+        sender_phone = message['from']
+        message_type = message['type']
 
-        # Handle tax calculation requests
-        elif any(keyword in incoming_msg.lower() for keyword in ['calculate', 'حساب', 'tax kitna', 'کتنا ٹیکس']):
-            response_text = """💰 *Tax Calculation*
+        # Receipts and tax documents sent as photos
+        if message_type in ('image', 'document'):
+            response_text = media_reply(message, sender_phone)
+            with dispatcher.timed("send_enqueue"):
+                submit_whatsapp_message(sender_phone, response_text)
+            return
 
-Please provide:
-1️⃣ Your monthly salary (e.g., "50000")
-2️⃣ Your profession (e.g., "software engineer")
-3️⃣ Your city (e.g., "Karachi")
+        # Other media (audio, stickers, locations, ...) is not supported
+        if message_type != 'text':
+            send_whatsapp_message(sender_phone, "Sorry, I can only process text messages at the moment.")
+            return
 
-Example: "Monthly income 80000, software engineer, Islamabad"
+        incoming_msg = message['text']['body'].strip()
 
-براہ کرم بتائیں:
-ماہانہ تنخواہ، پیشہ، شہر"""
+        # Log incoming message (the text itself only at DEBUG, redacted)
+        log.info("Message received", extra={"sender": sender_phone, "chars": len(incoming_msg)})
+        log.debug("Message text", extra={"sender": sender_phone, "text": incoming_msg})
 
-        # Handle empty or very short messages
-        elif len(incoming_msg) < 3:
-            response_text = "Please send a complete message. / براہ کرم مکمل پیغام بھیجیں۔"
+        # Generate response based on message content
+        with dispatcher.timed("local_reply"):
+            response_text = local_reply(incoming_msg, sender_phone)
 
         # Handle all other queries with AI
-        else:
-            # Get AI response
-            ai_response = get_ai_response(incoming_msg, sender_phone)
-            response_text = f"{ai_response}\n\n_- TaxGuard AI 🤖_"
+        if response_text is None:
+            delivered = []
+
+            def deliver_chunk(chunk, is_last):
+                # Chunks share the recipient's send lane, so order is kept
+                if is_last:
+                    chunk = f"{chunk}\n\n_- TaxGuard AI 🤖_"
+                submit_whatsapp_message(sender_phone, chunk)
+                delivered.append(chunk)
+
+            # Get AI response (streamed paragraph by paragraph if enabled)
+            with dispatcher.timed("ai_response"), admission_control.track():
+                ai_response = get_ai_response(
+                    incoming_msg, sender_phone,
+                    on_chunk=deliver_chunk if STREAM_RESPONSES else None
+                )
+
+            if delivered:
+                log.info("Streamed response", extra={"sender": sender_phone, "messages": len(delivered)})
+            else:
+                response_text = f"{ai_response}\n\n_- TaxGuard AI 🤖_"
 
         # Send response
         if response_text:
-            send_whatsapp_message(sender_phone, response_text)
-            print(f"📤 Sent response: {response_text[:100]}...")
+            # Delivery happens on the sender's own threads
+            with dispatcher.timed("send_enqueue"):
+                submit_whatsapp_message(sender_phone, response_text)
+            log.info("Response queued", extra={"sender": sender_phone, "chars": len(response_text)})
 
-    except Exception as e:
-        print(f"❌ Error processing message: {str(e)}")
+    except Exception:
+        log.exception("Error processing message")
 
 @app.route('/webhook', methods=['GET', 'POST'])
 def webhook():
@@ -273,31 +670,88 @@ def webhook():
         challenge = request.args.get('hub.challenge')
 
         if mode == 'subscribe' and token == META_WEBHOOK_VERIFY_TOKEN:
-            print("✅ Webhook verified successfully!")
+            log.info("Webhook verified successfully")
             return challenge, 200
         else:
-            print("❌ Webhook verification failed!")
+            log.warning("Webhook verification failed")
             return 'Forbidden', 403
 
     elif request.method == 'POST':
         # Handle incoming messages
-        data = request.get_json()
-
-        # Log webhook data
-        print(f"📥 Webhook data: {json.dumps(data, indent=2)}")
+        received_at = time.perf_counter()
+        with dispatcher.timed("parse"):
+            data = request.get_json(silent=True) or {}
+
+            # Full payloads only for a sample of requests, at DEBUG
+            log_payload(log, "Webhook payload", data)
+
+            # Collect every message in the delivery (Meta batches under load),
+            # skipping redeliveries of messages we have already handled
+            groups = group_messages_by_sender(
+                message for message in iter_webhook_messages(data)
+                if not deduplicator.seen(message.get('id'))
+            )
 
-        # Check if this is a message event
-        if data.get('object') == 'whatsapp_business_account':
-            if 'entry' in data and len(data['entry']) > 0:
-                if 'changes' in data['entry'][0] and len(data['entry'][0]['changes']) > 0:
-                    change = data['entry'][0]['changes'][0]
+        if groups:
+            if WEBHOOK_DISPATCH_MODE == 'background':
+                # Ack now, process each sender's messages on their shard
+                pending = list(groups.items())
+                for i, (sender, messages) in enumerate(pending):
+                    if not dispatcher.submit(sender, process_sender_messages, messages):
+                        # Queue is full: let Meta redeliver the rest later
+                        deduplicator.forget(message.get('id') for _, rest in pending[i:] for message in rest)
+                        log.warning("Webhook queue full, asking Meta to retry")
+                        return jsonify({"status": "busy"}), 503
+            else:
+                # Process the messages (senders in parallel) before replying
+                rejected = process_message_groups(groups)
+                if rejected:
+                    # Queue is full: let Meta redeliver those later
+                    deduplicator.forget(message.get('id') for message in rejected)
+                    log.warning("Webhook queue full, asking Meta to retry")
+                    return jsonify({"status": "busy"}), 503
+
+        dispatcher.record("ack", time.perf_counter() - received_at)
+        return jsonify({"status": "ok"}), 200
 
-                    if change.get('field') == 'messages':
-                        if 'messages' in change['value']:
-                            # Process the message
-                            process_whatsapp_message(data)
+@app.route('/api/tax/batch', methods=['POST'])
+def tax_batch():
+    """Calculate income tax for many employees in one call
 
-        return jsonify({"status": "ok"}), 200
+    Body: {"incomes": [960000, 2500000, ...], "period": "annual" or "monthly",
+           "year": "2024-25" (optional)}
+    """
+    data = request.get_json(silent=True) or {}
+    incomes = data.get('incomes')
+    period = data.get('period', 'annual')
+    year = data.get('year') or TAX_YEAR
+
+    if not isinstance(incomes, list) or not incomes:
+        return jsonify({"error": "incomes must be a non-empty list of numbers"}), 400
+    if len(incomes) > TAX_BATCH_MAX:
+        return jsonify({"error": f"at most {TAX_BATCH_MAX} incomes per request"}), 400
+    if period not in ('annual', 'monthly'):
+        return jsonify({"error": "period must be 'annual' or 'monthly'"}), 400
+    if not isinstance(year, str) or year not in TAX_TABLES:
+        return jsonify({"error": f"unknown tax year: {year!r} (one of {', '.join(TAX_TABLES)})"}), 400
+    for i, income in enumerate(incomes):
+        if isinstance(income, bool) or not isinstance(income, (int, float)):
+            return jsonify({"error": f"incomes[{i}] must be a number"}), 400
+        # Comparisons are exact even for huge ints, and false for NaN
+        if not 0 <= income <= TAX_BATCH_MAX_INCOME:
+            return jsonify({"error": f"incomes[{i}] must be between 0 and {TAX_BATCH_MAX_INCOME}"}), 400
+
+    if period == 'monthly':
+        incomes = [income * 12 for income in incomes]
+    taxes = calculate_tax_batch(incomes, year)
+
+    return jsonify({
+        "year": year,
+        "period": period,
+        "count": len(taxes),
+        "annual_tax": taxes,
+        "total_annual_tax": round(sum(taxes), 2)
+    })
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -306,9 +760,26 @@ def health():
         "status": "healthy",
         "service": "TaxGuard AI WhatsApp Bot (Cloud API)",
         "ai_provider": AI_PROVIDER or "not_configured",
-        "meta_configured": bool(META_ACCESS_TOKEN and META_PHONE_NUMBER_ID)
+        "ai_providers": AI_PROVIDERS,
+        "ai_router": ai_router.stats(),
+        "meta_configured": bool(META_ACCESS_TOKEN and META_PHONE_NUMBER_ID),
+        "dispatch_mode": WEBHOOK_DISPATCH_MODE,
+        "dispatcher": dispatcher.stats(),
+        "dedup": deduplicator.stats(),
+        "sessions": user_sessions.stats(),
+        "response_cache": response_cache.stats(),
+        "intents": intent_router.stats(),
+        "admission": admission_control.stats(),
+        "media": media_pipeline.stats(),
+        "logging": log_stats(),
+        "sender": whatsapp_sender.stats()
     }
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics (per-stage latency, providers, tokens, sends, queues)"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 @app.route('/', methods=['GET'])
 def home():
     """Home page with setup instructions"""
@@ -336,7 +807,7 @@ def home():
 
         <h3>Features:</h3>
         <ul>
-            <li>✅ Bilingual support (Urdu & English)</li>
+            <li>✅ Replies in English, Urdu or Roman Urdu</li>
             <li>✅ Tax calculations</li>
             <li>✅ Filing guidance</li>
             <li>✅ Deduction recommendations</li>
@@ -364,6 +835,8 @@ if __name__ == '__main__':
     else:
         print("⚠️ Warning: No AI provider configured!")
 
+    print(f"📨 Webhook dispatch mode: {WEBHOOK_DISPATCH_MODE}")
+
     if META_ACCESS_TOKEN and META_PHONE_NUMBER_ID:
         print(f"✅ WhatsApp Cloud API configured")
     else:
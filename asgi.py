@@ -0,0 +1,217 @@
+"""
+TaxGuard AI - asyncio serving mode (shared ASGI pieces)
+
+asgi_cloud_api.py and asgi_app.py serve the same /webhook, /health and /
+routes as the Flask apps from a single event loop. Each pending
+conversation is a coroutine rather than a blocked thread, so thousands
+of them fit in one process; SenderLanes caps how many may be pending and
+keeps every sender's messages in order. Work that touches the session
+store, response cache or deduplicator (SQLite or Redis) runs on a thread
+(asyncio.to_thread), never on the event loop.
+
+Run with any ASGI server, e.g.:
+uvicorn asgi_cloud_api:app --host 0.0.0.0 --port 5000
+uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+
+Environment Variables (.env file):
+ASGI_MAX_PENDING=max conversations queued or in progress (default: 2000)
+ASGI_DRAIN_TIMEOUT=seconds to finish pending conversations on shutdown (default: 25)
+"""
+
+import asyncio
+import json
+import logging
+from collections import namedtuple
+from urllib.parse import parse_qs
+
+from answers import NOT_CONFIGURED_MESSAGE
+
+log = logging.getLogger(__name__)
+
+Request = namedtuple("Request", "method path query body")
+Response = namedtuple("Response", "body status content_type")
+
+
+def json_response(data, status=200):
+    return Response(json.dumps(data), status, "application/json")
+
+
+def text_response(text, status=200, content_type="text/plain; charset=utf-8"):
+    return Response(text, status, content_type)
+
+
+def parse_form(body):
+    """application/x-www-form-urlencoded body -> {name: first value}"""
+    return {key: values[0] for key, values in parse_qs(body.decode("utf-8")).items()}
+
+
+class AsgiApp:
+    """Minimal ASGI application: exact-path routes plus startup/shutdown hooks"""
+
+    def __init__(self, routes, on_startup=(), on_shutdown=()):
+        # routes: {(method, path): async handler(Request) -> Response}
+        self.routes = routes
+        self.on_startup = list(on_startup)
+        self.on_shutdown = list(on_shutdown)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                for hook in self.on_startup:
+                    await hook()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for hook in self.on_shutdown:
+                    await hook()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        body = b""
+        more = True
+        while more:
+            message = await receive()
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+
+        request = Request(
+            method=scope["method"],
+            path=scope["path"],
+            query={k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode()).items()},
+            body=body,
+        )
+
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            allowed = any(path == request.path for _, path in self.routes)
+            response = text_response("Method Not Allowed" if allowed else "Not Found",
+                                     405 if allowed else 404)
+        else:
+            try:
+                response = await handler(request)
+            except Exception:
+                log.exception("Error handling request", extra={"method": request.method, "path": request.path})
+                response = text_response("Internal Server Error", 500)
+
+        payload = response.body.encode("utf-8") if isinstance(response.body, str) else response.body
+        await send({
+            "type": "http.response.start",
+            "status": response.status,
+            "headers": [
+                (b"content-type", response.content_type.encode()),
+                (b"content-length", str(len(payload)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": payload})
+
+
+class SenderLanes:
+    """Pending conversations as tasks: one at a time per sender, capped overall"""
+
+    def __init__(self, max_pending=2000):
+        self.max_pending = max(1, max_pending)
+        self._pending = 0
+        self._locks = {}  # sender -> [asyncio.Lock, tasks using it]
+        self._tasks = set()
+        self._accepted = 0
+        self._rejected = 0
+        self._failed = 0
+
+    def depth(self):
+        return self._pending
+
+    def _admit(self):
+        if self._pending >= self.max_pending:
+            self._rejected += 1
+            return False
+        self._pending += 1
+        self._accepted += 1
+        return True
+
+    async def _run(self, sender, fn, args):
+        entry = self._locks.get(sender)
+        if entry is None:
+            entry = self._locks[sender] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock wakes waiters in FIFO order, so arrival order is kept
+            async with entry[0]:
+                return await fn(*args)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[sender]
+            self._pending -= 1
+
+    async def _run_logged(self, sender, fn, args):
+        try:
+            await self._run(sender, fn, args)
+        except Exception:
+            self._failed += 1
+            log.exception("Conversation task failed")
+
+    def submit(self, sender, fn, *args):
+        """Run fn(*args) in the background after sender's earlier jobs; False if full"""
+        if not self._admit():
+            return False
+        task = asyncio.ensure_future(self._run_logged(sender, fn, args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def call(self, sender, fn, *args, busy=None):
+        """Await fn(*args) after sender's earlier jobs; returns busy if full"""
+        if not self._admit():
+            return busy
+        return await self._run(sender, fn, args)
+
+    async def drain(self, timeout):
+        """Wait for background conversations to finish (on shutdown)"""
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+        if self._tasks:
+            log.warning("Stopped with conversations still pending", extra={"pending": len(self._tasks)})
+
+    def stats(self):
+        return {
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "senders": len(self._locks),
+            "accepted": self._accepted,
+            "rejected": self._rejected,
+            "failed": self._failed,
+        }
+
+
+async def get_ai_response(bot, user_message, user_id):
+    """bot.get_ai_response() for the event loop (bot is the Flask app module)
+
+    History, response cache and provider routing are shared with the Flask
+    app (answers.AnswerSteps); the provider calls are awaited and the
+    session store and cache, which may be SQLite or Redis, are used from a
+    thread so they never block the event loop.
+    """
+
+    if bot.AI_PROVIDER is None:
+        return NOT_CONFIGURED_MESSAGE
+
+    steps = bot.answer_steps
+    pending = await asyncio.to_thread(steps.prepare, user_message, user_id, bot.AI_PROVIDER)
+    if pending.cached is not None:
+        return pending.cached
+
+    try:
+        # Primary provider, with failover/hedging to the others
+        calls = {name: client.acomplete for name, client in bot.ai_clients.items()}
+        provider, ai_message = await bot.ai_router.acomplete(calls, pending.messages)
+        return await asyncio.to_thread(steps.finish, pending, provider, ai_message)
+
+    except Exception as e:
+        return await asyncio.to_thread(steps.fail, pending, e)
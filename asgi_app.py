@@ -0,0 +1,173 @@
+"""
+TaxGuard AI - Twilio WhatsApp bot, asyncio serving mode
+
+Same routes and behaviour as app.py (configuration, sessions, caches,
+intents and provider routing are shared with it), but every conversation
+runs as a coroutine: AI calls use the providers' async clients and, in
+TWILIO_REPLY_MODE=async, replies go out through Twilio's pooled async
+HTTP client.
+
+Run:
+uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+from twilio.twiml.messaging_response import MessagingResponse
+
+import app as bot
+from asgi import AsgiApp, SenderLanes, get_ai_response, json_response, parse_form, text_response
+from language import conversation_language, localized
+from metrics import CONTENT_TYPE, REGISTRY, record_send
+
+log = logging.getLogger(__name__)
+
+ASGI_MAX_PENDING = int(os.getenv('ASGI_MAX_PENDING', '2000'))
+ASGI_DRAIN_TIMEOUT = float(os.getenv('ASGI_DRAIN_TIMEOUT', '25'))
+
+# Pending conversations, in order per sender; also the load-shedding depth
+lanes = SenderLanes(max_pending=ASGI_MAX_PENDING)
+bot.admission_control.depth_fn = lanes.depth
+REGISTRY.callback("taxguard_queue_depth", "Conversations queued or in progress", lanes.depth)
+
+# Async Twilio client; its aiohttp session must be created inside the event loop
+twilio_client = None
+
+
+async def startup():
+    global twilio_client
+    from twilio.http.async_http_client import AsyncTwilioHttpClient
+    from twilio.rest import Client
+    twilio_client = Client(
+        bot.TWILIO_ACCOUNT_SID,
+        bot.TWILIO_AUTH_TOKEN,
+        http_client=AsyncTwilioHttpClient(pool_connections=True, timeout=bot.TWILIO_HTTP_TIMEOUT)
+    )
+    if bot.TWILIO_API_BASE_URL:
+        twilio_client.api.base_url = bot.TWILIO_API_BASE_URL.rstrip('/')
+
+
+async def shutdown():
+    await lanes.drain(ASGI_DRAIN_TIMEOUT)
+    if twilio_client is not None:
+        await twilio_client.http_client.close()
+
+
+async def send_twilio_message(recipient_number, message_text, from_number=None):
+    """Send a WhatsApp message through the Twilio REST API"""
+    started = time.perf_counter()
+    try:
+        await twilio_client.messages.create_async(
+            from_=from_number or bot.TWILIO_WHATSAPP_NUMBER,
+            to=recipient_number,
+            body=message_text
+        )
+        record_send("twilio", True, time.perf_counter() - started)
+        log.info("Message sent", extra={"recipient": recipient_number})
+        return True
+    except Exception as e:
+        record_send("twilio", False, time.perf_counter() - started)
+        log.error("Exception while sending message", extra={"recipient": recipient_number, "error": str(e)})
+        return False
+
+
+async def answer_with_ai(incoming_msg, sender_number):
+    """AI answer with signature"""
+    with bot.dispatcher.timed("ai_response"), bot.admission_control.track():
+        ai_response = await get_ai_response(bot, incoming_msg, sender_number)
+
+    # Add TaxGuard AI signature
+    return f"{ai_response}\n\n_- TaxGuard AI 🤖_"
+
+
+async def reply_with_ai(incoming_msg, sender_number, from_number):
+    """Get the AI answer and send it as a separate message (async mode)"""
+    response_text = await answer_with_ai(incoming_msg, sender_number)
+    with bot.dispatcher.timed("send"):
+        await send_twilio_message(sender_number, response_text, from_number)
+    log.info("Response sent", extra={"sender": sender_number, "chars": len(response_text)})
+
+
+def twiml(resp):
+    return text_response(str(resp), content_type="application/xml")
+
+
+async def webhook(request):
+    """Handle incoming WhatsApp messages"""
+    received_at = time.perf_counter()
+    form = parse_form(request.body)
+    incoming_msg = form.get('Body', '').strip()
+    sender_number = form.get('From', '')
+    message_sid = form.get('MessageSid', '')
+
+    # Ignore Twilio retries of a message we already answered
+    if await asyncio.to_thread(bot.deduplicator.seen, message_sid):
+        log.info("Duplicate message ignored", extra={"message_sid": message_sid})
+        return twiml(MessagingResponse())
+
+    resp = MessagingResponse()
+    msg = resp.message()
+    log.info("Message received", extra={"sender": sender_number, "chars": len(incoming_msg)})
+    log.debug("Message text", extra={"sender": sender_number, "text": incoming_msg})
+
+    # Greetings, tax calculations, FBR questions and shed load need no AI
+    with bot.dispatcher.timed("local_reply"):
+        local_text = await asyncio.to_thread(bot.local_reply, incoming_msg, sender_number)
+    if local_text is not None:
+        msg.body(local_text)
+
+    # Async mode: acknowledge now, answer through the REST API when ready
+    elif bot.TWILIO_REPLY_MODE == 'async' and lanes.submit(
+            sender_number, reply_with_ai, incoming_msg, sender_number, form.get('To')):
+        ack = MessagingResponse()
+        if bot.TWILIO_ACK_MESSAGE:
+            ack.message(bot.TWILIO_ACK_MESSAGE)
+        bot.dispatcher.record("ack", time.perf_counter() - received_at)
+        return twiml(ack)
+
+    # Handle all other queries with AI, after the sender's earlier messages
+    else:
+        language = await asyncio.to_thread(
+            conversation_language, bot.user_sessions, sender_number, incoming_msg, False
+        )
+        response_text = await lanes.call(
+            sender_number, answer_with_ai, incoming_msg, sender_number,
+            busy=localized(bot.BUSY_MESSAGE, language)
+        )
+        msg.body(response_text)
+        log.info("Response sent", extra={"sender": sender_number, "chars": len(response_text)})
+
+    return twiml(resp)
+
+
+async def health(request):
+    """Health check endpoint"""
+    status = await asyncio.to_thread(bot.health)
+    status.update({"serving": "asgi", "lanes": lanes.stats()})
+    return json_response(status)
+
+
+async def metrics(request):
+    """Prometheus metrics (per-stage latency, providers, tokens, sends, queues)"""
+    # Some gauges read the session store
+    return text_response(await asyncio.to_thread(REGISTRY.render), content_type=CONTENT_TYPE)
+
+
+async def home(request):
+    """Home page with setup instructions"""
+    return text_response(bot.home(), content_type="text/html; charset=utf-8")
+
+
+app = AsgiApp(
+    {
+        ('POST', '/webhook'): webhook,
+        ('GET', '/health'): health,
+        ('GET', '/metrics'): metrics,
+        ('GET', '/'): home,
+    },
+    on_startup=[startup],
+    on_shutdown=[shutdown]
+)
@@ -0,0 +1,185 @@
+"""
+TaxGuard AI - WhatsApp Cloud API bot, asyncio serving mode
+
+Same routes and behaviour as app_cloud_api.py (configuration, sessions,
+caches, intents and provider routing are shared with it), but webhooks
+are acknowledged immediately and every conversation runs as a coroutine:
+AI calls use the providers' async clients and replies go out over a
+pooled aiohttp session.
+
+Run:
+uvicorn asgi_cloud_api:app --host 0.0.0.0 --port 5000
+
+Streamed answers (STREAM_RESPONSES) are only supported by the Flask app.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+import app_cloud_api as bot
+from asgi import AsgiApp, SenderLanes, get_ai_response, json_response, text_response
+from metrics import CONTENT_TYPE, REGISTRY
+from structured_log import log_payload
+from whatsapp_sender import AsyncWhatsAppSender
+
+log = logging.getLogger(__name__)
+
+ASGI_MAX_PENDING = int(os.getenv('ASGI_MAX_PENDING', '2000'))
+ASGI_DRAIN_TIMEOUT = float(os.getenv('ASGI_DRAIN_TIMEOUT', '25'))
+
+# Pooled async sender for all replies
+whatsapp_sender = AsyncWhatsAppSender(
+    bot.WHATSAPP_API_URL,
+    bot.META_ACCESS_TOKEN,
+    phone_number_id=bot.META_PHONE_NUMBER_ID,
+    pool_size=bot.WHATSAPP_POOL_SIZE,
+    connect_timeout=bot.WHATSAPP_CONNECT_TIMEOUT,
+    read_timeout=bot.WHATSAPP_READ_TIMEOUT,
+    max_retries=bot.WHATSAPP_MAX_RETRIES,
+    rate_per_second=bot.WHATSAPP_RATE_LIMIT
+)
+
+# Pending conversations, in order per sender; also the load-shedding depth
+lanes = SenderLanes(max_pending=ASGI_MAX_PENDING)
+bot.admission_control.depth_fn = lanes.depth
+REGISTRY.callback("taxguard_queue_depth", "Conversations queued or in progress", lanes.depth)
+
+
+async def send_whatsapp_message(recipient_phone, message_text):
+    """Send message using WhatsApp Cloud API"""
+
+    if not bot.META_ACCESS_TOKEN or not bot.META_PHONE_NUMBER_ID:
+        log.error("WhatsApp Cloud API credentials not configured")
+        return False
+
+    return await whatsapp_sender.send_text(recipient_phone, message_text)
+
+
+async def handle_whatsapp_message(message):
+    """Process a single incoming WhatsApp message"""
+
+    try:
+        sender_phone = message['from']
+
+        # Receipt photos: download and resizing block, so they run on a thread
+        if message['type'] in ('image', 'document'):
+            response_text = await asyncio.to_thread(bot.media_reply, message, sender_phone)
+            await send_whatsapp_message(sender_phone, response_text)
+            return
+
+        # Other media (audio, stickers, locations, ...) is not supported
+        if message['type'] != 'text':
+            await send_whatsapp_message(sender_phone, "Sorry, I can only process text messages at the moment.")
+            return
+
+        incoming_msg = message['text']['body'].strip()
+        log.info("Message received", extra={"sender": sender_phone, "chars": len(incoming_msg)})
+        log.debug("Message text", extra={"sender": sender_phone, "text": incoming_msg})
+
+        with bot.dispatcher.timed("local_reply"):
+            response_text = await asyncio.to_thread(bot.local_reply, incoming_msg, sender_phone)
+
+        # Handle all other queries with AI
+        if response_text is None:
+            with bot.dispatcher.timed("ai_response"), bot.admission_control.track():
+                ai_response = await get_ai_response(bot, incoming_msg, sender_phone)
+            response_text = f"{ai_response}\n\n_- TaxGuard AI 🤖_"
+
+        with bot.dispatcher.timed("send"):
+            await send_whatsapp_message(sender_phone, response_text)
+        log.info("Response sent", extra={"sender": sender_phone, "chars": len(response_text)})
+
+    except Exception:
+        log.exception("Error processing message")
+
+
+async def process_sender_messages(messages):
+    """Process one sender's messages strictly in order"""
+    for message in messages:
+        await handle_whatsapp_message(message)
+
+
+def new_message_groups(data):
+    """Messages not seen before, by sender (the deduplicator may be Redis, so run on a thread)"""
+    return bot.group_messages_by_sender(
+        message for message in bot.iter_webhook_messages(data)
+        if not bot.deduplicator.seen(message.get('id'))
+    )
+
+
+async def verify_webhook(request):
+    """Webhook verification (required by Meta)"""
+    if (request.query.get('hub.mode') == 'subscribe'
+            and request.query.get('hub.verify_token') == bot.META_WEBHOOK_VERIFY_TOKEN):
+        log.info("Webhook verified successfully")
+        return text_response(request.query.get('hub.challenge', ''))
+
+    log.warning("Webhook verification failed")
+    return text_response('Forbidden', 403)
+
+
+async def webhook(request):
+    """Ack Meta right away; each sender's messages run as one pending conversation"""
+    received_at = time.perf_counter()
+    with bot.dispatcher.timed("parse"):
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            data = {}
+        log_payload(log, "Webhook payload", data)
+        groups = await asyncio.to_thread(new_message_groups, data)
+
+    pending = list(groups.items())
+    for i, (sender, messages) in enumerate(pending):
+        if not lanes.submit(sender, process_sender_messages, messages):
+            # Too many pending conversations: let Meta redeliver the rest later
+            await asyncio.to_thread(
+                bot.deduplicator.forget, [message.get('id') for _, rest in pending[i:] for message in rest]
+            )
+            log.warning("Too many pending conversations, asking Meta to retry")
+            return json_response({"status": "busy"}, 503)
+
+    bot.dispatcher.record("ack", time.perf_counter() - received_at)
+    return json_response({"status": "ok"})
+
+
+async def health(request):
+    """Health check endpoint"""
+    status = await asyncio.to_thread(bot.health)
+    status.update({
+        "serving": "asgi",
+        "lanes": lanes.stats(),
+        "sender": whatsapp_sender.stats(),
+    })
+    return json_response(status)
+
+
+async def metrics(request):
+    """Prometheus metrics (per-stage latency, providers, tokens, sends, queues)"""
+    # Some gauges read the session store
+    return text_response(await asyncio.to_thread(REGISTRY.render), content_type=CONTENT_TYPE)
+
+
+async def home(request):
+    """Home page with setup instructions"""
+    return text_response(bot.home(), content_type="text/html; charset=utf-8")
+
+
+async def shutdown():
+    await lanes.drain(ASGI_DRAIN_TIMEOUT)
+    await whatsapp_sender.close()
+
+
+app = AsgiApp(
+    {
+        ('GET', '/webhook'): verify_webhook,
+        ('POST', '/webhook'): webhook,
+        ('GET', '/health'): health,
+        ('GET', '/metrics'): metrics,
+        ('GET', '/'): home,
+    },
+    on_shutdown=[shutdown]
+)
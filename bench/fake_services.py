@@ -0,0 +1,326 @@
+"""
+TaxGuard AI - Local stand-ins for the external APIs (benchmarks only)
+
+One HTTP server that answers like the four services the bots call, so
+load tests never touch real quota:
+
+- graph:  POST /<version>/<phone_number_id>/messages (WhatsApp Cloud API)
+- twilio: POST /2010-04-01/Accounts/<sid>/Messages.json
+- openai: POST /v1/chat/completions (plain and stream=true)
+- gemini: POST /v1beta/models/<model>:generateContent and :streamGenerateContent
+- media:  GET /<version>/<media_id> and the download URL it returns, for
+  files registered with add_media() (Cloud API receipts, see media.py)
+
+Every service has its own latency (plus random jitter) and error rate;
+an injected error answers with error_status (500 by default, which the
+senders retry).
+
+Point the apps at it with:
+META_GRAPH_URL=http://127.0.0.1:<port>
+TWILIO_API_BASE_URL=http://127.0.0.1:<port>
+OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+GEMINI_API_ENDPOINT=http://127.0.0.1:<port>
+
+Run standalone (e.g. in front of a gunicorn deployment):
+python -m bench.fake_services --port 9000 --latency openai=800 --error-rate graph=0.02
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SERVICES = ("graph", "twilio", "openai", "gemini", "media")
+
+# latency and jitter in seconds; error_rate is a fraction of requests
+ServiceConfig = namedtuple("ServiceConfig", "latency jitter error_rate error_status")
+
+DEFAULT_CONFIG = {
+    "graph": ServiceConfig(0.05, 0.02, 0.0, 500),
+    "twilio": ServiceConfig(0.08, 0.02, 0.0, 500),
+    "openai": ServiceConfig(0.8, 0.3, 0.0, 500),
+    "gemini": ServiceConfig(0.6, 0.2, 0.0, 500),
+    "media": ServiceConfig(0.05, 0.02, 0.0, 500),
+}
+
+ANSWER = (
+    "*Income tax on salary*\n\n"
+    "For tax year 2024-25 salaried individuals pay tax on annual taxable income "
+    "above Rs. 600,000 using the slab rates published by FBR. Your employer "
+    "deducts it every month and reports it on your withholding statement.\n\n"
+    "To file your return, log in to IRIS, open the Return of Income form for "
+    "the tax year, declare your salary from the withholding statement and add "
+    "any other income, deductible allowances and tax already paid.\n\n"
+    "Keep your salary certificate, bank certificates and Zakat receipts for "
+    "at least six years in case FBR asks for them."
+)
+
+_GRAPH = re.compile(r"^/v[\d.]+/[^/]+/messages$")
+_TWILIO = re.compile(r"^/2010-04-01/Accounts/[^/]+/Messages\.json$")
+_MEDIA_INFO = re.compile(r"^/v[\d.]+/([^/]+)$")
+_MEDIA_FILE = re.compile(r"^/media/([^/]+)$")
+_GEMINI = re.compile(r"^/v1(?:beta)?/models/[^/:]+:(generateContent|streamGenerateContent)$")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up early (aborted downloads, timeouts) are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeServices:
+    """The fake APIs on one port, with per-service counters"""
+
+    def __init__(self, host="127.0.0.1", port=0, config=None, answer=ANSWER):
+        self.config = dict(DEFAULT_CONFIG)
+        self.config.update(config or {})
+        self.answer = answer
+        self._cond = threading.Condition()
+        self._calls = dict.fromkeys(SERVICES, 0)
+        self._errors = dict.fromkeys(SERVICES, 0)
+        self._media = {}  # media_id -> (data, mime_type)
+        self._server = _Server((host, port), _handler_for(self))
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-services", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add_media(self, media_id, data, mime_type="image/jpeg"):
+        """Serve data as Cloud API media media_id"""
+        self._media[media_id] = (data, mime_type)
+
+    def delivered(self, service):
+        """Calls answered successfully (injected errors excluded)"""
+        with self._cond:
+            return self._calls[service] - self._errors[service]
+
+    def wait_for(self, service, count, timeout):
+        """Wait until service has answered count calls successfully; False on timeout"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._calls[service] - self._errors[service] < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._cond:
+            return {
+                service: {"calls": self._calls[service], "injected_errors": self._errors[service]}
+                for service in SERVICES
+            }
+
+    def _begin(self, service):
+        """Sleep for the service latency; True if this call should fail"""
+        config = self.config[service]
+        delay = config.latency + random.uniform(-config.jitter, config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        failed = random.random() < config.error_rate
+        with self._cond:
+            self._calls[service] += 1
+            if failed:
+                self._errors[service] += 1
+            self._cond.notify_all()
+        return failed
+
+
+def _handler_for(services):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, as the real APIs
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            info, download = _MEDIA_INFO.match(path), _MEDIA_FILE.match(path)
+            media_id = (info or download).group(1) if (info or download) else None
+            if media_id not in services._media:
+                self._send(404, {"error": {"message": f"no fake for {path}"}})
+            elif info:
+                self._answer("media", lambda: self._media_info(media_id))
+            else:
+                data, mime_type = services._media[media_id]
+                self._answer("media", lambda: (200, data, mime_type))
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            url = urlparse(self.path)
+            path = url.path
+
+            if _GRAPH.match(path):
+                self._answer("graph", lambda: self._graph(body))
+            elif _TWILIO.match(path):
+                self._answer("twilio", lambda: self._twilio(body))
+            elif path.endswith("/chat/completions"):
+                self._answer("openai", lambda: self._openai(body))
+            elif _GEMINI.match(path):
+                stream = _GEMINI.match(path).group(1) == "streamGenerateContent"
+                sse = parse_qs(url.query).get("alt") == ["sse"]
+                self._answer("gemini", lambda: self._gemini(stream, sse))
+            else:
+                self._send(404, {"error": {"message": f"no fake for {path}"}})
+
+        def _answer(self, service, build):
+            if services._begin(service):
+                status = services.config[service].error_status
+                self._send(status, {"error": {"message": "injected error", "code": status}})
+                return
+            self._send(*build())
+
+        def _send(self, status, payload, content_type="application/json"):
+            data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _media_info(self, media_id):
+            data, mime_type = services._media[media_id]
+            return 200, {
+                "messaging_product": "whatsapp",
+                "url": f"{services.url}/media/{media_id}",
+                "mime_type": mime_type,
+                "sha256": hashlib.sha256(data).hexdigest(),
+                "file_size": len(data),
+                "id": media_id,
+            }
+
+        def _graph(self, body):
+            to = json.loads(body or b"{}").get("to", "")
+            return 200, {
+                "messaging_product": "whatsapp",
+                "contacts": [{"input": to, "wa_id": to}],
+                "messages": [{"id": f"wamid.{uuid.uuid4().hex}"}],
+            }
+
+        def _twilio(self, body):
+            form = {key: values[0] for key, values in parse_qs(body.decode("utf-8")).items()}
+            return 201, {
+                "sid": "SM" + uuid.uuid4().hex,
+                "status": "queued",
+                "to": form.get("To"),
+                "from": form.get("From"),
+                "body": form.get("Body"),
+                "num_segments": "1",
+                "direction": "outbound-api",
+            }
+
+        def _openai(self, body):
+            request = json.loads(body or b"{}")
+            model = request.get("model", "gpt-4")
+            base = {"id": "chatcmpl-" + uuid.uuid4().hex, "created": int(time.time()), "model": model}
+            if not request.get("stream"):
+                return 200, dict(base, object="chat.completion", choices=[{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": services.answer},
+                    "finish_reason": "stop",
+                }], usage={"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0})
+
+            events = []
+            for i, part in enumerate(_split(services.answer)):
+                delta = {"role": "assistant", "content": part} if i == 0 else {"content": part}
+                events.append(dict(base, object="chat.completion.chunk",
+                                   choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+            events.append(dict(base, object="chat.completion.chunk",
+                               choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+            return 200, _sse(events, done=True), "text/event-stream"
+
+        def _gemini(self, stream, sse):
+            def candidate(text, finished):
+                entry = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+                if finished:
+                    entry["finishReason"] = "STOP"
+                return {"candidates": [entry]}
+
+            if not stream:
+                return 200, candidate(services.answer, True)
+            parts = _split(services.answer)
+            events = [candidate(part, i == len(parts) - 1) for i, part in enumerate(parts)]
+            if sse:
+                return 200, _sse(events), "text/event-stream"
+            return 200, events
+
+    return Handler
+
+
+def _split(text, size=40):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _sse(events, done=False):
+    lines = [f"data: {json.dumps(event)}\n\n" for event in events]
+    if done:
+        lines.append("data: [DONE]\n\n")
+    return "".join(lines).encode("utf-8")
+
+
+def config_from_args(args):
+    """--latency/--jitter/--error-rate SERVICE=VALUE pairs -> {service: ServiceConfig}"""
+    config = dict(DEFAULT_CONFIG)
+    for field, pairs, scale in (("latency", args.latency, 0.001), ("jitter", args.jitter, 0.001),
+                                ("error_rate", args.error_rate, 1.0)):
+        for pair in pairs or []:
+            service, _, value = pair.partition("=")
+            if service not in SERVICES:
+                raise ValueError(f"unknown service {service!r} (one of {', '.join(SERVICES)})")
+            config[service] = config[service]._replace(**{field: float(value) * scale})
+    return config
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", action="append", metavar="SERVICE=MS",
+                        help="mean latency of a fake service in ms (repeatable)")
+    parser.add_argument("--jitter", action="append", metavar="SERVICE=MS",
+                        help="+/- random jitter in ms (repeatable)")
+    parser.add_argument("--error-rate", action="append", metavar="SERVICE=FRACTION",
+                        help="fraction of calls answered with an error (repeatable)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Graph, Twilio, OpenAI and Gemini APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    services = FakeServices(args.host, args.port, config_from_args(args)).start()
+    print(f"Fake APIs listening on {services.url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(services.stats()))
+    except KeyboardInterrupt:
+        services.stop()
+
+
+if __name__ == "__main__":
+    main()
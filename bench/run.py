@@ -0,0 +1,338 @@
+"""
+TaxGuard AI - Offline load test / benchmark
+
+Drives /webhook of app.py (form-encoded Twilio payloads) or
+app_cloud_api.py (Cloud API JSON, optionally several messages per
+delivery) served by a local threaded WSGI server, with every external API
+replaced by bench.fake_services. No real quota is used.
+
+Reports:
+- webhook throughput and p50/p95/p99/max latency
+- end-to-end message throughput (until every outbound reply reached the fake API)
+- user_sessions growth (sessions, approximate bytes, bytes per session) and peak RSS
+- calls and injected errors per fake service
+- regressions against a saved earlier run (--baseline)
+
+Examples:
+python -m bench.run --app cloud --requests 2000 --concurrency 32 --batch 3
+python -m bench.run --app twilio --requests 500 --latency openai=300 --error-rate openai=0.05
+python -m bench.run --app cloud --save bench-main.json
+python -m bench.run --app cloud --baseline bench-main.json --tolerance 0.10
+
+Settings the bots read from the environment (WEBHOOK_DISPATCH_MODE,
+TWILIO_REPLY_MODE, SESSION_BACKEND, ...) apply as usual; rate limits are
+raised so the load is not shed unless they are set explicitly.
+"""
+
+import argparse
+import importlib
+import itertools
+import json
+import math
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.fake_services import FakeServices, add_arguments, config_from_args
+
+# Message kinds; {n} is filled per message so personal questions stay unique.
+# "ai" texts must not parse as tax queries (tax_query.py) or match an intent
+MESSAGES = {
+    "intent": ["hi", "menu", "What is the filing deadline?", "How do I check my filer status?"],
+    "tax": ["Monthly income {n}, software engineer, Islamabad", "salary {n} per month, teacher, Lahore"],
+    "ai": ["What deductions can I claim?", "How do I file my tax return online?",
+           "A flat I own brings in {n} rent a year, which return form applies?",
+           "My employer deducted {n} this year, can I get a refund?"],
+}
+
+# Metrics compared against --baseline: name -> True when higher is better
+COMPARED = {
+    "webhook_rps": True,
+    "messages_per_second": True,
+    "latency_p50_ms": False,
+    "latency_p95_ms": False,
+    "latency_p99_ms": False,
+    "session_bytes_per_session": False,
+}
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(rank, 1)) - 1]
+
+
+def parse_mix(text):
+    """"ai=0.6,intent=0.2,tax=0.2" -> [(kind, weight)]"""
+    mix = []
+    for pair in text.split(","):
+        kind, _, weight = pair.partition("=")
+        if kind not in MESSAGES:
+            raise ValueError(f"unknown message kind {kind!r} (one of {', '.join(MESSAGES)})")
+        mix.append((kind, float(weight)))
+    return mix
+
+
+class Workload:
+    """Deterministic stream of (sender, text, kind) for a run"""
+
+    def __init__(self, senders, mix, seed):
+        self._random = random.Random(seed)
+        self._senders = [f"92300{index:07d}" for index in range(senders)]
+        self._kinds, self._weights = zip(*mix)
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            kind = self._random.choices(self._kinds, self._weights)[0]
+            text = self._random.choice(MESSAGES[kind]).format(n=self._random.randrange(30000, 900000, 500))
+            return self._random.choice(self._senders), text, kind
+
+
+def configure_environment(args, fakes):
+    """Point the bot at the fakes before it is imported"""
+    env = {
+        "OPENAI_API_KEY": "bench" if args.provider == "openai" else "",
+        "GEMINI_API_KEY": "bench" if args.provider == "gemini" else "",
+        "OPENAI_BASE_URL": f"{fakes.url}/v1",
+        "GEMINI_API_ENDPOINT": fakes.url,
+        "META_GRAPH_URL": fakes.url,
+        "META_ACCESS_TOKEN": "bench",
+        "META_PHONE_NUMBER_ID": "100000000000000",
+        "TWILIO_API_BASE_URL": fakes.url,
+        "TWILIO_ACCOUNT_SID": "AC" + "0" * 32,
+        "TWILIO_AUTH_TOKEN": "bench",
+    }
+    os.environ.update(env)
+    for name, value in (("RATE_LIMIT_PER_SENDER", "1000000"), ("RATE_LIMIT_SENDER_BURST", "1000000"),
+                        ("RATE_LIMIT_GLOBAL", "1000000"), ("RATE_LIMIT_GLOBAL_BURST", "1000000"),
+                        ("RATE_LIMIT_SHED_DEPTH", "1000000"), ("GEMINI_CONTEXT_CACHE", "false"),
+                        ("LOG_LEVEL", "WARNING")):
+        os.environ.setdefault(name, value)
+
+
+def serve(flask_app):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, flask_app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name="bench-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/webhook"
+
+
+def cloud_delivery(items, ids):
+    """Cloud API webhook body carrying several messages"""
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "bench", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"phone_number_id": "100000000000000"},
+            "messages": [
+                {"from": sender, "id": f"wamid.bench.{next(ids)}", "timestamp": str(int(time.time())),
+                 "type": "text", "text": {"body": text}}
+                for sender, text, _ in items
+            ],
+        }}]}],
+    }
+
+
+def run(args):
+    fakes = FakeServices(config=config_from_args(args)).start()
+    configure_environment(args, fakes)
+    bot = importlib.import_module("app_cloud_api" if args.app == "cloud" else "app")
+
+    import requests
+    server, webhook_url = serve(bot.app)
+    workload = Workload(args.senders, parse_mix(args.mix), args.seed)
+    ids = itertools.count()
+    local = threading.local()
+    latencies = []
+    failures = []
+    kinds = {kind: 0 for kind in MESSAGES}
+    results_lock = threading.Lock()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def one_request(_):
+        batch = args.batch if args.app == "cloud" else 1
+        items = [workload.next() for _ in range(batch)]
+        started = time.perf_counter()
+        try:
+            if args.app == "cloud":
+                response = session().post(webhook_url, json=cloud_delivery(items, ids), timeout=args.timeout)
+            else:
+                sender, text, _ = items[0]
+                response = session().post(webhook_url, data={
+                    "Body": text, "From": f"whatsapp:+{sender}", "To": "whatsapp:+14155238886",
+                    "MessageSid": f"SMbench{next(ids)}",
+                }, timeout=args.timeout)
+            ok = response.status_code == 200
+            status = response.status_code
+        except Exception as e:
+            ok, status = False, type(e).__name__
+        elapsed = time.perf_counter() - started
+        with results_lock:
+            latencies.append(elapsed)
+            for _, _, kind in items:
+                kinds[kind] += 1
+            if not ok:
+                failures.append(status)
+
+    outbound = "graph" if args.app == "cloud" else "twilio"
+
+    def expected_replies():
+        # Replies sent through the REST API (Cloud API always, Twilio in async mode)
+        if args.app == "cloud":
+            return sum(kinds.values())
+        return kinds["ai"] if bot.TWILIO_REPLY_MODE == "async" else 0
+
+    # Warm up connections and lazy imports outside the measured window
+    for _ in range(min(args.warmup, args.requests)):
+        one_request(None)
+    fakes.wait_for(outbound, expected_replies(), args.drain_timeout)
+    latencies.clear()
+    failures.clear()
+    kinds.update(dict.fromkeys(kinds, 0))
+    outbound_before = fakes.delivered(outbound)
+    sessions_before = bot.user_sessions.stats()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one_request, range(args.requests)))
+    webhook_seconds = time.perf_counter() - started
+
+    messages = sum(kinds.values())
+    expected = expected_replies()
+    drained = fakes.wait_for(outbound, outbound_before + expected, args.drain_timeout)
+    total_seconds = time.perf_counter() - started
+
+    sessions_after = bot.user_sessions.stats()
+    latencies.sort()
+    new_sessions = sessions_after.get("sessions", 0) - sessions_before.get("sessions", 0)
+    new_bytes = sessions_after.get("approx_bytes", 0) - sessions_before.get("approx_bytes", 0)
+    server.shutdown()
+    fakes.stop()
+
+    return {
+        "app": args.app,
+        "config": {
+            "requests": args.requests, "concurrency": args.concurrency,
+            "batch": args.batch if args.app == "cloud" else 1, "senders": args.senders,
+            "mix": args.mix, "provider": args.provider, "seed": args.seed,
+            "fakes": {name: config._asdict() for name, config in fakes.config.items()},
+        },
+        "webhook_requests": len(latencies),
+        "webhook_failures": len(failures),
+        "failure_statuses": {str(status): failures.count(status) for status in set(failures)},
+        "messages": messages,
+        "messages_by_kind": kinds,
+        "webhook_seconds": round(webhook_seconds, 3),
+        "webhook_rps": round(len(latencies) / webhook_seconds, 2) if webhook_seconds else 0.0,
+        "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "latency_max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "replies_expected": expected,
+        "replies_delivered": fakes.delivered(outbound) - outbound_before,
+        "replies_drained": drained,
+        "total_seconds": round(total_seconds, 3),
+        "messages_per_second": round(messages / total_seconds, 2) if total_seconds else 0.0,
+        "sessions": sessions_after.get("sessions"),
+        "session_bytes_growth": new_bytes,
+        "session_bytes_per_session": round(new_bytes / new_sessions, 1) if new_sessions > 0 else None,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "fake_services": fakes.stats(),
+    }
+
+
+def compare(result, baseline, tolerance):
+    """[(metric, before, after, change)] for metrics worse than baseline by more than tolerance"""
+    regressions = []
+    for metric, higher_is_better in COMPARED.items():
+        before, after = baseline.get(metric), result.get(metric)
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append((metric, before, after, change))
+    return regressions
+
+
+def report(result, regressions, baseline):
+    print(f"\nTaxGuard AI benchmark - {result['app']} app")
+    print(f"  webhook requests   {result['webhook_requests']} ({result['webhook_failures']} failed) "
+          f"in {result['webhook_seconds']}s = {result['webhook_rps']} req/s")
+    print(f"  webhook latency    p50 {result['latency_p50_ms']} ms  p95 {result['latency_p95_ms']} ms  "
+          f"p99 {result['latency_p99_ms']} ms  max {result['latency_max_ms']} ms")
+    print(f"  messages           {result['messages']} {result['messages_by_kind']}")
+    print(f"  replies via API    {result['replies_delivered']}/{result['replies_expected']}"
+          f"{'' if result['replies_drained'] else ' (timed out waiting)'}")
+    print(f"  end to end         {result['total_seconds']}s = {result['messages_per_second']} msg/s")
+    print(f"  user_sessions      {result['sessions']} sessions, +{result['session_bytes_growth']} bytes "
+          f"({result['session_bytes_per_session']} per new session), peak RSS {result['peak_rss_mb']} MB")
+    for name, stats in result["fake_services"].items():
+        if stats["calls"]:
+            print(f"  fake {name:<13} {stats['calls']} calls, {stats['injected_errors']} injected errors")
+
+    if baseline is not None:
+        print("\n  vs baseline:")
+        for metric in COMPARED:
+            before, after = baseline.get(metric), result.get(metric)
+            if before and after is not None:
+                print(f"    {metric:<26} {before} -> {after} ({(after - before) / before:+.1%})")
+        for metric, before, after, change in regressions:
+            print(f"  REGRESSION {metric}: {before} -> {after} ({change:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline TaxGuard AI webhook benchmark")
+    parser.add_argument("--app", choices=("cloud", "twilio"), default="cloud")
+    parser.add_argument("--requests", type=int, default=1000, help="webhook calls (default: 1000)")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients (default: 16)")
+    parser.add_argument("--batch", type=int, default=1, help="messages per Cloud API delivery (default: 1)")
+    parser.add_argument("--senders", type=int, default=200, help="distinct users (default: 200)")
+    parser.add_argument("--mix", default="ai=0.6,intent=0.2,tax=0.2", help="message kinds and weights")
+    parser.add_argument("--provider", choices=("openai", "gemini"), default="openai")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests first (default: 20)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout in seconds")
+    parser.add_argument("--drain-timeout", type=float, default=120.0,
+                        help="seconds to wait for outbound replies after the last request")
+    parser.add_argument("--save", metavar="FILE", help="write the results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="earlier --save output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed relative slowdown before a regression is reported (default: 0.10)")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    result = run(args)
+    regressions = compare(result, baseline, args.tolerance) if baseline is not None else []
+    result["regressions"] = [metric for metric, *_ in regressions]
+    report(result, regressions, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
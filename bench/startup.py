@@ -0,0 +1,165 @@
+"""
+TaxGuard AI - Cold start benchmark
+
+Imports a bot module in fresh interpreters (as every gunicorn worker,
+container health check and test run does) and reports, as the median of
+--runs:
+
+- import time and RSS after the import
+- time of the first /health request (Flask apps)
+- heavy modules loaded by the import; provider SDKs, the Twilio REST
+  client and NumPy are created on first use, so none should be listed
+
+Both AI providers are configured with dummy keys so the client setup path
+is measured. Nothing is sent anywhere.
+
+Examples:
+python -m bench.startup
+python -m bench.startup --app cloud --app asgi_cloud --runs 9 --save startup-main.json
+python -m bench.startup --baseline startup-main.json   # exits 1 on a regression
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APPS = {
+    "cloud": "app_cloud_api",
+    "twilio": "app",
+    "asgi_cloud": "asgi_cloud_api",
+    "asgi_twilio": "asgi_app",
+}
+
+# Must not be imported just to start serving
+HEAVY_MODULES = ("openai", "google.generativeai", "twilio.rest", "numpy", "PIL.Image")
+
+# Metrics compared against --baseline (lower is better)
+COMPARED = ("import_ms", "rss_mb", "health_ms")
+
+# Runs in the fresh interpreter; prints one JSON line
+PROBE = """
+import importlib, json, resource, sys, time
+started = time.perf_counter()
+module = importlib.import_module(sys.argv[1])
+import_ms = (time.perf_counter() - started) * 1000
+rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+health_ms = None
+if hasattr(module.app, "test_client"):
+    started = time.perf_counter()
+    status = module.app.test_client().get("/health").status_code
+    health_ms = (time.perf_counter() - started) * 1000
+    assert status == 200, status
+print(json.dumps({
+    "import_ms": import_ms,
+    "rss_mb": rss_mb,
+    "health_ms": health_ms,
+    "modules": len(sys.modules),
+    "heavy_modules": [name for name in sys.argv[2:] if name in sys.modules],
+}))
+"""
+
+
+def probe(module):
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "bench-dummy"),
+        GEMINI_API_KEY=os.getenv("GEMINI_API_KEY", "bench-dummy"),
+        META_ACCESS_TOKEN="bench-dummy",
+        META_PHONE_NUMBER_ID="0",
+        TWILIO_ACCOUNT_SID=os.getenv("TWILIO_ACCOUNT_SID", "ACbench"),
+        TWILIO_AUTH_TOKEN=os.getenv("TWILIO_AUTH_TOKEN", "bench-dummy"),
+        LOG_LEVEL="ERROR",
+    )
+    process = subprocess.run(
+        [sys.executable, "-c", PROBE, module, *HEAVY_MODULES],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if process.returncode != 0:
+        sys.exit(f"importing {module} failed:\n{process.stderr[-2000:]}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def measure(app, runs):
+    samples = [probe(APPS[app]) for _ in range(max(1, runs))]
+    result = {"app": app, "module": APPS[app], "runs": len(samples)}
+    for metric in COMPARED:
+        values = [s[metric] for s in samples if s[metric] is not None]
+        result[metric] = round(statistics.median(values), 1) if values else None
+    result["modules"] = samples[-1]["modules"]
+    result["heavy_modules"] = sorted({name for s in samples for name in s["heavy_modules"]})
+    return result
+
+
+def compare(result, baseline, tolerance):
+    """[(metric, before, after, change)] for metrics worse than baseline by more than tolerance"""
+    regressions = []
+    for metric in COMPARED:
+        before, after = baseline.get(metric), result.get(metric)
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        if change > tolerance:
+            regressions.append((metric, before, after, change))
+    return regressions
+
+
+def report(result, regressions, baseline):
+    health = f"{result['health_ms']} ms" if result["health_ms"] is not None else "n/a"
+    print(f"\n{result['app']} ({result['module']}), median of {result['runs']} runs")
+    print(f"  import             {result['import_ms']} ms, {result['modules']} modules")
+    print(f"  RSS after import   {result['rss_mb']} MB")
+    print(f"  first /health      {health}")
+    print(f"  heavy modules      {', '.join(result['heavy_modules']) or 'none'}"
+          f"{'  REGRESSION: should load on first use' if result['heavy_modules'] else ''}")
+    if baseline is not None:
+        for metric in COMPARED:
+            before, after = baseline.get(metric), result.get(metric)
+            if before and after is not None:
+                print(f"    {metric:<16} {before} -> {after} ({(after - before) / before:+.1%})")
+    for metric, before, after, change in regressions:
+        print(f"  REGRESSION {metric}: {before} -> {after} ({change:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TaxGuard AI cold start benchmark")
+    parser.add_argument("--app", action="append", choices=sorted(APPS),
+                        help="bot module to measure (repeatable; default: cloud and twilio)")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per app (default: 5)")
+    parser.add_argument("--save", metavar="FILE", help="write the results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="earlier --save output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.20,
+                        help="allowed relative slowdown before a regression is reported (default: 0.20)")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {result["app"]: result for result in json.load(f)}
+
+    results = []
+    failed = False
+    for app in args.app or ["cloud", "twilio"]:
+        result = measure(app, args.runs)
+        before = baseline.get(app)
+        regressions = compare(result, before, args.tolerance) if before else []
+        result["regressions"] = [metric for metric, *_ in regressions]
+        if result["heavy_modules"]:
+            result["regressions"].append("heavy_modules")
+        report(result, regressions, before)
+        failed = failed or bool(result["regressions"])
+        results.append(result)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+"""
+TaxGuard AI - Broadcast reminders (filing deadline, filer status)
+
+Sends one message to everyone who has talked to the Cloud API bot:
+
+- recipients are streamed from the session store (SQLite or Redis; the
+  in-memory store only lives inside the serving process, so use
+  --recipients FILE with it) in batches, never loaded all at once
+- sends run on BROADCAST_CONCURRENCY threads over one pooled keep-alive
+  session, paced by one token bucket at BROADCAST_RATE messages/second.
+  Keep it below WHATSAPP_RATE_LIMIT: the bot's replies use the same
+  phone number limit while a campaign runs
+- every result (sent/failed, latency, time) is written to the campaign
+  database in bulk, one transaction per batch. That table is also the
+  checkpoint: running the same --campaign again skips everyone already
+  sent to, so an interrupted campaign resumes where it stopped (at most
+  the last unflushed batch is sent twice)
+- built-in reminders go out in each user's language as remembered in
+  their session (English or Urdu script, see language.py)
+- --dry-run counts the remaining recipients and estimates how long the
+  campaign will take, without sending anything
+
+Outside the 24-hour customer service window Meta only delivers approved
+templates; pass --template NAME to send one instead of the text.
+
+Usage:
+python broadcast.py deadline --campaign deadline-2025 --dry-run
+python broadcast.py deadline --campaign deadline-2025
+python broadcast.py filer_status --campaign atl-2025 --recipients numbers.txt
+python broadcast.py --campaign deadline-2025 --status
+
+Environment Variables (.env file):
+META_ACCESS_TOKEN, META_PHONE_NUMBER_ID, META_API_VERSION, META_GRAPH_URL
+and SESSION_BACKEND/SESSION_* as for app_cloud_api.py
+BROADCAST_DB=path of the campaign database (default: broadcast.db)
+BROADCAST_RATE=messages per second (default: 50)
+BROADCAST_CONCURRENCY=sends in flight (default: 16)
+BROADCAST_BATCH_SIZE=recipients read and results written per batch (default: 500)
+"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from intents import DEADLINE_REPLY, FILER_STATUS_REPLY, reply_context
+from language import DEFAULT_LANGUAGE, TEMPLATE_LANGUAGE
+from session_store import create_session_store
+from structured_log import setup_logging
+from tax_engine import TAX_YEAR
+from whatsapp_sender import WhatsAppSender, template_payload, text_payload
+
+log = logging.getLogger(__name__)
+
+MESSAGES = {
+    "deadline": DEADLINE_REPLY,
+    "filer_status": FILER_STATUS_REPLY,
+}
+
+# Assumed Graph API round trip for --dry-run estimates
+ESTIMATED_SEND_LATENCY = 0.3
+
+
+class CampaignStore:
+    """Campaigns and per-recipient results in SQLite (single-threaded use)"""
+
+    def __init__(self, path="broadcast.db"):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=10, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS campaigns ("
+            " name TEXT PRIMARY KEY,"
+            " payload TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " finished REAL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS deliveries ("
+            " campaign TEXT NOT NULL,"
+            " recipient TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " latency_ms REAL,"
+            " sent_at REAL NOT NULL,"
+            " PRIMARY KEY (campaign, recipient)) WITHOUT ROWID"
+        )
+
+    def open(self, name, payloads):
+        """Create the campaign, or check that a resumed one sends the same messages"""
+        encoded = json.dumps(payloads, sort_keys=True, ensure_ascii=False)
+        row = self.conn.execute("SELECT payload FROM campaigns WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            self.conn.execute(
+                "INSERT INTO campaigns (name, payload, created) VALUES (?, ?, ?)",
+                (name, encoded, time.time())
+            )
+        elif row[0] != encoded:
+            raise ValueError(f"campaign {name!r} was started with a different message; "
+                             "use a new --campaign name")
+
+    def exists(self, name):
+        return self.conn.execute("SELECT 1 FROM campaigns WHERE name = ?", (name,)).fetchone() is not None
+
+    def done(self, name, recipients, retry_failed=False):
+        """The recipients (one batch) that need no new send"""
+        statuses = ("sent",) if retry_failed else ("sent", "failed")
+        found = set()
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(recipients), 500):
+            chunk = recipients[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT recipient FROM deliveries WHERE campaign = ? AND status IN ({','.join('?' * len(statuses))})"
+                f" AND recipient IN ({','.join('?' * len(chunk))})",
+                (name, *statuses, *chunk)
+            ).fetchall()
+            found.update(recipient for (recipient,) in rows)
+        return found
+
+    def record(self, name, results):
+        """Write (recipient, status, latency_ms, sent_at) rows in one transaction"""
+        if not results:
+            return
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO deliveries (campaign, recipient, status, latency_ms, sent_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(name, *result) for result in results]
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def finish(self, name):
+        self.conn.execute("UPDATE campaigns SET finished = ? WHERE name = ?", (time.time(), name))
+
+    def summary(self, name):
+        counts = dict(self.conn.execute(
+            "SELECT status, COUNT(*) FROM deliveries WHERE campaign = ? GROUP BY status", (name,)
+        ).fetchall())
+        row = self.conn.execute("SELECT created, finished FROM campaigns WHERE name = ?", (name,)).fetchone()
+        return {
+            "campaign": name,
+            "sent": counts.get("sent", 0),
+            "failed": counts.get("failed", 0),
+            "created": row[0] if row else None,
+            "finished": row[1] if row else None,
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+class Broadcast:
+    """Streams recipients through a bounded pool of concurrent sends"""
+
+    def __init__(self, sender, store, campaign, payloads, concurrency=16, batch_size=500,
+                 retry_failed=False, language_of=None):
+        self.sender = sender
+        self.store = store
+        self.campaign = campaign
+        self.payloads = payloads  # template language -> payload without "to"
+        self.language_of = language_of
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.retry_failed = retry_failed
+        self._results = queue.SimpleQueue()
+        # Bounds sends queued in the pool, so recipients are read as they are sent
+        self._slots = threading.BoundedSemaphore(self.concurrency * 2)
+        self._seen = set()  # SCAN may return a key twice
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def pending(self, recipients):
+        """Recipients still to send to, one batch at a time"""
+        for batch in _batches(recipients, self.batch_size):
+            batch = [r for r in dict.fromkeys(batch) if r not in self._seen]
+            self._seen.update(batch)
+            done = self.store.done(self.campaign, batch, self.retry_failed)
+            self.skipped += len(done)
+            yield [r for r in batch if r not in done]
+
+    def run(self, recipients):
+        """Send to every pending recipient; returns the counters (also on Ctrl+C)"""
+        started = time.perf_counter()
+        pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="broadcast")
+        finished = False
+        try:
+            for batch in self.pending(recipients):
+                for recipient in batch:
+                    self._slots.acquire()
+                    pool.submit(self._send, recipient)
+                self._flush()
+                self._progress(started)
+            pool.shutdown(wait=True)
+            finished = True
+        except KeyboardInterrupt:
+            log.warning("Broadcast interrupted, saving progress", extra={"campaign": self.campaign})
+            pool.shutdown(wait=True, cancel_futures=True)
+        finally:
+            self._flush()
+
+        if finished:
+            self.store.finish(self.campaign)
+        elapsed = time.perf_counter() - started
+        return {
+            "campaign": self.campaign,
+            "sent": self.sent,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "finished": finished,
+            "seconds": round(elapsed, 1),
+            "per_second": round((self.sent + self.failed) / elapsed, 1) if elapsed else 0.0,
+        }
+
+    def payload_for(self, recipient):
+        language = self.language_of(recipient) if self.language_of else None
+        return self.payloads[TEMPLATE_LANGUAGE.get(language, DEFAULT_LANGUAGE)]
+
+    def _send(self, recipient):
+        started = time.perf_counter()
+        try:
+            ok = self.sender.post(dict(self.payload_for(recipient), to=recipient))
+        except Exception as e:
+            log.error("Broadcast send failed", extra={"recipient": recipient, "error": str(e)})
+            ok = False
+        finally:
+            self._slots.release()
+        latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        self._results.put((recipient, "sent" if ok else "failed", latency_ms, time.time()))
+
+    def _flush(self):
+        results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except queue.Empty:
+                break
+        self.store.record(self.campaign, results)
+        for _, status, _, _ in results:
+            if status == "sent":
+                self.sent += 1
+            else:
+                self.failed += 1
+
+    def _progress(self, started):
+        elapsed = time.perf_counter() - started
+        log.info("Broadcast progress", extra={
+            "campaign": self.campaign,
+            "sent": self.sent,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "per_second": round((self.sent + self.failed) / elapsed, 1) if elapsed else 0.0,
+        })
+
+
+def estimate(count, rate, concurrency, latency=ESTIMATED_SEND_LATENCY):
+    """Seconds to send count messages: the rate limit or the concurrency, whichever binds"""
+    throughput = min(rate, concurrency / latency) if latency > 0 else rate
+    return count / throughput if throughput > 0 else float("inf")
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _read_recipients(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            number = line.strip().lstrip("+")
+            if number and not number.startswith("#"):
+                yield number
+
+
+def main():
+    load_dotenv()
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Send a reminder to everyone who has messaged the bot")
+    parser.add_argument("message", nargs="?", choices=sorted(MESSAGES), help="reminder to send")
+    parser.add_argument("--campaign", required=True,
+                        help="campaign name; running it again resumes it")
+    parser.add_argument("--text", help="send this text instead of a built-in reminder")
+    parser.add_argument("--template", help="approved template name (for users outside the 24h window)")
+    parser.add_argument("--template-language", default="en", help="template language code (default: en)")
+    parser.add_argument("--recipients", help="file with one number per line instead of the session store")
+    parser.add_argument("--rate", type=float, default=float(os.getenv('BROADCAST_RATE', '50')),
+                        help="messages per second")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv('BROADCAST_CONCURRENCY', '16')),
+                        help="sends in flight")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv('BROADCAST_BATCH_SIZE', '500')),
+                        help="recipients read and results written per batch")
+    parser.add_argument("--db", default=os.getenv('BROADCAST_DB', 'broadcast.db'),
+                        help="campaign database")
+    parser.add_argument("--retry-failed", action="store_true", help="send again to recipients that failed")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="count recipients and estimate the duration; send nothing")
+    parser.add_argument("--status", action="store_true", help="print the campaign's results so far")
+    args = parser.parse_args()
+
+    store = CampaignStore(args.db)
+    if args.status:
+        print(json.dumps(store.summary(args.campaign), indent=2))
+        return
+
+    languages = sorted(set(TEMPLATE_LANGUAGE.values()))
+    if args.template:
+        payloads = {language: template_payload(None, args.template, args.template_language)
+                    for language in languages}
+    elif args.text:
+        payloads = {language: text_payload(None, args.text) for language in languages}
+    elif args.message:
+        context = reply_context(TAX_YEAR)
+        payloads = {language: text_payload(None, MESSAGES[args.message][language].format(**context))
+                    for language in languages}
+    else:
+        parser.error("choose a reminder, --text or --template")
+    for payload in payloads.values():
+        payload.pop("to")
+
+    # Also where each user's language is remembered
+    sessions = create_session_store("")
+    if args.recipients:
+        recipients = _read_recipients(args.recipients)
+    else:
+        if sessions.backend == "memory":
+            parser.error("the in-memory session store is not shared between processes; "
+                         "use SESSION_BACKEND=sqlite/redis or --recipients FILE")
+        recipients = sessions.user_ids()
+
+    try:
+        # A dry run checks a resumed campaign's message but creates nothing
+        if not args.dry_run or store.exists(args.campaign):
+            store.open(args.campaign, payloads)
+    except ValueError as e:
+        sys.exit(str(e))
+
+    if args.dry_run:
+        broadcast = Broadcast(None, store, args.campaign, payloads, args.concurrency, args.batch_size,
+                              args.retry_failed)
+        remaining = sum(len(batch) for batch in broadcast.pending(recipients))
+        seconds = estimate(remaining, args.rate, args.concurrency)
+        print(json.dumps({
+            "campaign": args.campaign,
+            "recipients": remaining,
+            "already_done": broadcast.skipped,
+            "rate": args.rate,
+            "concurrency": args.concurrency,
+            "estimated_minutes": round(seconds / 60, 1),
+            "payloads": payloads,
+        }, indent=2, ensure_ascii=False))
+        return
+
+    access_token = os.getenv('META_ACCESS_TOKEN')
+    phone_number_id = os.getenv('META_PHONE_NUMBER_ID')
+    if not access_token or not phone_number_id:
+        sys.exit("META_ACCESS_TOKEN and META_PHONE_NUMBER_ID must be set")
+    graph_url = os.getenv('META_GRAPH_URL', 'https://graph.facebook.com').rstrip('/')
+    api_url = f"{graph_url}/{os.getenv('META_API_VERSION', 'v21.0')}/{phone_number_id}/messages"
+
+    # One pooled session and one token bucket shared by every send thread
+    sender = WhatsAppSender(
+        api_url,
+        access_token,
+        phone_number_id=phone_number_id,
+        pool_size=args.concurrency,
+        connect_timeout=float(os.getenv('WHATSAPP_CONNECT_TIMEOUT', '3.05')),
+        read_timeout=float(os.getenv('WHATSAPP_READ_TIMEOUT', '10')),
+        max_retries=int(os.getenv('WHATSAPP_MAX_RETRIES', '3')),
+        rate_per_second=args.rate,
+        send_workers=1
+    )
+    broadcast = Broadcast(sender, store, args.campaign, payloads, args.concurrency, args.batch_size,
+                          args.retry_failed, language_of=sessions.language)
+    try:
+        result = broadcast.run(recipients)
+    finally:
+        sender.close()
+        store.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
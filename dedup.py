@@ -0,0 +1,123 @@
+"""
+TaxGuard AI - Webhook message de-duplication
+
+Meta and Twilio redeliver webhooks when we acknowledge slowly. Remembering
+the provider message ID (Cloud API message['id'] / Twilio MessageSid) for a
+while lets us drop the retries instead of paying for a second AI call and
+sending a duplicate reply.
+
+Environment Variables (.env file):
+DEDUP_TTL_SECONDS=how long a message ID is remembered (default: 86400)
+DEDUP_MAX_IDS=max IDs kept in memory per process (default: 100000)
+DEDUP_REDIS_URL=redis://host:6379/0 (optional - share IDs across gunicorn workers)
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class MessageDeduplicator:
+    """Remembers recently seen message IDs with TTL and size bounds"""
+
+    def __init__(self, ttl=86400, max_size=100000, redis_url=None, prefix="taxguard:msg:"):
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self.prefix = prefix
+        self._seen = OrderedDict()  # message_id -> expiry (insertion order == expiry order)
+        self._lock = threading.Lock()
+        self._checks = 0
+        self._duplicates = 0
+        self._redis = None
+
+        if redis_url:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.5)
+                self._redis.ping()
+                log.info("Message de-duplication using shared Redis backend")
+            except Exception as e:
+                self._redis = None
+                log.warning("Redis de-duplication unavailable, using in-process cache", extra={"error": str(e)})
+
+    @property
+    def backend(self):
+        return "redis" if self._redis is not None else "memory"
+
+    def seen(self, message_id):
+        """Record message_id; returns True if it was already seen (a redelivery)"""
+        if not message_id:
+            return False
+
+        duplicate = self._check_shared(message_id)
+        if duplicate is None:
+            duplicate = self._check_local(message_id)
+
+        with self._lock:
+            self._checks += 1
+            if duplicate:
+                self._duplicates += 1
+        return duplicate
+
+    def forget(self, message_ids):
+        """Drop IDs again, e.g. when a message was accepted but could not be queued"""
+        ids = [message_id for message_id in message_ids if message_id]
+        if not ids:
+            return
+
+        with self._lock:
+            for message_id in ids:
+                self._seen.pop(message_id, None)
+
+        if self._redis is not None:
+            try:
+                self._redis.delete(*[self.prefix + message_id for message_id in ids])
+            except Exception as e:
+                log.warning("Redis de-duplication forget failed", extra={"error": str(e)})
+
+    def stats(self):
+        """Hit-rate counters for /health (each duplicate is one AI call saved)"""
+        with self._lock:
+            checks = self._checks
+            duplicates = self._duplicates
+            size = len(self._seen)
+        return {
+            "backend": self.backend,
+            "checks": checks,
+            "duplicates": duplicates,
+            "hit_rate": round(duplicates / checks, 4) if checks else 0.0,
+            "ai_calls_saved": duplicates,
+            "local_ids": size,
+        }
+
+    def _check_shared(self, message_id):
+        """SET NX in Redis; returns None if Redis is not available"""
+        if self._redis is None:
+            return None
+        try:
+            created = self._redis.set(self.prefix + message_id, 1, nx=True, ex=self.ttl)
+            return not created
+        except Exception as e:
+            log.warning("Redis de-duplication failed, using in-process cache", extra={"error": str(e)})
+            return None
+
+    def _check_local(self, message_id):
+        now = time.monotonic()
+        with self._lock:
+            # Expired IDs are always at the front
+            while self._seen:
+                _, expires = next(iter(self._seen.items()))
+                if expires > now:
+                    break
+                self._seen.popitem(last=False)
+
+            if message_id in self._seen:
+                return True
+
+            self._seen[message_id] = now + self.ttl
+            if len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+            return False
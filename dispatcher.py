@@ -0,0 +1,276 @@
+"""
+TaxGuard AI - Background webhook dispatcher
+
+Lets the webhook handler acknowledge Meta immediately and hand the slow
+work (AI response + outbound reply) to a bounded pool of worker threads.
+
+Work is sharded by sender: every sender ID hashes to one of N shards and
+each shard has a single worker, so one user's messages are always handled
+one at a time and in arrival order (no races on their conversation
+history), while different users run in parallel. Inside a shard senders
+take turns, one job each, so a chatty user cannot starve the others.
+
+Environment Variables (.env file):
+WEBHOOK_DISPATCH_MODE=inline or background (default: inline)
+WEBHOOK_WORKERS=number of shards, one worker thread each (default: 4)
+WEBHOOK_QUEUE_SIZE=max queued jobs before new webhooks are rejected (default: 500)
+WEBHOOK_MAX_PER_SENDER=max queued jobs for one sender (default: 50)
+WEBHOOK_DRAIN_TIMEOUT=seconds to wait for queued jobs on shutdown (default: 25)
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from metrics import STAGE_SECONDS
+
+log = logging.getLogger(__name__)
+
+
+class StageStats:
+    """Latency counters for one processing stage"""
+
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def as_dict(self):
+        avg = self.total / self.count if self.count else 0.0
+        return {
+            "count": self.count,
+            "avg_ms": round(avg * 1000, 2),
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+class _Shard:
+    """One single-consumer queue: pending jobs per sender, served round-robin"""
+
+    __slots__ = ("cond", "jobs", "ring", "depth", "processed", "stopping", "thread")
+
+    def __init__(self, lock):
+        self.cond = threading.Condition(lock)
+        self.jobs = {}        # sender -> deque of jobs, in arrival order
+        self.ring = deque()   # senders with pending jobs, next to be served first
+        self.depth = 0
+        self.processed = 0
+        self.stopping = False
+        self.thread = None
+
+    def push(self, key, job):
+        pending = self.jobs.get(key)
+        if pending is None:
+            pending = self.jobs[key] = deque()
+            self.ring.append(key)
+        pending.append(job)
+        self.depth += 1
+
+    def pop(self):
+        # Serve one job for the sender at the front, then send it to the back
+        key = self.ring.popleft()
+        pending = self.jobs[key]
+        job = pending.popleft()
+        if pending:
+            self.ring.append(key)
+        else:
+            del self.jobs[key]
+        self.depth -= 1
+        return job
+
+    def clear(self):
+        jobs = [job for pending in self.jobs.values() for job in pending]
+        self.jobs.clear()
+        self.ring.clear()
+        self.depth = 0
+        return jobs
+
+
+class WebhookDispatcher:
+    """Sender-sharded job queues, each drained in order by its own worker thread"""
+
+    def __init__(self, name="webhook", workers=4, max_queue=500, max_per_sender=50,
+                 drain_timeout=25.0):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.max_per_sender = max(1, max_per_sender)
+        self.drain_timeout = drain_timeout
+        self._lock = threading.Lock()
+        self._shards = [_Shard(threading.Lock()) for _ in range(self.workers)]
+        self._shard_limit = -(-self.max_queue // self.workers)
+        self._stages = {}
+        self._accepted = 0
+        self._rejected = 0
+        self._failed = 0
+        self._started = False
+        self._closing = False
+        self._exit_hook = False
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Worker threads do not survive fork() (e.g. gunicorn preload_app):
+        # fresh, empty shards whose workers start on the first call
+        self._lock = threading.Lock()
+        self._shards = [_Shard(threading.Lock()) for _ in range(self.workers)]
+        self._started = False
+
+    def start(self):
+        """Start one worker thread per shard (safe to call more than once)"""
+        with self._lock:
+            if self._started:
+                return
+            for i, shard in enumerate(self._shards):
+                shard.thread = threading.Thread(
+                    target=self._run, args=(shard,), name=f"{self.name}-shard-{i}", daemon=True
+                )
+                shard.thread.start()
+            self._started = True
+            exit_hook, self._exit_hook = self._exit_hook, True
+        if not exit_hook:
+            atexit.register(self.shutdown)
+
+    def shard_for(self, key):
+        return zlib.crc32(str(key).encode("utf-8")) % self.workers
+
+    def call(self, key, fn, *args, **kwargs):
+        """Queue a job behind key's earlier jobs; returns a Future, or None if rejected"""
+        if not self._started:
+            self.start()
+
+        future = Future()
+        shard = self._shards[self.shard_for(key)]
+        with shard.cond:
+            pending = shard.jobs.get(key)
+            accepted = (
+                not self._closing
+                and shard.depth < self._shard_limit
+                and (pending is None or len(pending) < self.max_per_sender)
+            )
+            if accepted:
+                shard.push(key, (time.perf_counter(), future, fn, args, kwargs))
+                shard.cond.notify()
+
+        with self._lock:
+            if accepted:
+                self._accepted += 1
+            else:
+                self._rejected += 1
+        return future if accepted else None
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Queue a job for key; returns False if the queue is full or shutting down"""
+        return self.call(key, fn, *args, **kwargs) is not None
+
+    def record(self, stage, seconds):
+        """Record how long a stage took"""
+        STAGE_SECONDS.labels(self.name, stage).observe(seconds)
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = StageStats()
+            stats.add(seconds)
+
+    @contextmanager
+    def timed(self, stage):
+        """Context manager that records the duration of a stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def depth(self):
+        """Jobs queued and not yet started, over all shards"""
+        return sum(shard.depth for shard in self._shards)
+
+    def stats(self):
+        """Snapshot of queue, shard and stage counters for /health"""
+        shards = []
+        for shard in self._shards:
+            with shard.cond:
+                shards.append({
+                    "depth": shard.depth,
+                    "senders": len(shard.jobs),
+                    "processed": shard.processed,
+                })
+
+        with self._lock:
+            stages = {name: s.as_dict() for name, s in self._stages.items()}
+            return {
+                "workers": self.workers,
+                "queue_depth": sum(s["depth"] for s in shards),
+                "queue_limit": self.max_queue,
+                "max_per_sender": self.max_per_sender,
+                "accepted": self._accepted,
+                "rejected": self._rejected,
+                "failed": self._failed,
+                "shards": shards,
+                "stages": stages,
+            }
+
+    def shutdown(self, drain=True):
+        """Stop accepting jobs and optionally wait for queued ones to finish"""
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+
+        for shard in self._shards:
+            with shard.cond:
+                if not drain:
+                    # Throw away whatever has not started yet
+                    for _, future, _, _, _ in shard.clear():
+                        future.cancel()
+                # Workers finish their queued jobs before they see this
+                shard.stopping = True
+                shard.cond.notify()
+
+        deadline = time.monotonic() + self.drain_timeout
+        for shard in self._shards:
+            if shard.thread is not None:
+                shard.thread.join(max(0.0, deadline - time.monotonic()))
+
+        pending = self.depth()
+        if pending:
+            log.warning("Dispatcher stopped with jobs still queued", extra={"dispatcher": self.name, "pending": pending})
+
+    def _run(self, shard):
+        while True:
+            with shard.cond:
+                while not shard.ring:
+                    if shard.stopping:
+                        return
+                    shard.cond.wait()
+                enqueued_at, future, fn, args, kwargs = shard.pop()
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            started = time.perf_counter()
+            self.record("queue_wait", started - enqueued_at)
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                with self._lock:
+                    self._failed += 1
+                log.exception("Dispatcher job failed", extra={"dispatcher": self.name})
+                future.set_exception(e)
+            finally:
+                self.record("job", time.perf_counter() - started)
+                with shard.cond:
+                    shard.processed += 1
@@ -0,0 +1,51 @@
+"""
+TaxGuard AI - gunicorn settings
+
+gunicorn -c gunicorn.conf.py app_cloud_api:app
+gunicorn -c gunicorn.conf.py app:app
+gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi_cloud_api:app
+
+With preload_app the bot module is imported once, in the master, and the
+workers are forked from it: configuration, prompts, tax tables, intents
+and the AI SDKs (imported in when_ready, see ai_clients.preload_sdks) are
+shared copy-on-write instead of being loaded by every worker. Nothing
+that holds a connection or a thread is created before the fork: SDK
+clients, the Twilio client and SQLite connections are created on first
+use in each worker, and dispatcher/log threads restart after the fork.
+
+Environment Variables (.env file):
+PORT=port to listen on (default: 5000)
+WEB_CONCURRENCY=worker processes (default: 2)
+GUNICORN_THREADS=threads per worker (default: 8)
+GUNICORN_PRELOAD=true or false (default: true)
+GUNICORN_TIMEOUT=seconds before a silent worker is restarted (default: 120)
+"""
+
+import gc
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+# Leave the dispatcher time to drain queued replies on shutdown
+graceful_timeout = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', '25')) + 5
+
+
+def when_ready(server):
+    """Runs in the master after the app is loaded, before workers are forked"""
+    if not preload_app:
+        return
+
+    from ai_clients import preload_sdks
+    from tax_engine import load_numpy
+
+    preload_sdks()
+    load_numpy()
+    # Keep the collector from touching (and so copying) the preloaded objects
+    gc.freeze()
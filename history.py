@@ -0,0 +1,120 @@
+"""
+TaxGuard AI - Token-budget conversation window
+
+Chooses which past turns go into a prompt by token count rather than by a
+fixed number of messages: the newest turns are packed into a per-provider
+budget, so a long pasted payslip cannot blow the context limit and short
+chats are not padded. Older turns that no longer fit can optionally be
+collapsed into a short running summary.
+
+Token counts use tiktoken when it is installed and a character-based
+estimate otherwise. Each turn's count is computed once and cached on the
+turn (and stored with it by the persistent session backends).
+
+Environment Variables (.env file):
+HISTORY_TOKEN_BUDGET_OPENAI=tokens of history sent to OpenAI (default: 2500)
+HISTORY_TOKEN_BUDGET_GEMINI=tokens of history sent to Gemini (default: 6000)
+HISTORY_SUMMARY=true to summarize turns that fall out of the budget (default: false)
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+
+# Every chat message costs a few tokens of framing on top of its content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_SENTENCE_END = re.compile(r"(?<=[.!?۔؟])\s+")
+
+
+def count_tokens(text):
+    """Token count for text (exact with tiktoken, estimated otherwise)"""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    # ~4 characters per token for English; Urdu script tokenizes far worse
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return max(1, ascii_chars // 4 + (len(text) - ascii_chars))
+
+
+def turn_tokens(turn):
+    """Cached token count of a stored turn, including message framing"""
+    if turn.tokens is None:
+        turn.tokens = count_tokens(turn.content) + MESSAGE_OVERHEAD_TOKENS
+    return turn.tokens
+
+
+class HistoryWindow:
+    """Packs the newest turns into a token budget"""
+
+    def __init__(self, budget_tokens, summarize=False, summary_chars=400, cache_size=2000):
+        self.budget_tokens = budget_tokens
+        self.summarize = summarize
+        self.summary_chars = summary_chars
+        self._summaries = OrderedDict()  # hash of dropped turns -> summary text
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def select(self, turns):
+        """Split turns (oldest first) into (dropped, kept) by the token budget"""
+        used = 0
+        start = len(turns)
+        for i in range(len(turns) - 1, -1, -1):
+            cost = turn_tokens(turns[i])
+            # The newest turn is always sent, even if it alone exceeds the budget
+            if used + cost > self.budget_tokens and i < len(turns) - 1:
+                break
+            used += cost
+            start = i
+        return turns[:start], turns[start:]
+
+    def build(self, system_prompt, turns):
+        """Chat messages for the prompt: system prompt, optional summary, kept turns"""
+        dropped, kept = self.select(turns)
+
+        messages = [{"role": "system", "content": system_prompt}]
+        if self.summarize and dropped:
+            messages.append({
+                "role": "system",
+                "content": f"Earlier in this conversation: {self.summary(dropped)}"
+            })
+        messages.extend(turn.as_message() for turn in kept)
+        return messages
+
+    def summary(self, turns):
+        """Short extractive summary of turns, cached by their content"""
+        digest = hashlib.sha1()
+        for turn in turns:
+            digest.update(turn.role.encode())
+            digest.update(turn.content.encode("utf-8"))
+        key = digest.hexdigest()
+
+        with self._lock:
+            cached = self._summaries.get(key)
+            if cached is not None:
+                self._summaries.move_to_end(key)
+                return cached
+
+        parts = []
+        for turn in turns:
+            first = _SENTENCE_END.split(turn.content.strip(), 1)[0]
+            label = "User" if turn.role == "user" else "Assistant"
+            parts.append(f"{label}: {first[:120]}")
+        text = " | ".join(parts)
+        if len(text) > self.summary_chars:
+            # Keep the most recent part of the summary
+            text = "…" + text[-self.summary_chars:]
+
+        with self._lock:
+            self._summaries[key] = text
+            if len(self._summaries) > self._cache_size:
+                self._summaries.popitem(last=False)
+        return text
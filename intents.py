@@ -0,0 +1,229 @@
+"""
+TaxGuard AI - Local intent routing
+
+Greetings, the calculation prompt and common FBR questions (filer status,
+NTN registration, filing deadlines) are answered from canned replies
+without calling the AI provider. All intents live in the INTENTS table
+below; at startup every phrase is normalized the same way as incoming
+messages (case, punctuation, Urdu letters, Roman Urdu spellings) and the
+whole table is compiled into a single word-bounded pattern, so a message
+is scanned once no matter how many intents there are. Every reply has an
+English and an Urdu template (see language.py), each rendered once when
+the router is built.
+
+Greetings and thanks only match a message that is nothing else: "hi, how
+do I file my return late?" is a question, and it is matched (and its
+words counted) without the leading "hi", so it goes to the AI unless it
+is one of the short FAQ questions.
+"""
+
+import re
+import threading
+from collections import namedtuple
+
+from language import DEFAULT_LANGUAGE, TEMPLATE_LANGUAGE
+from response_cache import normalize_question
+from tax_engine import TAX_YEAR
+
+# exact: the whole message must be one of the phrases (greetings);
+# otherwise a phrase anywhere in the message matches.
+# max_words: longer messages are left to the AI (None = any length)
+# reply: {"en": ..., "ur": ...} in INTENTS; one rendered string once matched
+Intent = namedtuple("Intent", "name phrases reply exact max_words")
+
+WELCOME_MESSAGE = {
+    "en": """🇵🇰 *Welcome to TaxGuard AI*
+
+Pakistan's intelligent tax assistant. I can help you with:
+✅ Tax calculations
+✅ Filing guidance
+✅ Deduction tips
+✅ FBR questions
+
+Try asking:
+• "Mera tax calculate karo"
+• "How do I file tax return?"
+• "What deductions can I claim?"
+
+*Type your question in English or Urdu!* 🤖""",
+    "ur": """🇵🇰 *TaxGuard AI - خوش آمدید*
+
+پاکستان کا ذہین ٹیکس اسسٹنٹ۔ میں ان کاموں میں مدد کر سکتا ہوں:
+✅ ٹیکس کا حساب
+✅ فائلنگ کی رہنمائی
+✅ کٹوتیوں کی تجاویز
+✅ ایف بی آر کے سوالات
+
+مثال کے طور پر پوچھیں:
+• "میرا ٹیکس کتنا بنے گا؟"
+• "ٹیکس ریٹرن کیسے جمع کروائیں؟"
+• "میں کون سی کٹوتیاں لے سکتا ہوں؟"
+
+*اپنا سوال اردو یا انگریزی میں لکھیں!* 🤖""",
+}
+
+CALCULATION_PROMPT = {
+    "en": """💰 *Tax Calculation*
+
+Please provide:
+1️⃣ Your monthly salary (e.g., "50000")
+2️⃣ Your profession (e.g., "software engineer")
+3️⃣ Your city (e.g., "Karachi")
+
+Example: "Monthly income 80000, software engineer, Islamabad\"""",
+    "ur": """💰 *ٹیکس کا حساب*
+
+براہ کرم بتائیں:
+1️⃣ ماہانہ تنخواہ (مثلاً "50000")
+2️⃣ پیشہ (مثلاً "ٹیچر")
+3️⃣ شہر (مثلاً "کراچی")
+
+مثال: "ماہانہ تنخواہ 80000، ٹیچر، لاہور\"""",
+}
+
+FILER_STATUS_REPLY = {
+    "en": """✅ *Filer Status (ATL)*
+
+You are a filer if your name is on FBR's Active Taxpayers List (ATL).
+
+Check your status:
+• SMS "ATL <your CNIC>" to *9966*
+• Or use "Online Verification" on e.fbr.gov.pk
+
+To become a filer, file your income tax return for tax year {tax_year} on iris.fbr.gov.pk. Returns filed after the due date appear on the ATL once the late-filing surcharge is paid.""",
+    "ur": """✅ *فائلر اسٹیٹس (ATL)*
+
+اگر آپ کا نام ایف بی آر کی ایکٹو ٹیکس پیئرز لسٹ (ATL) میں ہے تو آپ فائلر ہیں۔
+
+اپنا اسٹیٹس چیک کریں:
+• "ATL <اپنا شناختی کارڈ نمبر>" لکھ کر *9966* پر SMS کریں
+• یا e.fbr.gov.pk پر "Online Verification" استعمال کریں
+
+فائلر بننے کے لیے ٹیکس سال {tax_year} کا انکم ٹیکس ریٹرن iris.fbr.gov.pk پر جمع کروائیں۔ آخری تاریخ کے بعد جمع ہونے والے ریٹرن لیٹ فائلنگ سرچارج ادا ہونے پر ATL میں آتے ہیں۔""",
+}
+
+NTN_REPLY = {
+    "en": """🆔 *NTN Registration*
+
+For individuals your CNIC number is your NTN. Register once on IRIS:
+1️⃣ Open iris.fbr.gov.pk → "Registration for Unregistered Person"
+2️⃣ Enter your CNIC, mobile number (in your name) and email
+3️⃣ Enter the codes sent by SMS and email, then set your password
+
+After that you can file your return from the same account.""",
+    "ur": """🆔 *این ٹی این رجسٹریشن*
+
+انفرادی افراد کے لیے شناختی کارڈ نمبر ہی این ٹی این ہے۔ IRIS پر ایک بار رجسٹر کریں:
+1️⃣ iris.fbr.gov.pk کھولیں → "Registration for Unregistered Person"
+2️⃣ اپنا شناختی کارڈ نمبر، اپنے نام پر موبائل نمبر اور ای میل درج کریں
+3️⃣ SMS اور ای میل پر آنے والے کوڈ درج کریں، پھر پاس ورڈ بنائیں
+
+اس کے بعد آپ اسی اکاؤنٹ سے اپنا ریٹرن جمع کروا سکتے ہیں۔""",
+}
+
+DEADLINE_REPLY = {
+    "en": """📅 *Filing Deadline*
+
+Tax year {tax_year} ends on 30 June {tax_year_end}. Income tax returns for salaried individuals and individuals with business income are due by *30 September {tax_year_end}* unless FBR extends the date.
+
+Filing late means a late-filing surcharge and a higher withholding rate as a non-filer until you appear on the ATL.""",
+    "ur": """📅 *آخری تاریخ*
+
+ٹیکس سال {tax_year} 30 جون {tax_year_end} کو ختم ہوتا ہے۔ تنخواہ دار اور کاروباری افراد کے انکم ٹیکس ریٹرن کی آخری تاریخ *30 ستمبر {tax_year_end}* ہے، جب تک ایف بی آر اسے نہ بڑھائے۔
+
+دیر سے فائل کرنے پر لیٹ فائلنگ سرچارج لگتا ہے اور ATL میں نام آنے تک نان فائلر کی زیادہ ودہولڈنگ شرح لاگو ہوتی ہے۔""",
+}
+
+THANKS_REPLY = {
+    "en": "😊 You're welcome! Ask me anything else about your taxes.",
+    "ur": "😊 خوش رہیں! ٹیکس کے بارے میں کچھ اور پوچھنا ہو تو ضرور پوچھیں۔",
+}
+
+# Checked in this order: when several intents match, the first one wins
+INTENTS = [
+    Intent("welcome", ["start", "شروع", "hello", "hi", "السلام علیکم", "salam",
+                       "assalam o alaikum", "assalamualaikum", "aoa", "menu"],
+           WELCOME_MESSAGE, exact=True, max_words=None),
+    Intent("thanks", ["thanks", "thank you", "thankyou", "shukriya", "shukria", "شکریہ",
+                      "jazakallah", "جزاک اللہ"],
+           THANKS_REPLY, exact=True, max_words=None),
+    Intent("calculate", ["calculate", "calculation", "calculator", "حساب", "tax kitna", "کتنا ٹیکس"],
+           CALCULATION_PROMPT, exact=False, max_words=6),
+    Intent("filer_status", ["filer", "non filer", "nonfiler", "filer status", "active taxpayer",
+                            "active taxpayers list", "atl", "فائلر", "نان فائلر"],
+           FILER_STATUS_REPLY, exact=False, max_words=12),
+    Intent("ntn", ["ntn", "national tax number", "ntn number", "fbr registration",
+                   "register with fbr", "iris registration", "این ٹی این"],
+           NTN_REPLY, exact=False, max_words=12),
+    Intent("deadline", ["deadline", "last date", "due date", "akhri tareekh", "aakhri tareekh",
+                        "akhri tarikh", "آخری تاریخ"],
+           DEADLINE_REPLY, exact=False, max_words=12),
+]
+
+
+def reply_context(year=None):
+    """Values available to reply templates"""
+    year = year or TAX_YEAR
+    return {"tax_year": year, "tax_year_end": int(year[:4]) + 1}
+
+
+class IntentRouter:
+    """Matches a message against every intent phrase in one pass"""
+
+    def __init__(self, intents=INTENTS, year=None):
+        context = reply_context(year)
+        # Replies are rendered once here, not per message: one intent list per template language
+        self._by_language = {
+            language: [intent._replace(reply=intent.reply[language].format(**context)) for intent in intents]
+            for language in set(TEMPLATE_LANGUAGE.values())
+        }
+        self.intents = self._by_language[DEFAULT_LANGUAGE]
+        self._exact = {}
+        self._phrases = {}  # normalized phrase -> index of its intent
+        for index, intent in enumerate(self.intents):
+            for phrase in intent.phrases:
+                key = normalize_question(phrase)
+                if intent.exact:
+                    self._exact.setdefault(key, index)
+                else:
+                    self._phrases.setdefault(key, index)
+
+        alternatives = sorted(map(re.escape, self._phrases), key=len, reverse=True)
+        self._pattern = re.compile(r"(?<!\w)(?:" + "|".join(alternatives) + r")(?!\w)")
+        # A greeting in front of a question: "hi how do i ..." -> "how do i ..."
+        greetings = sorted(map(re.escape, self._exact), key=len, reverse=True)
+        self._greeting = re.compile(r"(?:" + "|".join(greetings) + r") (?=\w)") if greetings else None
+        self._lock = threading.Lock()
+        self._hits = {intent.name: 0 for intent in self.intents}
+        self._misses = 0
+
+    def match(self, message, language=DEFAULT_LANGUAGE):
+        """The matching Intent (reply rendered in language), or None"""
+        text = normalize_question(message)
+        index = self._exact.get(text)
+
+        if index is None and self._greeting is not None:
+            greeting = self._greeting.match(text)
+            if greeting:
+                text = text[greeting.end():]
+
+        if index is None and self._phrases:
+            words = text.count(" ") + 1
+            for found in self._pattern.finditer(text):
+                candidate = self._phrases[found.group(0)]
+                max_words = self.intents[candidate].max_words
+                if (max_words is None or words <= max_words) and (index is None or candidate < index):
+                    index = candidate
+
+        with self._lock:
+            if index is None:
+                self._misses += 1
+                return None
+            intent = self._by_language[TEMPLATE_LANGUAGE.get(language, DEFAULT_LANGUAGE)][index]
+            self._hits[intent.name] += 1
+        return intent
+
+    def stats(self):
+        """Matches per intent for /health"""
+        with self._lock:
+            return {"hits": dict(self._hits), "misses": self._misses}
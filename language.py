@@ -0,0 +1,95 @@
+"""
+TaxGuard AI - Local language detection
+
+Users write in English, in Urdu (Arabic script) or in Roman Urdu ("mera
+tax kitna hai"). The language is decided locally, without asking the
+model, from the characters and words of the message:
+
+- Arabic-script letters (Urdu/Arabic Unicode blocks) -> "ur"
+- Latin words with enough Roman Urdu words from ROMAN_URDU_WORDS -> "roman_ur"
+- other Latin text of two words or more -> "en"
+- anything shorter or without letters ("ok", "50000", emoji) -> None, and
+  the language remembered in the user's session is kept
+
+The language picks the system prompt variant (one reply language instead
+of "detect language automatically") and the reply templates, so prompts,
+answers and static replies carry one language instead of two. Roman Urdu
+readers get the English templates, which are in the same script.
+"""
+
+import re
+
+LANGUAGES = ("en", "ur", "roman_ur")
+DEFAULT_LANGUAGE = "en"
+
+# Reply templates exist in English and Urdu script
+TEMPLATE_LANGUAGE = {"en": "en", "ur": "ur", "roman_ur": "en"}
+
+# Replaces "detect language automatically" in the system prompt
+PROMPT_INSTRUCTIONS = {
+    "en": "Reply in English",
+    "ur": "Reply in Urdu, written in Urdu script",
+    "roman_ur": "Reply in Roman Urdu (Urdu written in English letters), as the user writes",
+}
+
+# Common Roman Urdu words that are not also common English words
+# ("main", "me", "to", "do", "par", "the" are left out for that reason)
+ROMAN_URDU_WORDS = frozenset("""
+    aap ap apna apni apne aur bhi bohat bohot bahut batao bataen bataein bata bataye chahiye
+    dein hai hain hay hy hun hoon ho hoga hogi hoti hota hum humein hamara hamari
+    jab jaise jata jati jo ka kab kahan kaise kaisay kar karo karna karein karen karta karti
+    ke ki kis kitna kitni kitne ko koi kon kya kyun kyu liye lye mein mai mera meri mere
+    mujhe mjhe nahi nahin nai naheen raha rahi rahe sakta sakti sakte se sirf tha thi
+    tou tum unka unki wala wali wale woh yeh ye zaroor shukriya shukria meherbani
+    tankhwah tankhwa tankha salana mahana maheena mahina kamai amdani amdan hisab
+""".split())
+
+_ARABIC_SCRIPT = re.compile("[\u0600-\u06ff\u0750-\u077f\u08a0-\u08ff\ufb50-\ufdff\ufe70-\ufefe]")
+_LATIN_WORD = re.compile(r"[a-z]+")
+
+# Roman Urdu when at least this share of the Latin words are on the list
+ROMAN_URDU_SHARE = 0.25
+
+
+def detect_language(text):
+    """Language of text ("en", "ur" or "roman_ur"), or None when it is too short to tell"""
+    if not text:
+        return None
+    arabic = len(_ARABIC_SCRIPT.findall(text))
+    words = _LATIN_WORD.findall(text.lower())
+    latin = sum(map(len, words))
+
+    if arabic >= 2 and arabic >= latin:
+        return "ur"
+    if not words:
+        return None
+
+    roman = sum(1 for word in words if word in ROMAN_URDU_WORDS)
+    if roman >= 2 or (roman and roman >= ROMAN_URDU_SHARE * len(words)):
+        return "roman_ur"
+    if len(words) >= 2:
+        return "en"
+    return None
+
+
+def conversation_language(sessions, user_id, text, remember=True):
+    """Language to answer text in: detected from it, else the one in the user's session
+
+    With remember, a newly detected language is saved in the session
+    (written only when it changes).
+    """
+    detected = detect_language(text)
+    if detected is not None and not remember:
+        return detected
+
+    stored = sessions.language(user_id)
+    if detected is None:
+        return stored or DEFAULT_LANGUAGE
+    if detected != stored:
+        sessions.set_language(user_id, detected)
+    return detected
+
+
+def localized(templates, language):
+    """The template for a language from an {"en": ..., "ur": ...} dict"""
+    return templates[TEMPLATE_LANGUAGE.get(language, DEFAULT_LANGUAGE)]
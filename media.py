@@ -0,0 +1,296 @@
+"""
+TaxGuard AI - Receipt and document photos
+
+Images (and documents that are images) sent to the Cloud API bot go
+through four steps:
+
+1. resolve: the media ID -> download URL, MIME type, size and sha256 (Graph API)
+2. download: streamed in chunks into a temp file and hashed on the way;
+   it is aborted as soon as it passes MEDIA_MAX_BYTES, so a file is never
+   held in memory whole
+3. prepare: a process pool opens the temp file, downscales it to
+   MEDIA_MAX_DIMENSION and re-encodes it as JPEG (Pillow), so decoding
+   large photos never competes with the webhook threads for the GIL.
+   Its workers come from a forkserver (spawn where that is unavailable),
+   never from fork(): the pool is created lazily inside a threaded
+   server, and a forked child could inherit locks held by other threads
+   (logging, connection pools, the session store) and deadlock
+4. extract: the small JPEG goes to the AI provider (vision)
+
+Extracted answers are cached by content hash and variant (the caption and
+reply language the answer was written for): a receipt that is sent again
+with the same caption (Meta reports the same sha256) is answered without
+downloading it or calling the AI. PDFs are not supported; users are
+asked for a photo.
+
+A worker that dies (a decoder crash, the OOM killer) breaks the whole
+pool; the broken pool is dropped and the image is prepared once more in
+a new one.
+
+The Graph API host is configurable (META_GRAPH_URL), so the pipeline runs
+against the media stand-in in bench/fake_services.py.
+
+Environment Variables (.env file):
+MEDIA_ENABLED=true or false (default: true)
+MEDIA_MAX_BYTES=largest file accepted (default: 10485760)
+MEDIA_MAX_DIMENSION=longest side in pixels sent to the AI (default: 1600)
+MEDIA_JPEG_QUALITY=JPEG quality of the prepared image (default: 80)
+MEDIA_WORKERS=processes preparing images (default: 2)
+MEDIA_CACHE_SIZE=extracted receipts kept in memory (default: 1000)
+MEDIA_TEMP_DIR=directory downloads are spooled to (default: system temp dir)
+"""
+
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import requests
+
+log = logging.getLogger(__name__)
+
+# What the vision models accept; anything else is refused before download
+SUPPORTED_TYPES = {"image/jpeg", "image/png", "image/webp"}
+
+CHUNK_SIZE = 64 * 1024
+
+UNSUPPORTED_MESSAGE = ("📎 Please send your receipt or tax document as a photo (JPG or PNG). "
+                       "/ براہ کرم رسید کی تصویر بھیجیں۔")
+TOO_LARGE_MESSAGE = "📎 That file is too large. Please send a smaller photo. / فائل بہت بڑی ہے۔"
+DOWNLOAD_FAILED_MESSAGE = ("📎 Sorry, I couldn't download that file. Please send it again. "
+                           "/ فائل ڈاؤن لوڈ نہیں ہو سکی، دوبارہ بھیجیں۔")
+
+
+def pool_context():
+    """Start method for the worker pool: forkserver, or spawn where unavailable"""
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    context = multiprocessing.get_context(method)
+    if method == "forkserver":
+        # The server imports only this module, not the bot that started it
+        context.set_forkserver_preload([__name__])
+    return context
+
+
+class MediaError(Exception):
+    """A media message that cannot be processed; str(e) is the reply for the user"""
+
+
+def prepare_image(path, max_dimension, quality):
+    """Downscaled JPEG bytes of the image at path (runs in a worker process)
+
+    Returns (data, mime_type). Without Pillow the file is passed on as is.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        with open(path, "rb") as f:
+            return f.read(), None
+
+    with Image.open(path) as image:
+        # JPEG: let the decoder scale down while decoding (much less memory)
+        image.draft("RGB", (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_dimension, max_dimension))
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=quality, optimize=True)
+    return output.getvalue(), "image/jpeg"
+
+
+class MediaCache:
+    """Extracted answers by content hash and variant (LRU)"""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max(1, max_entries)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, digest, variant=None):
+        if not digest:
+            return None
+        key = (digest, variant)
+        with self._lock:
+            answer = self._entries.get(key)
+            if answer is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return answer
+
+    def put(self, digest, answer, variant=None):
+        key = (digest, variant)
+        with self._lock:
+            self._entries[key] = answer
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self._hits, "misses": self._misses}
+
+
+class MediaPipeline:
+    """Resolve -> streamed download -> downscale in a process pool -> extract"""
+
+    def __init__(self, graph_url, access_token, api_version="v21.0", max_bytes=10 * 1024 * 1024,
+                 max_dimension=1600, jpeg_quality=80, workers=2, cache_size=1000,
+                 temp_dir=None, connect_timeout=3.05, read_timeout=30.0):
+        self.graph_url = graph_url.rstrip("/")
+        self.api_version = api_version
+        self.max_bytes = max_bytes
+        self.max_dimension = max_dimension
+        self.jpeg_quality = jpeg_quality
+        self.workers = max(1, workers)
+        self.temp_dir = temp_dir
+        self.timeout = (connect_timeout, read_timeout)
+        self.cache = MediaCache(cache_size)
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {access_token}"
+        # Worker processes are started on the first photo, not at import
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._processed = 0
+        self._rejected = 0
+        self._bytes_downloaded = 0
+
+    def process(self, media_id, extract, variant=None):
+        """Answer for one media message; extract(data, mime_type) -> text calls the AI
+
+        variant holds whatever else extract's answer depends on (caption,
+        reply language); answers are only reused for the same variant.
+        Raises MediaError with a user-facing message when the file is
+        refused or cannot be downloaded.
+        """
+        info = self.resolve(media_id)
+        mime_type = (info.get("mime_type") or "").split(";")[0].strip().lower()
+        if mime_type not in SUPPORTED_TYPES:
+            self._reject()
+            raise MediaError(UNSUPPORTED_MESSAGE)
+        if int(info.get("file_size") or 0) > self.max_bytes:
+            self._reject()
+            raise MediaError(TOO_LARGE_MESSAGE)
+
+        # Meta sends the sha256 of the file: a repeat costs nothing
+        answer = self.cache.get(info.get("sha256"), variant)
+        if answer is not None:
+            return answer
+
+        path, digest = self.download(info["url"])
+        try:
+            answer = self.cache.get(digest, variant) if digest != info.get("sha256") else None
+            if answer is not None:
+                return answer
+            data, prepared_type = self.prepare(path)
+        finally:
+            os.unlink(path)
+
+        answer = extract(data, prepared_type or mime_type)
+        self.cache.put(digest, answer, variant)
+        with self._lock:
+            self._processed += 1
+        return answer
+
+    def resolve(self, media_id):
+        """Graph API media lookup: {"url", "mime_type", "sha256", "file_size", "id"}"""
+        if not media_id:
+            raise MediaError(DOWNLOAD_FAILED_MESSAGE)
+        try:
+            response = self.session.get(f"{self.graph_url}/{self.api_version}/{media_id}", timeout=self.timeout)
+            response.raise_for_status()
+            info = response.json()
+        except (requests.RequestException, ValueError) as e:
+            log.error("Media lookup failed", extra={"media_id": media_id, "error": str(e)})
+            raise MediaError(DOWNLOAD_FAILED_MESSAGE) from e
+        if not info.get("url"):
+            raise MediaError(DOWNLOAD_FAILED_MESSAGE)
+        return info
+
+    def download(self, url):
+        """Stream url into a temp file; returns (path, sha256 hex)"""
+        digest = hashlib.sha256()
+        size = 0
+        handle, path = tempfile.mkstemp(prefix="taxguard-media-", dir=self.temp_dir)
+        try:
+            with os.fdopen(handle, "wb") as f, \
+                    self.session.get(url, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        self._reject()
+                        raise MediaError(TOO_LARGE_MESSAGE)
+                    digest.update(chunk)
+                    f.write(chunk)
+        except MediaError:
+            os.unlink(path)
+            raise
+        except (requests.RequestException, OSError) as e:
+            os.unlink(path)
+            log.error("Media download failed", extra={"error": str(e)})
+            raise MediaError(DOWNLOAD_FAILED_MESSAGE) from e
+
+        with self._lock:
+            self._bytes_downloaded += size
+        return path, digest.hexdigest()
+
+    def prepare(self, path):
+        """Downscaled (data, mime_type) from the worker pool"""
+        for attempt in range(2):
+            pool = self._get_pool()
+            try:
+                future = pool.submit(prepare_image, path, self.max_dimension, self.jpeg_quality)
+                return future.result(timeout=self.timeout[1])
+            except BrokenProcessPool as e:
+                # A worker died; every later submit would fail until the pool is replaced
+                log.error("Media worker pool broken", extra={"error": str(e), "attempt": attempt + 1})
+                self._discard_pool(pool)
+                error = e
+            except Exception as e:
+                log.error("Media could not be decoded", extra={"error": str(e)})
+                raise MediaError(UNSUPPORTED_MESSAGE) from e
+        raise MediaError(UNSUPPORTED_MESSAGE) from error
+
+    def stats(self):
+        """Counters for /health"""
+        with self._lock:
+            stats = {
+                "processed": self._processed,
+                "rejected": self._rejected,
+                "bytes_downloaded": self._bytes_downloaded,
+                "workers": self.workers if self._pool is not None else 0,
+            }
+        stats["cache"] = self.cache.stats()
+        return stats
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=pool_context())
+        return self._pool
+
+    def _discard_pool(self, pool):
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _reject(self):
+        with self._lock:
+            self._rejected += 1
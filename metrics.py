@@ -0,0 +1,243 @@
+"""
+TaxGuard AI - Prometheus-style metrics
+
+A small, dependency-free metrics registry rendered in the Prometheus text
+format at /metrics. Recording a value is one dict lookup, a bisect and a
+few additions under a per-series lock, so the timers stay on in
+production. Values are per process: with several gunicorn workers each
+one is scraped (or summed) separately.
+
+What is measured:
+- taxguard_stage_seconds: every dispatcher stage (parse, local_reply,
+  queue_wait, ai_response, send_enqueue, send, ack, job)
+- taxguard_provider_seconds: each AI provider call, by outcome
+- taxguard_ai_tokens: prompt and completion tokens per AI request
+- taxguard_send_seconds / taxguard_send_total: outbound message latency
+  and successes/failures per channel
+- gauges registered by the apps: queue depth, sessions, admission counts
+"""
+
+import logging
+import threading
+from bisect import bisect_left
+
+from history import MESSAGE_OVERHEAD_TOKENS, count_tokens
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """The series for these label values (created on first use)"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class _CounterChild:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def render(self):
+        lines = self.header()
+        for values, child in list(self._children.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(child.value)}")
+        return lines
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def render(self):
+        lines = self.header()
+        for values, child in list(self._children.items()):
+            with child.lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, values)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}")
+        return lines
+
+
+class Callback(_Metric):
+    """Value read at scrape time: fn() returns a number, None, or {label values: number}"""
+
+    def __init__(self, name, help_text, fn, labelnames=(), kind="gauge"):
+        super().__init__(name, help_text, labelnames)
+        self.fn = fn
+        self.kind = kind
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            log.warning("Metric callback failed", extra={"metric": self.name, "error": str(e)})
+            return []
+        if value is None:
+            return []
+        samples = value.items() if isinstance(value, dict) else [((), value)]
+        lines = self.header()
+        for values, number in samples:
+            if not isinstance(values, tuple):
+                values = (values,)
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(number)}")
+        return lines
+
+
+class Registry:
+    """All metrics of this process, in registration order"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        # Registering a name again replaces it (e.g. the ASGI apps' queue depth)
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def callback(self, name, help_text, fn, labelnames=(), kind="gauge"):
+        return self.register(Callback(name, help_text, fn, labelnames, kind))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "taxguard_stage_seconds", "Time spent in each message processing stage", ("app", "stage")
+)
+PROVIDER_SECONDS = REGISTRY.histogram(
+    "taxguard_provider_seconds", "AI provider call latency", ("provider", "outcome")
+)
+AI_TOKENS = REGISTRY.histogram(
+    "taxguard_ai_tokens", "Tokens per AI request", ("provider", "kind"), buckets=TOKEN_BUCKETS
+)
+SEND_SECONDS = REGISTRY.histogram(
+    "taxguard_send_seconds", "Outbound message latency including retries", ("channel",)
+)
+SEND_TOTAL = REGISTRY.counter(
+    "taxguard_send_total", "Outbound messages by result", ("channel", "result")
+)
+SEND_RETRIES = REGISTRY.counter(
+    "taxguard_send_retries_total", "Outbound message retries", ("channel",)
+)
+
+_system_prompt_tokens = {}
+
+
+def record_send(channel, ok, seconds):
+    SEND_SECONDS.labels(channel).observe(seconds)
+    SEND_TOTAL.labels(channel, "ok" if ok else "failed").inc()
+
+
+def record_ai_tokens(provider, messages, answer):
+    """Prompt and completion token counts of one AI request"""
+    system_prompt = messages[0]["content"]
+    prompt = _system_prompt_tokens.get(system_prompt)
+    if prompt is None:
+        # The system prompt is the same on every call; count it once
+        prompt = _system_prompt_tokens[system_prompt] = count_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+    for message in messages[1:]:
+        prompt += count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+    AI_TOKENS.labels(provider, "prompt").observe(prompt)
+    AI_TOKENS.labels(provider, "completion").observe(count_tokens(answer))
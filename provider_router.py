@@ -0,0 +1,385 @@
+"""
+TaxGuard AI - AI provider router with failover, hedging and circuit breakers
+
+When more than one provider is configured (OpenAI and Gemini), requests go
+to the primary first. If it has not answered after its recent p95 latency,
+the same request is also sent to the secondary and whichever answer arrives
+first is used. A provider that keeps failing is taken out of rotation by a
+circuit breaker for a cool-down period. Hedged requests cost money, so only
+a configurable fraction of requests may be hedged.
+
+Environment Variables (.env file):
+AI_HEDGE_ENABLED=true or false (default: true)
+AI_HEDGE_BUDGET=max fraction of requests that may be hedged (default: 0.1)
+AI_HEDGE_MIN_DELAY=never hedge before this many seconds (default: 1.5)
+AI_HEDGE_DEFAULT_DELAY=hedge delay until enough latency samples exist (default: 6)
+AI_BREAKER_FAILURES=consecutive failures that open the breaker (default: 5)
+AI_BREAKER_COOLDOWN=seconds a tripped provider is skipped (default: 30)
+AI_REQUEST_TIMEOUT=max seconds to wait for any answer (default: 60)
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from metrics import PROVIDER_SECONDS
+
+# Latency samples needed before p95 is trusted for the hedge delay
+MIN_SAMPLES = 20
+
+
+class ProviderStats:
+    """Rolling latency and error rate for one provider"""
+
+    def __init__(self, window=200):
+        self.latencies = deque(maxlen=window)  # seconds, successful calls only
+        self.outcomes = deque(maxlen=window)   # True = success
+        self.calls = 0
+        self.failures = 0
+
+    def record(self, ok, seconds):
+        self.calls += 1
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(seconds)
+        else:
+            self.failures += 1
+
+    def p95(self):
+        if len(self.latencies) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+
+class CircuitBreaker:
+    """closed -> open after repeated failures -> half-open trial after cool-down"""
+
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+
+    def allow(self):
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            # Let one trial request through
+            self.state = "half_open"
+            return True
+        return False
+
+    def record(self, ok):
+        if ok:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            return
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.trips += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """A half-open trial ended without a result (cancelled): let the next request retry"""
+        if self.state == "half_open":
+            self.state = "open"
+            self.opened_at = time.monotonic() - self.cooldown
+
+
+class ProviderRouter:
+    """Routes a chat request across providers, fastest successful answer wins"""
+
+    def __init__(self, providers, hedge=True, hedge_budget=0.1, hedge_min_delay=1.5,
+                 hedge_default_delay=6.0, failure_threshold=5, cooldown=30.0,
+                 timeout=60.0, workers=16):
+        # providers: list of (name, callable(messages) -> text), primary first
+        self.providers = list(providers)
+        self.hedge = hedge
+        self.hedge_budget = hedge_budget
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.timeout = timeout
+        self.stats_by_name = {name: ProviderStats() for name, _ in self.providers}
+        self.breakers = {
+            name: CircuitBreaker(failure_threshold, cooldown) for name, _ in self.providers
+        }
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ai")
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._hedged = 0
+        self._hedge_wins = 0
+        self._failovers = 0
+
+    @property
+    def names(self):
+        return [name for name, _ in self.providers]
+
+    def complete(self, messages):
+        """Return (provider_name, text); raises the last error if every provider fails"""
+        with self._lock:
+            self._requests += 1
+        candidates = self.providers
+
+        pending = {}
+        launched = []
+        last_error = None
+        deadline = time.monotonic() + self.timeout
+        next_index = 0
+        hedge_considered = False
+        hedged = False
+
+        def launch():
+            """Call the next provider whose breaker allows it; False when none is left"""
+            nonlocal next_index
+            while next_index < len(candidates):
+                name, fn = candidates[next_index]
+                next_index += 1
+                if self._allow(name):
+                    submit(name, fn)
+                    return True
+            return False
+
+        def submit(name, fn):
+            try:
+                future = self._executor.submit(self._call, name, fn, messages)
+            except Exception:
+                self._release(name)
+                raise
+            pending[future] = name
+            launched.append(name)
+
+        if not launch():
+            # Everything is tripped: try the primary rather than fail outright
+            submit(*candidates[0])
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            # Only the first slow call is hedged, and only once per request
+            can_hedge = (self.hedge and not hedge_considered
+                         and next_index < len(candidates) and len(pending) == 1)
+            timeout = remaining
+            if can_hedge:
+                timeout = min(remaining, self._hedge_delay(next(iter(pending.values()))))
+
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                if can_hedge:
+                    hedge_considered = True
+                    if self._take_hedge():
+                        hedged = launch()
+                continue
+
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    text = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+
+                if hedged and name != launched[0]:
+                    with self._lock:
+                        self._hedge_wins += 1
+                return name, text
+
+            # Everything that finished failed: fail over to the next provider now
+            if not pending and launch():
+                with self._lock:
+                    self._failovers += 1
+
+        if last_error is None:
+            last_error = FutureTimeout(f"No AI provider answered within {self.timeout:.0f}s")
+        raise last_error
+
+    async def acomplete(self, calls, messages):
+        """complete() for asyncio: calls maps provider name -> async fn(messages)
+
+        Same routing, hedging and breakers as complete(), but a slower
+        duplicate request is cancelled as soon as the other one answers.
+        """
+        with self._lock:
+            self._requests += 1
+        candidates = [n for n in self.names if n in calls]
+
+        pending = {}
+        launched = []
+        last_error = None
+        deadline = time.monotonic() + self.timeout
+        next_index = 0
+        hedge_considered = False
+        hedged = False
+
+        def launch():
+            nonlocal next_index
+            while next_index < len(candidates):
+                name = candidates[next_index]
+                next_index += 1
+                if self._allow(name):
+                    submit(name)
+                    return True
+            return False
+
+        def submit(name):
+            pending[asyncio.ensure_future(self._acall(name, calls[name], messages))] = name
+            launched.append(name)
+
+        if not launch():
+            submit(candidates[0])
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                can_hedge = (self.hedge and not hedge_considered
+                             and next_index < len(candidates) and len(pending) == 1)
+                timeout = remaining
+                if can_hedge:
+                    timeout = min(remaining, self._hedge_delay(next(iter(pending.values()))))
+
+                done, _ = await asyncio.wait(list(pending), timeout=timeout,
+                                             return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    if can_hedge:
+                        hedge_considered = True
+                        if self._take_hedge():
+                            hedged = launch()
+                    continue
+
+                for task in done:
+                    name = pending.pop(task)
+                    try:
+                        text = task.result()
+                    except Exception as e:
+                        last_error = e
+                        continue
+
+                    if hedged and name != launched[0]:
+                        with self._lock:
+                            self._hedge_wins += 1
+                    return name, text
+
+                if not pending and launch():
+                    with self._lock:
+                        self._failovers += 1
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if last_error is None:
+            last_error = FutureTimeout(f"No AI provider answered within {self.timeout:.0f}s")
+        raise last_error
+
+    def first_available(self):
+        """Name of the first provider whose breaker lets a request through"""
+        with self._lock:
+            self._requests += 1
+            # Stop at the first allowed provider: allow() starts a half-open
+            # trial, which only the caller's record() can end
+            for name in self.names:
+                if self.breakers[name].allow():
+                    return name
+        return self.names[0]
+
+    def record(self, name, ok, seconds):
+        """Record the outcome of a call made outside complete() (e.g. streaming)"""
+        self._record(name, ok, seconds)
+
+    def _allow(self, name):
+        """Ask name's breaker at the moment it would be called
+
+        allow() moves a cooled-down breaker to half-open, and only the
+        outcome of that call closes or reopens it, so it is never asked for
+        a provider that is not then launched.
+        """
+        with self._lock:
+            return self.breakers[name].allow()
+
+    def _release(self, name):
+        with self._lock:
+            self.breakers[name].release()
+
+    def _call(self, name, fn, messages):
+        started = time.perf_counter()
+        try:
+            text = fn(messages)
+        except Exception:
+            self._record(name, False, time.perf_counter() - started)
+            raise
+        self._record(name, True, time.perf_counter() - started)
+        return text
+
+    async def _acall(self, name, fn, messages):
+        started = time.perf_counter()
+        try:
+            text = await fn(messages)
+        except asyncio.CancelledError:
+            # The loser of a hedge is not a failure, but may hold the half-open trial
+            self._release(name)
+            raise
+        except Exception:
+            self._record(name, False, time.perf_counter() - started)
+            raise
+        self._record(name, True, time.perf_counter() - started)
+        return text
+
+    def _record(self, name, ok, seconds):
+        PROVIDER_SECONDS.labels(name, "ok" if ok else "error").observe(seconds)
+        with self._lock:
+            self.stats_by_name[name].record(ok, seconds)
+            self.breakers[name].record(ok)
+
+    def _hedge_delay(self, name):
+        with self._lock:
+            p95 = self.stats_by_name[name].p95()
+        delay = self.hedge_default_delay if p95 is None else p95
+        return max(self.hedge_min_delay, delay)
+
+    def _take_hedge(self):
+        """Allow a hedge only while hedged requests stay within the budget"""
+        with self._lock:
+            if self._hedged + 1 > self.hedge_budget * self._requests + 1:
+                return False
+            self._hedged += 1
+            return True
+
+    def stats(self):
+        """Per-provider latency, error rate and breaker state for /health"""
+        with self._lock:
+            providers = {}
+            for name in self.names:
+                stats = self.stats_by_name[name]
+                p95 = stats.p95()
+                providers[name] = {
+                    "calls": stats.calls,
+                    "failures": stats.failures,
+                    "error_rate": round(stats.error_rate(), 4),
+                    "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                    "breaker": self.breakers[name].state,
+                    "breaker_trips": self.breakers[name].trips,
+                }
+            return {
+                "order": self.names,
+                "requests": self._requests,
+                "hedged": self._hedged,
+                "hedge_wins": self._hedge_wins,
+                "failovers": self._failovers,
+                "providers": providers,
+            }
@@ -0,0 +1,145 @@
+"""
+TaxGuard AI - Token bucket rate limiting
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available right now; never blocks"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, timeout=None):
+        """Block until tokens are available; returns False if timeout expires first"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate if self.rate > 0 else 1.0
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+class KeyedRateLimiter:
+    """One token bucket per key (e.g. sender number); idle buckets are dropped"""
+
+    def __init__(self, rate, capacity=None, max_keys=100000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max(1, max_keys)
+        self._buckets = OrderedDict()  # key -> TokenBucket, least recently used first
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+                # A dropped bucket was idle the longest, so it would be full anyway
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+        return bucket.try_acquire()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._buckets)
+
+
+class AdmissionControl:
+    """Decides whether a message may go to the AI: "ok", "limited" or "shed"
+
+    "limited" means the sender is over their own rate; "shed" means the
+    system as a whole is over its AI rate or has too much work queued or in
+    flight, and the message should be answered from static/cached replies.
+    """
+
+    def __init__(self, per_sender_rate, per_sender_burst, global_rate, global_burst,
+                 shed_depth, depth_fn=None):
+        self.per_sender = KeyedRateLimiter(per_sender_rate, per_sender_burst)
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.shed_depth = shed_depth
+        self.depth_fn = depth_fn
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._admitted = 0
+        self._limited = 0
+        self._shed = 0
+
+    def depth(self):
+        queued = self.depth_fn() if self.depth_fn else 0
+        return queued + self._in_flight
+
+    def check(self, sender):
+        if not self.per_sender.allow(sender):
+            result = "limited"
+        elif self.depth() >= self.shed_depth or not self.global_bucket.try_acquire():
+            result = "shed"
+        else:
+            result = "ok"
+
+        with self._lock:
+            if result == "ok":
+                self._admitted += 1
+            elif result == "limited":
+                self._limited += 1
+            else:
+                self._shed += 1
+        return result
+
+    @contextmanager
+    def track(self):
+        """Count an AI call as in flight for the load-shedding depth"""
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "admitted": self._admitted,
+                "limited": self._limited,
+                "shed": self._shed,
+                "in_flight": self._in_flight,
+                "depth": self.depth(),
+                "shed_depth": self.shed_depth,
+                "tracked_senders": len(self.per_sender),
+            }
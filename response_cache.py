@@ -0,0 +1,225 @@
+"""
+TaxGuard AI - Response cache for FAQ-style questions
+
+Many users ask the same few questions ("How do I file tax return?",
+"What deductions can I claim?"). Answers are cached under the normalized
+question text plus a prompt version, so changing SYSTEM_PROMPT starts a
+fresh cache, and an optional variant (the reply language), so a question
+asked in English is never answered from an Urdu answer. Only questions
+that open a conversation are cached, and only when they carry no
+personal details (amounts, long pasted text): an answer written with one
+user's earlier turns as context ("what about for freelancers?") is never
+served to another.
+
+The SQLite tier keeps each answer's expiry: a hit there expires locally
+when the row does, and expired rows are deleted by writes at most once
+every PURGE_INTERVAL seconds.
+
+Environment Variables (.env file):
+RESPONSE_CACHE_ENABLED=true or false (default: true)
+RESPONSE_CACHE_SIZE=max answers kept in memory (default: 2000)
+RESPONSE_CACHE_TTL=seconds an answer stays valid (default: 21600)
+RESPONSE_CACHE_PATH=path of an SQLite file for a persistent tier (optional)
+"""
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# Arabic code points that Urdu keyboards mix with their Urdu equivalents
+_URDU_LETTERS = str.maketrans({
+    "ي": "ی", "ى": "ی", "ك": "ک", "ة": "ہ", "ه": "ہ", "ۀ": "ہ",
+    "أ": "ا", "إ": "ا", "آ": "ا", "ـ": None,
+})
+_DIGITS = str.maketrans("۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩", "01234567890123456789")
+
+# Common Roman Urdu spellings mapped to one form
+_ROMAN_URDU = {
+    "kya": "kia", "kyaa": "kia",
+    "kaise": "kese", "kaisay": "kese", "kesay": "kese", "kaisy": "kese", "kesy": "kese",
+    "kaun": "kon", "kon": "kon", "kitna": "kitna", "kitnaa": "kitna",
+    "hy": "hai", "hain": "hai", "hein": "hai",
+    "krna": "karna", "krain": "karen", "karein": "karen", "kren": "karen",
+    "tax": "tax", "tex": "tax", "taxes": "tax",
+    "plz": "please", "pls": "please",
+}
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+# Questions longer than this are assumed to carry personal details
+MAX_CACHEABLE_CHARS = 200
+
+# Seconds between deletes of expired rows from the SQLite tier
+PURGE_INTERVAL = 300
+
+
+def normalize_question(text):
+    """Case, punctuation, whitespace and Urdu/Roman-Urdu spelling insensitive form"""
+    text = unicodedata.normalize("NFKC", text).translate(_URDU_LETTERS).lower()
+    # Drop Urdu/Arabic diacritics (zer, zabar, pesh...)
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    text = _PUNCTUATION.sub(" ", text)
+    words = [_ROMAN_URDU.get(word, word) for word in _SPACES.split(text) if word]
+    return " ".join(words)
+
+
+def _has_digits(text):
+    return any(ch.isdigit() for ch in text.translate(_DIGITS))
+
+
+class ResponseCache:
+    """LRU + TTL answer cache with an optional SQLite tier shared by workers"""
+
+    def __init__(self, prompt_version, max_entries=2000, ttl=21600, path=None):
+        self.prompt_version = prompt_version
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()  # key -> (expires, answer)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._hits = 0
+        self._misses = 0
+        self._skipped = 0
+        self._provider_seconds = 0.0
+        self._provider_calls = 0
+        self._purged_at = 0.0
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+        if path:
+            conn = self._conn()
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, answer TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires)")
+
+    def _after_fork(self):
+        # A connection opened before fork() must not be used by the child
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def key(self, question, variant=""):
+        normalized = normalize_question(question)
+        return hashlib.sha1(f"{self.prompt_version}\n{variant}\n{normalized}".encode("utf-8")).hexdigest()
+
+    def cacheable(self, question, history=()):
+        """False for follow-ups (any earlier turns) and questions with personal details"""
+        personal = (
+            bool(history)
+            or len(question) > MAX_CACHEABLE_CHARS
+            or _has_digits(question)
+        )
+        if personal:
+            with self._lock:
+                self._skipped += 1
+        return not personal
+
+    def get(self, question, variant=""):
+        key = self.key(question, variant)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        row = self._get_persistent(key, now)
+        with self._lock:
+            if row is None:
+                self._misses += 1
+                return None
+            answer, expires = row
+            self._hits += 1
+            self._store_local(key, answer, expires)
+        return answer
+
+    def put(self, question, answer, provider_seconds=None, variant=""):
+        """Cache an answer; provider_seconds feeds the latency-saved estimate"""
+        key = self.key(question, variant)
+        now = time.time()
+        expires = now + self.ttl
+        with self._lock:
+            self._store_local(key, answer, expires)
+            if provider_seconds is not None:
+                self._provider_seconds += provider_seconds
+                self._provider_calls += 1
+            purge = self.path and now - self._purged_at >= PURGE_INTERVAL
+            if purge:
+                self._purged_at = now
+
+        if self.path:
+            try:
+                conn = self._conn()
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, answer, expires) VALUES (?, ?, ?)",
+                    (key, answer, expires)
+                )
+                if purge:
+                    conn.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+            except sqlite3.Error as e:
+                log.warning("Response cache write failed", extra={"error": str(e)})
+
+    def stats(self):
+        """Hit ratio and estimated provider latency saved"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            avg = self._provider_seconds / self._provider_calls if self._provider_calls else 0.0
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "skipped_personal": self._skipped,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0,
+                "latency_saved_ms": round(self._hits * avg * 1000, 1),
+                "persistent": bool(self.path),
+            }
+
+    def _store_local(self, key, answer, expires):
+        self._entries[key] = (expires, answer)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _get_persistent(self, key, now):
+        """(answer, expires) from the SQLite tier, or None"""
+        if not self.path:
+            return None
+        try:
+            row = self._conn().execute(
+                "SELECT answer, expires FROM responses WHERE key = ? AND expires > ?", (key, now)
+            ).fetchone()
+        except sqlite3.Error as e:
+            log.warning("Response cache read failed", extra={"error": str(e)})
+            return None
+        return tuple(row) if row else None
+
+
+def prompt_version(*parts):
+    """Short fingerprint of the prompt text, used to invalidate cached answers"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+    return digest.hexdigest()[:12]
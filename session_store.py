@@ -0,0 +1,517 @@
+"""
+TaxGuard AI - Bounded conversation session store
+
+Replaces the plain user_sessions dict. Sessions are evicted least recently
+used first, after an idle timeout, and whenever the estimated memory use
+goes over the cap. Each turn is a small slotted record and the system
+prompt is kept once for the whole store instead of once per user.
+
+The in-memory store only works within one process. For several gunicorn
+workers, or to keep conversations across deploys, use the SQLite or Redis
+backend instead; they share the same interface.
+
+Environment Variables (.env file):
+SESSION_BACKEND=memory, sqlite or redis (default: memory)
+SESSION_SQLITE_PATH=path of the SQLite database (default: sessions.db)
+SESSION_REDIS_URL=redis://host:6379/0 (required for the redis backend)
+SESSION_MAX_USERS=max conversations kept (default: 10000)
+SESSION_IDLE_TTL=seconds of inactivity before a conversation is dropped (default: 86400)
+SESSION_MAX_MB=approximate memory cap for all conversations (default: 64)
+SESSION_MAX_TURNS=messages kept per conversation (default: 20)
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from history import turn_tokens
+
+log = logging.getLogger(__name__)
+
+# Rough per-object overheads used for the memory estimate
+_TURN_OVERHEAD = sys.getsizeof(object()) + 3 * 8
+_SESSION_OVERHEAD = 256
+
+# Compact role codes used when turns are serialized
+_ROLE_CODES = {"user": "u", "assistant": "a"}
+_ROLE_NAMES = {code: role for role, code in _ROLE_CODES.items()}
+
+
+class Turn:
+    """One message in a conversation"""
+
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role, content, tokens=None):
+        self.role = role
+        self.content = content
+        self.tokens = tokens  # cached by history.turn_tokens()
+
+    def as_message(self):
+        return {"role": self.role, "content": self.content}
+
+    def size(self):
+        return _TURN_OVERHEAD + sys.getsizeof(self.content)
+
+    def encode(self):
+        item = [_ROLE_CODES.get(self.role, self.role), self.content]
+        if self.tokens is not None:
+            item.append(self.tokens)
+        return item
+
+    @classmethod
+    def decode(cls, item):
+        tokens = item[2] if len(item) > 2 else None
+        return cls(_ROLE_NAMES.get(item[0], item[0]), item[1], tokens)
+
+
+def _as_turn(turn):
+    """Accept either a Turn or a (role, content) pair"""
+    if isinstance(turn, Turn):
+        return turn
+    role, content = turn
+    return Turn(role, content)
+
+
+def encode_turns(turns):
+    """Serialize turns as compact UTF-8 JSON"""
+    return json.dumps([turn.encode() for turn in turns], ensure_ascii=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def decode_turns(data):
+    if not data:
+        return []
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    return [Turn.decode(item) for item in json.loads(data)]
+
+
+class BaseSessionStore:
+    """Shared behaviour; subclasses implement history(), extend() and clear()"""
+
+    backend = "base"
+
+    def __init__(self, system_prompt, max_turns=10):
+        self.system_prompt = system_prompt
+        self.max_turns = max(1, max_turns)
+
+    def history(self, user_id):
+        raise NotImplementedError
+
+    def extend(self, user_id, turns):
+        """Add several Turn or (role, content) turns in one write"""
+        raise NotImplementedError
+
+    def clear(self, user_id):
+        raise NotImplementedError
+
+    def language(self, user_id):
+        """Language last detected for the user (see language.py), or None"""
+        raise NotImplementedError
+
+    def set_language(self, user_id, language):
+        raise NotImplementedError
+
+    def append(self, user_id, role, content):
+        """Add a single turn"""
+        self.extend(user_id, [(role, content)])
+
+    def messages(self, user_id, user_message=None, window=None, history=None, system_prompt=None):
+        """System prompt plus recent history, optionally with a not-yet-saved user message
+
+        With a history.HistoryWindow the turns are picked by token budget,
+        otherwise the last max_turns are used. Pass `history` when it has
+        already been loaded to avoid reading it again, and `system_prompt`
+        to use a variant (e.g. per language) instead of the store's own.
+        """
+        system_prompt = system_prompt or self.system_prompt
+        turns = list(history) if history is not None else self.history(user_id)
+        if user_message is not None:
+            turns.append(_as_turn(("user", user_message)) if isinstance(user_message, str) else user_message)
+        if window is not None:
+            return window.build(system_prompt, turns)
+        turns = turns[-self.max_turns:]
+
+        messages = [{"role": "system", "content": system_prompt}]
+        messages.extend(turn.as_message() for turn in turns)
+        return messages
+
+    def __contains__(self, user_id):
+        return bool(self.history(user_id))
+
+    def close(self):
+        pass
+
+
+class Session:
+    """A user's recent turns plus bookkeeping for eviction"""
+
+    __slots__ = ("turns", "last_seen", "size", "language")
+
+    def __init__(self):
+        self.turns = []
+        self.last_seen = time.monotonic()
+        self.size = _SESSION_OVERHEAD
+        self.language = None
+
+
+class SessionStore(BaseSessionStore):
+    """Thread-safe in-process LRU session store with idle TTL and a memory cap"""
+
+    backend = "memory"
+
+    def __init__(self, system_prompt, max_sessions=10000, idle_ttl=86400,
+                 max_bytes=64 * 1024 * 1024, max_turns=10):
+        super().__init__(system_prompt, max_turns)
+        self.max_sessions = max(1, max_sessions)
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()  # user_id -> Session, least recently used first
+        self._lock = threading.RLock()
+        self._bytes = 0
+        self._evictions = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def __contains__(self, user_id):
+        with self._lock:
+            return user_id in self._sessions
+
+    def history(self, user_id):
+        """Recent turns for a user (oldest first), without the system prompt"""
+        with self._lock:
+            session = self._touch(user_id, create=False)
+            return list(session.turns) if session else []
+
+    def extend(self, user_id, turns):
+        """Add turns, keeping only the most recent max_turns"""
+        turns = [_as_turn(turn) for turn in turns]
+        with self._lock:
+            session = self._touch(user_id, create=True)
+            for turn in turns:
+                session.turns.append(turn)
+                self._resize(session, turn.size())
+
+            while len(session.turns) > self.max_turns:
+                dropped = session.turns.pop(0)
+                self._resize(session, -dropped.size())
+
+            self._evict()
+
+    def clear(self, user_id):
+        with self._lock:
+            session = self._sessions.pop(user_id, None)
+            if session:
+                self._bytes -= session.size
+
+    def language(self, user_id):
+        with self._lock:
+            session = self._sessions.get(user_id)
+            return session.language if session else None
+
+    def set_language(self, user_id, language):
+        with self._lock:
+            self._touch(user_id, create=True).language = language
+            self._evict()
+
+    def user_ids(self):
+        with self._lock:
+            return list(self._sessions)
+
+    def stats(self):
+        """Memory footprint for /health"""
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "approx_bytes": self._bytes + sys.getsizeof(self.system_prompt),
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions,
+            }
+
+    def _touch(self, user_id, create):
+        session = self._sessions.get(user_id)
+        if session is None:
+            if not create:
+                return None
+            session = self._sessions[user_id] = Session()
+            self._bytes += session.size
+        else:
+            self._sessions.move_to_end(user_id)
+        session.last_seen = time.monotonic()
+        return session
+
+    def _resize(self, session, delta):
+        session.size += delta
+        self._bytes += delta
+
+    def _evict(self):
+        """Drop idle sessions, then least recently used ones until within limits"""
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            over_limit = len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes
+            if session.last_seen >= cutoff and not over_limit:
+                break
+            if len(self._sessions) == 1 and session.last_seen >= cutoff:
+                # Never evict the conversation that is being written to
+                break
+            del self._sessions[user_id]
+            self._bytes -= session.size
+            self._evictions += 1
+
+
+class SQLiteSessionStore(BaseSessionStore):
+    """Sessions in a local SQLite database (WAL mode), shared by all workers on one host"""
+
+    backend = "sqlite"
+
+    # Purge idle sessions once every this many writes
+    PURGE_EVERY = 500
+
+    def __init__(self, system_prompt, path="sessions.db", idle_ttl=86400, max_turns=10):
+        super().__init__(system_prompt, max_turns)
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " user_id TEXT PRIMARY KEY,"
+            " turns BLOB NOT NULL,"
+            " updated REAL NOT NULL,"
+            " language TEXT)"
+        )
+        # Databases created before the language column
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+        if "language" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN language TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+        conn.commit()
+
+    def _after_fork(self):
+        # A connection opened before fork() must not be used by the child
+        self._local = threading.local()
+
+    def _conn(self):
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def history(self, user_id):
+        row = self._conn().execute(
+            "SELECT turns, updated FROM sessions WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None or row[1] < time.time() - self.idle_ttl:
+            return []
+        return decode_turns(row[0])
+
+    def extend(self, user_id, turns):
+        """Read-modify-write inside one IMMEDIATE transaction"""
+        conn = self._conn()
+        # Token counts are stored with the turn so they are only computed once
+        new_turns = [_as_turn(turn) for turn in turns]
+        for turn in new_turns:
+            turn_tokens(turn)
+        now = time.time()
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT turns, updated FROM sessions WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            existing = decode_turns(row[0]) if row and row[1] >= now - self.idle_ttl else []
+            kept = (existing + new_turns)[-self.max_turns:]
+            # An upsert, so the stored language is kept
+            conn.execute(
+                "INSERT INTO sessions (user_id, turns, updated) VALUES (?, ?, ?)"
+                " ON CONFLICT (user_id) DO UPDATE SET turns = excluded.turns, updated = excluded.updated",
+                (user_id, encode_turns(kept), now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        with self._lock:
+            self._writes += 1
+            purge = self._writes % self.PURGE_EVERY == 0
+        if purge:
+            self.purge_idle()
+
+    def clear(self, user_id):
+        self._conn().execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def language(self, user_id):
+        # Kept until purge_idle() drops the row, not just while the turns are fresh
+        row = self._conn().execute("SELECT language FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_language(self, user_id, language):
+        self._conn().execute(
+            "INSERT INTO sessions (user_id, turns, updated, language) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (user_id) DO UPDATE SET language = excluded.language",
+            (user_id, encode_turns([]), time.time(), language)
+        )
+
+    def purge_idle(self):
+        self._conn().execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.idle_ttl,))
+
+    def user_ids(self, batch_size=1000):
+        """Yield every stored user ID without loading them all at once"""
+        last = ""
+        while True:
+            rows = self._conn().execute(
+                "SELECT user_id FROM sessions WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (last, batch_size)
+            ).fetchall()
+            if not rows:
+                return
+            for (user_id,) in rows:
+                yield user_id
+            last = rows[-1][0]
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def stats(self):
+        conn = self._conn()
+        count, size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(turns)), 0) FROM sessions"
+        ).fetchone()
+        return {
+            "backend": self.backend,
+            "sessions": count,
+            "stored_bytes": size,
+            "path": self.path,
+        }
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RedisSessionStore(BaseSessionStore):
+    """Sessions in Redis, shared by workers on any host
+
+    Each conversation is a Redis list of compact JSON turns. A turn is saved
+    with one pipelined RPUSH + LTRIM + EXPIRE round trip; the user's language
+    is a separate string key with the same TTL. Pass `client` to use any
+    redis-py compatible client (e.g. fakeredis in local testing).
+    """
+
+    backend = "redis"
+
+    def __init__(self, system_prompt, url=None, client=None, idle_ttl=86400,
+                 max_turns=10, prefix="taxguard:session:"):
+        super().__init__(system_prompt, max_turns)
+        self.idle_ttl = idle_ttl
+        self.prefix = prefix
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url, socket_timeout=1.0)
+        self.client = client
+
+    def _key(self, user_id):
+        return self.prefix + str(user_id)
+
+    def history(self, user_id):
+        items = self.client.lrange(self._key(user_id), 0, -1)
+        return [Turn.decode(json.loads(item)) for item in items]
+
+    def extend(self, user_id, turns):
+        key = self._key(user_id)
+        new_turns = [_as_turn(turn) for turn in turns]
+        for turn in new_turns:
+            turn_tokens(turn)
+        encoded = [
+            json.dumps(turn.encode(), ensure_ascii=False, separators=(",", ":"))
+            for turn in new_turns
+        ]
+        if not encoded:
+            return
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpush(key, *encoded)
+        pipe.ltrim(key, -self.max_turns, -1)
+        pipe.expire(key, int(self.idle_ttl))
+        pipe.expire(self._language_key(user_id), int(self.idle_ttl))
+        pipe.execute()
+
+    def clear(self, user_id):
+        self.client.delete(self._key(user_id), self._language_key(user_id))
+
+    def _language_key(self, user_id):
+        # Outside the session prefix, so user_ids() does not list it
+        return f"{self.prefix.rstrip(':')}-language:{user_id}"
+
+    def language(self, user_id):
+        language = self.client.get(self._language_key(user_id))
+        if isinstance(language, bytes):
+            language = language.decode("utf-8")
+        return language
+
+    def set_language(self, user_id, language):
+        self.client.set(self._language_key(user_id), language, ex=int(self.idle_ttl))
+
+    def user_ids(self):
+        """Yield every stored user ID (SCAN, so Redis is never blocked)"""
+        for key in self.client.scan_iter(match=self.prefix + "*", count=1000):
+            if isinstance(key, bytes):
+                key = key.decode("utf-8")
+            yield key[len(self.prefix):]
+
+    def __len__(self):
+        return sum(1 for _ in self.user_ids())
+
+    def stats(self):
+        return {"backend": self.backend}
+
+    def close(self):
+        self.client.close()
+
+
+def create_session_store(system_prompt, backend=None, max_turns=10, idle_ttl=86400,
+                         max_sessions=10000, max_bytes=64 * 1024 * 1024,
+                         sqlite_path=None, redis_url=None):
+    """Build the session store selected by SESSION_BACKEND"""
+    backend = (backend or os.getenv('SESSION_BACKEND', 'memory')).lower()
+
+    if backend == "sqlite":
+        path = sqlite_path or os.getenv('SESSION_SQLITE_PATH', 'sessions.db')
+        log.info("Conversation history stored in SQLite", extra={"path": path})
+        return SQLiteSessionStore(system_prompt, path=path, idle_ttl=idle_ttl, max_turns=max_turns)
+
+    if backend == "redis":
+        url = redis_url or os.getenv('SESSION_REDIS_URL')
+        log.info("Conversation history stored in Redis")
+        return RedisSessionStore(system_prompt, url=url, idle_ttl=idle_ttl, max_turns=max_turns)
+
+    return SessionStore(
+        system_prompt,
+        max_sessions=max_sessions,
+        idle_ttl=idle_ttl,
+        max_bytes=max_bytes,
+        max_turns=max_turns
+    )
@@ -0,0 +1,73 @@
+"""
+TaxGuard AI - Paragraph chunking for streamed AI answers
+
+While an answer is being streamed, complete paragraphs are flushed as
+separate WhatsApp messages once they reach a sensible size, so the user
+sees the first paragraph instead of waiting for the whole completion.
+Every chunk stays under WhatsApp's text body limit.
+
+Environment Variables (.env file):
+STREAM_RESPONSES=true or false (default: false)
+STREAM_MIN_CHARS=characters collected before a paragraph is sent (default: 300)
+"""
+
+# WhatsApp Cloud API text bodies are limited to 4096 characters; leave room
+# for the signature appended to the last chunk
+WHATSAPP_MAX_CHARS = 4000
+
+
+def _hard_split(text, max_chars):
+    """Best place to cut text that is longer than max_chars"""
+    for separator in ("\n\n", "\n", ". ", "۔ ", " "):
+        cut = text.rfind(separator, 0, max_chars)
+        if cut > 0:
+            return cut + len(separator)
+    return max_chars
+
+
+class ParagraphChunker:
+    """Accumulates streamed text and releases it paragraph by paragraph"""
+
+    def __init__(self, min_chars=300, max_chars=WHATSAPP_MAX_CHARS):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, text):
+        """Add streamed text; returns chunks that are ready to send"""
+        self._buffer += text
+        chunks = []
+        while True:
+            cut = self._next_cut()
+            if cut is None:
+                return chunks
+            chunk = self._buffer[:cut].strip()
+            self._buffer = self._buffer[cut:].lstrip()
+            if chunk:
+                chunks.append(chunk)
+
+    def flush(self):
+        """Whatever is left once the stream has ended"""
+        chunks = []
+        rest = self._buffer.strip()
+        self._buffer = ""
+        while len(rest) > self.max_chars:
+            cut = _hard_split(rest, self.max_chars)
+            chunks.append(rest[:cut].strip())
+            rest = rest[cut:].strip()
+        if rest:
+            chunks.append(rest)
+        return chunks
+
+    def _next_cut(self):
+        if len(self._buffer) > self.max_chars:
+            return _hard_split(self._buffer, self.max_chars)
+        if len(self._buffer) < self.min_chars:
+            return None
+
+        # Cut at the last paragraph break past min_chars, but only once text
+        # follows it, so the final chunk is always produced by flush()
+        cut = self._buffer.rfind("\n\n")
+        if cut < self.min_chars or not self._buffer[cut:].strip():
+            return None
+        return cut + 2
@@ -0,0 +1,220 @@
+"""
+TaxGuard AI - Structured, non-blocking logging
+
+Modules log through the standard logging module
+(log = logging.getLogger(__name__)) and pass details as extra fields
+instead of formatting them into the message:
+
+    log.info("Message received", extra={"sender": sender, "chars": len(text)})
+
+setup_logging() routes every record through a bounded in-memory queue to a
+single listener thread, so a request thread only appends the record and
+moves on. Formatting (JSON or text), PII redaction and writing to stdout
+all happen on the listener thread. When the queue is full, records are
+dropped and counted instead of blocking the request.
+
+Redaction (on by default): phone numbers keep their last 4 digits; CNICs
+and email addresses are masked wherever they appear in a field, and
+message bodies and webhook payloads also have every number masked
+(salaries, amounts).
+
+Full webhook payloads are only logged at DEBUG and only for a sample of
+requests (log_payload()).
+
+Environment Variables (.env file):
+LOG_LEVEL=DEBUG, INFO, WARNING or ERROR (default: INFO)
+LOG_FORMAT=json or text (default: json)
+LOG_REDACT=true or false (default: true)
+LOG_PAYLOAD_SAMPLE_RATE=fraction of webhook payloads logged at DEBUG (default: 0.01)
+LOG_QUEUE_SIZE=max records waiting to be written (default: 10000)
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+# Fields holding user-written text: every number in them is masked
+TEXT_FIELDS = {"text", "body", "response", "payload"}
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_CNIC = re.compile(r"(?<!\d)\d{5}-?\d{7}-?\d(?!\d)")
+_PHONE = re.compile(r"\+?\d[\d -]{7,}(\d{4})(?!\d)")
+_NUMBER = re.compile(r"\d[\d,.]*\d|\d")
+
+# Libraries that log request bodies (and so message text) at INFO
+_NOISY_LOGGERS = ("twilio", "urllib3", "aiohttp.access")
+
+
+def redact(value):
+    """Mask CNICs, email addresses and phone numbers (keeping the last 4 digits)"""
+    value = _EMAIL.sub("[email]", value)
+    value = _CNIC.sub("[cnic]", value)
+    return _PHONE.sub(lambda found: "***" + found.group(1), value)
+
+
+def redact_text(value):
+    """redact() plus every other number (amounts, salaries, IDs)"""
+    return _NUMBER.sub("#", redact(value))
+
+
+class _Formatter(logging.Formatter):
+    """Shared field collection and redaction; subclasses lay the record out"""
+
+    def __init__(self, redact_pii=True):
+        super().__init__()
+        self.redact_pii = redact_pii
+
+    def fields(self, record):
+        fields = {}
+        for key, value in vars(record).items():
+            if key in _RECORD_ATTRS or key.startswith("_"):
+                continue
+            if key == "payload" and not isinstance(value, str):
+                value = json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+            if self.redact_pii and isinstance(value, str):
+                value = redact_text(value) if key in TEXT_FIELDS else redact(value)
+            fields[key] = value
+        return fields
+
+    def message(self, record):
+        message = record.getMessage()
+        return redact(message) if self.redact_pii else message
+
+
+class JsonFormatter(_Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": self.message(record),
+        }
+        entry.update(self.fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(_Formatter):
+    """Human-readable: time, level, logger, message, key=value fields"""
+
+    def format(self, record):
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created))
+        parts = [stamp, record.levelname, f"{record.name}:", self.message(record)]
+        parts.extend(f"{key}={value}" for key, value in self.fields(record).items())
+        line = " ".join(parts)
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread; drops them when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The listener runs in this process, so the record is passed as is;
+        # the default prepare() would format it here on the request thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_state = {"handler": None, "listener": None, "sample_rate": 0.0}
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level=None, fmt=None, redact_pii=None, sample_rate=None, queue_size=None, stream=None):
+    """Install the queue handler on the root logger (once per process)"""
+    with _setup_lock:
+        if _state["handler"] is not None:
+            return _state["handler"]
+
+        level = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+        fmt = (fmt or os.getenv('LOG_FORMAT', 'json')).lower()
+        if redact_pii is None:
+            redact_pii = os.getenv('LOG_REDACT', 'true').lower() == 'true'
+        if sample_rate is None:
+            sample_rate = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0.01'))
+        if queue_size is None:
+            queue_size = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(TextFormatter(redact_pii) if fmt == "text" else JsonFormatter(redact_pii))
+
+        handler = DroppingQueueHandler(queue.Queue(max(1, queue_size)))
+        listener = logging.handlers.QueueListener(handler.queue, output)
+        listener.start()
+        atexit.register(listener.stop)
+
+        root = logging.getLogger()
+        root.handlers = [handler]
+        root.setLevel(level)
+        for name in _NOISY_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+        _state.update(handler=handler, listener=listener, sample_rate=max(0.0, min(1.0, sample_rate)))
+        return handler
+
+
+def _after_fork():
+    # The listener thread does not survive fork() (gunicorn preload_app):
+    # give the child its own queue and listener
+    handler, listener = _state["handler"], _state["listener"]
+    if handler is None:
+        return
+    atexit.unregister(listener.stop)
+    handler.queue = queue.Queue(handler.queue.maxsize)
+    handler.dropped = 0
+    listener = logging.handlers.QueueListener(handler.queue, *listener.handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    _state["listener"] = listener
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def log_payload(logger, message, payload, **fields):
+    """Log a full webhook payload at DEBUG for a sample of calls
+
+    The payload is serialized and redacted on the listener thread; when
+    DEBUG is off or the call is not sampled this costs one comparison.
+    """
+    if not logger.isEnabledFor(logging.DEBUG) or random.random() >= _state["sample_rate"]:
+        return
+    logger.debug(message, extra=dict(fields, payload=payload))
+
+
+def log_stats():
+    """Queue and drop counts for /health"""
+    handler = _state["handler"]
+    if handler is None:
+        return {"configured": False}
+    return {
+        "configured": True,
+        "queued": handler.queue.qsize(),
+        "dropped": handler.dropped,
+        "payload_sample_rate": _state["sample_rate"],
+    }
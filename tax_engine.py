@@ -0,0 +1,161 @@
+"""
+TaxGuard AI - Pakistani income tax calculation
+
+Tax is computed from per-year slab tables instead of hand-written
+if/elif chains. Each table stores the tax already due at the start of every
+slab, so a calculation is one bisect lookup plus one multiplication, and
+arrays of incomes are computed in one vectorized NumPy pass when NumPy is
+installed (imported on the first batch, not at startup). The same tables
+render the bracket section of SYSTEM_PROMPT, so a new budget only needs a
+new entry in TAX_BRACKETS.
+
+Environment Variables (.env file):
+TAX_YEAR=tax year used by default, e.g. 2024-25 (default: 2024-25)
+"""
+
+import os
+from bisect import bisect_left
+
+# NumPy module once imported, False when it is not installed
+_numpy = None
+
+
+def load_numpy():
+    """NumPy, imported on first use; None when it is not installed"""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+# Slabs per tax year: (upper limit of slab, rate); the last slab has no limit
+TAX_BRACKETS = {
+    "2024-25": [
+        (600000, 0.0),
+        (1200000, 0.05),
+        (2400000, 0.15),
+        (3600000, 0.25),
+        (6000000, 0.30),
+        (None, 0.35),
+    ],
+    "2025-26": [
+        (600000, 0.0),
+        (1200000, 0.01),
+        (2200000, 0.11),
+        (3200000, 0.23),
+        (4100000, 0.30),
+        (None, 0.35),
+    ],
+}
+
+TAX_YEAR = os.getenv('TAX_YEAR', '2024-25')
+
+
+class TaxTable:
+    """One year's slabs with the cumulative tax due at the start of each slab"""
+
+    __slots__ = ("year", "lowers", "uppers", "rates", "base_tax", "_np")
+
+    def __init__(self, year, brackets):
+        self.year = year
+        self.lowers = []
+        self.uppers = []
+        self.rates = []
+        self.base_tax = []
+
+        lower = 0
+        base = 0.0
+        for upper, rate in brackets:
+            self.lowers.append(lower)
+            self.uppers.append(upper)
+            self.rates.append(rate)
+            self.base_tax.append(round(base, 2))
+            if upper is not None:
+                base += (upper - lower) * rate
+                lower = upper
+
+        self._np = None  # NumPy copies of the tables, built by the first tax_many()
+
+    def slab_index(self, annual_income):
+        """Index of the slab an income falls in (slab upper limits are inclusive)"""
+        return max(0, bisect_left(self.lowers, annual_income) - 1)
+
+    def tax(self, annual_income):
+        if annual_income <= 0:
+            return 0.0
+        i = self.slab_index(annual_income)
+        return round(self.base_tax[i] + (annual_income - self.lowers[i]) * self.rates[i], 2)
+
+    def tax_many(self, incomes):
+        """Tax for a sequence of incomes, vectorized when NumPy is available"""
+        np = load_numpy()
+        if np is None:
+            return [self.tax(income) for income in incomes]
+
+        if self._np is None:
+            self._np = (
+                np.array(self.lowers, dtype=np.float64),
+                np.array(self.rates, dtype=np.float64),
+                np.array(self.base_tax, dtype=np.float64),
+            )
+        lowers, rates, base_tax = self._np
+        values = np.maximum(np.asarray(incomes, dtype=np.float64), 0.0)
+        idx = np.maximum(np.searchsorted(lowers, values, side="left") - 1, 0)
+        taxes = base_tax[idx] + (values - lowers[idx]) * rates[idx]
+        return np.round(taxes, 2).tolist()
+
+    def breakdown(self, annual_income):
+        """Tax charged in each slab: list of (lower, upper, rate, taxable, tax)"""
+        rows = []
+        if annual_income <= 0:
+            return rows
+        for i in range(self.slab_index(annual_income) + 1):
+            lower, upper, rate = self.lowers[i], self.uppers[i], self.rates[i]
+            top = annual_income if upper is None else min(annual_income, upper)
+            taxable = top - lower
+            rows.append((lower, upper, rate, taxable, round(taxable * rate, 2)))
+        return rows
+
+    def prompt_text(self):
+        """Bracket section for SYSTEM_PROMPT"""
+        lines = [f"Pakistani Tax Brackets {self.year}:"]
+        for lower, upper, rate in zip(self.lowers, self.uppers, self.rates):
+            if upper is None:
+                slab = f"Above Rs. {lower:,}"
+            elif lower == 0:
+                slab = f"Up to Rs. {upper:,}"
+            else:
+                slab = f"Rs. {lower + 1:,} to {upper:,}"
+            lines.append(f"- {slab}: {rate * 100:g}%")
+        return "\n".join(lines)
+
+
+TAX_TABLES = {year: TaxTable(year, brackets) for year, brackets in TAX_BRACKETS.items()}
+
+
+def get_tax_table(year=None):
+    """Table for a tax year (default TAX_YEAR); raises KeyError for unknown years"""
+    return TAX_TABLES[year or TAX_YEAR]
+
+
+def calculate_tax(annual_income, year=None):
+    """Calculate Pakistani income tax"""
+    return get_tax_table(year).tax(annual_income)
+
+
+def calculate_tax_batch(incomes, year=None):
+    """Calculate tax for many annual incomes at once"""
+    return get_tax_table(year).tax_many(incomes)
+
+
+def tax_breakdown(annual_income, year=None):
+    """Tax charged in each slab: list of (lower, upper, rate, taxable, tax)"""
+    return get_tax_table(year).breakdown(annual_income)
+
+
+def bracket_prompt_text(year=None):
+    """Bracket section of the system prompt, generated from the same table"""
+    return get_tax_table(year).prompt_text()
@@ -0,0 +1,285 @@
+"""
+TaxGuard AI - Local tax-calculation fast path
+
+Recognises messages like "Monthly income 80000, software engineer,
+Islamabad" (also Roman Urdu such as "tankhwah 80 hazar mahana" and Urdu
+with Urdu/Arabic numerals) and answers them straight from calculate_tax()
+with a slab-by-slab breakdown, labelled in English or Urdu. Only
+messages that cannot be parsed go to the AI provider.
+
+An amount counts as income only when an income word (salary, income,
+tankhwah...) sits next to it and is closer to it than any expense word
+(rent, penalty, zakat, fee, refund, deduction...). A profession, a city
+or "pay" alone is not enough: "I pay 25000 rent in Karachi" is a
+question for the AI, not a salary.
+
+A period word (monthly, per annum, mahana...) counts under the same
+distance rule, and "tax year", "this year" or "last month" is never one.
+Without a period word next to the amount the period is assumed from its
+size and the reply says so.
+"""
+
+import re
+from collections import namedtuple
+
+from language import DEFAULT_LANGUAGE, localized
+from tax_engine import TAX_YEAR, calculate_tax, tax_breakdown
+
+TaxQuery = namedtuple("TaxQuery", "amount period annual_income profession city period_assumed")
+
+# Urdu (Extended Arabic-Indic) and Arabic-Indic digits and separators
+_DIGITS = str.maketrans("۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩٬٫", "01234567890123456789,.")
+
+_MULTIPLIERS = {
+    "k": 1000, "thousand": 1000, "hazar": 1000, "hazaar": 1000, "hzar": 1000, "ہزار": 1000,
+    "lakh": 100000, "lakhs": 100000, "lac": 100000, "lacs": 100000, "لاکھ": 100000,
+    "m": 1000000, "mn": 1000000, "million": 1000000, "ملین": 1000000,
+    "crore": 10000000, "کروڑ": 10000000,
+}
+
+# 1,20,000 / 120,000 / 120000 / 1.5, optionally followed by a unit
+_AMOUNT = re.compile(
+    r"(?<![\w.])(\d{1,3}(?:,\d{2,3})+|\d+(?:\.\d+)?)\s*("
+    + "|".join(sorted(map(re.escape, _MULTIPLIERS), key=len, reverse=True))
+    + r")?(?!\w)"
+)
+
+_INCOME_WORDS = [
+    "income", "salary", "salry", "earn", "earning", "earnings", "package",
+    "tankhwah", "tankhwa", "tankhah", "tankha", "amdani", "aamdani", "kamai",
+    "تنخواہ", "آمدنی", "آمدن", "کمائی",
+]
+# Amounts next to these are not income
+_EXPENSE_WORDS = [
+    "rent", "kiraya", "kiraaya", "penalty", "penalties", "fine", "jurmana", "surcharge",
+    "zakat", "zakaat", "fee", "fees", "refund", "refunds", "deduct", "deducted", "deduction",
+    "deductions", "donation", "donations", "donate", "donated", "charity", "bill", "bills",
+    "loan", "installment", "کرایہ", "جرمانہ", "زکوٰۃ", "زکوۃ", "زکات", "فیس", "ریفنڈ", "کٹوتی",
+    "عطیہ", "بل", "قرض",
+]
+_MONTHLY_WORDS = [
+    "monthly", "month", "per month", "pm", "mahana", "mahanah", "mahina", "mahine",
+    "ماہانہ", "ماہوار", "مہینہ", "مہینے",
+]
+_ANNUAL_WORDS = [
+    "annual", "annually", "yearly", "year", "per annum", "pa", "salana", "saalana", "saal",
+    "سالانہ", "سال",
+]
+
+# Phrases naming a year or month rather than the income's period
+_NOT_PERIOD_WORDS = [
+    "tax year", "this year", "last year", "next year", "current year", "previous year",
+    "financial year", "fiscal year", "is saal", "pichle saal", "pichhle saal", "agle saal",
+    "this month", "last month", "next month", "is mahine", "pichle mahine", "agle mahine",
+    "ٹیکس سال", "اس سال", "پچھلے سال", "اگلے سال", "مالی سال", "اس مہینے", "پچھلے مہینے",
+]
+
+PROFESSIONS = {
+    "Software Engineer": ["software engineer", "software developer", "developer", "programmer",
+                          "سافٹ ویئر انجینئر"],
+    "Engineer": ["engineer", "انجینئر"],
+    "Doctor": ["doctor", "dr", "ڈاکٹر"],
+    "Teacher": ["teacher", "ustad", "professor", "lecturer", "استاد", "ٹیچر"],
+    "Lawyer": ["lawyer", "advocate", "wakeel", "وکیل"],
+    "Accountant": ["accountant", "اکاؤنٹنٹ"],
+    "Banker": ["banker", "بینکر"],
+    "Freelancer": ["freelancer", "فری لانسر"],
+    "Business Owner": ["business", "businessman", "karobar", "shopkeeper", "dukandar",
+                       "کاروبار", "دکاندار"],
+    "Government Employee": ["government employee", "govt employee", "sarkari mulazim",
+                            "سرکاری ملازم"],
+    "Nurse": ["nurse", "نرس"],
+}
+
+CITIES = {
+    "Karachi": ["karachi", "کراچی"],
+    "Lahore": ["lahore", "لاہور"],
+    "Islamabad": ["islamabad", "اسلام آباد"],
+    "Rawalpindi": ["rawalpindi", "pindi", "راولپنڈی"],
+    "Faisalabad": ["faisalabad", "فیصل آباد"],
+    "Multan": ["multan", "ملتان"],
+    "Peshawar": ["peshawar", "پشاور"],
+    "Quetta": ["quetta", "کوئٹہ"],
+    "Hyderabad": ["hyderabad", "حیدرآباد"],
+    "Sialkot": ["sialkot", "سیالکوٹ"],
+    "Gujranwala": ["gujranwala", "گوجرانوالہ"],
+    "Abbottabad": ["abbottabad", "ایبٹ آباد"],
+    "Sargodha": ["sargodha", "سرگودھا"],
+    "Bahawalpur": ["bahawalpur", "بہاولپور"],
+    "Sukkur": ["sukkur", "سکھر"],
+}
+
+
+def _words_pattern(words):
+    alternatives = sorted(map(re.escape, words), key=len, reverse=True)
+    return re.compile(r"(?<!\w)(?:" + "|".join(alternatives) + r")(?!\w)")
+
+
+def _lookup_pattern(table):
+    """One regex per table; the matched variant maps back to its canonical name"""
+    variants = {variant: name for name, names in table.items() for variant in names}
+    return _words_pattern(variants), variants
+
+
+_INCOME = _words_pattern(_INCOME_WORDS)
+_EXPENSE = _words_pattern(_EXPENSE_WORDS)
+_MONTHLY = _words_pattern(_MONTHLY_WORDS)
+_ANNUAL = _words_pattern(_ANNUAL_WORDS)
+_NOT_PERIOD = _words_pattern(_NOT_PERIOD_WORDS)
+_PROFESSION, _PROFESSION_NAMES = _lookup_pattern(PROFESSIONS)
+_CITY, _CITY_NAMES = _lookup_pattern(CITIES)
+
+# Amounts at or above this with no period word are taken as annual
+ANNUAL_THRESHOLD = 1000000
+
+# An income or period word counts for an amount at most this many words away
+INCOME_WORD_DISTANCE = 3
+
+_CURRENCY = re.compile(r"(?<!\w)(?:rs|pkr|rupees?|روپے)(?!\w)\.?")
+_WORD = re.compile(r"\w+")
+_SENTENCE_BREAK = re.compile(r"[.?!;\n]")
+
+
+def _distance(text, start, end, pattern):
+    """Words between text[start:end] and the nearest pattern match in its sentence, or None"""
+    nearest = None
+    for match in pattern.finditer(text):
+        if match.end() <= start:
+            between = text[match.end():start]
+        elif match.start() >= end:
+            between = text[end:match.start()]
+        else:
+            continue
+        between = _CURRENCY.sub(" ", between)
+        if _SENTENCE_BREAK.search(between):
+            continue
+        words = len(_WORD.findall(between))
+        if nearest is None or words < nearest:
+            nearest = words
+    return nearest
+
+
+def _is_income(text, match):
+    """True if an income word is next to the amount and nearer than any expense word"""
+    income = _distance(text, match.start(), match.end(), _INCOME)
+    if income is None or income > INCOME_WORD_DISTANCE:
+        return False
+    expense = _distance(text, match.start(), match.end(), _EXPENSE)
+    return expense is None or income < expense
+
+
+def _is_near(text, match, pattern):
+    distance = _distance(text, match.start(), match.end(), pattern)
+    return distance is not None and distance <= INCOME_WORD_DISTANCE
+
+
+def _find_amount(text):
+    """(value, match) of the first income amount, or None"""
+    for match in _AMOUNT.finditer(text):
+        digits, unit = match.group(1), match.group(2)
+        value = float(digits.replace(",", ""))
+        if unit:
+            value *= _MULTIPLIERS[unit]
+        elif "," not in digits and 1900 <= value <= 2100:
+            continue  # looks like a year ("2024-25")
+        if value >= 1000 and _is_income(text, match):
+            return value, match
+    return None
+
+
+def parse_tax_query(message):
+    """Parse income, period, profession and city; None if this is not a tax query"""
+    text = message.translate(_DIGITS).lower()
+
+    found = _find_amount(text)
+    if found is None:
+        return None
+    amount, match = found
+
+    profession = _PROFESSION.search(text)
+    city = _CITY.search(text)
+
+    # Blank out "tax year", "this year"... keeping offsets, then look for a
+    # period word next to the amount
+    periods = _NOT_PERIOD.sub(lambda m: " " * len(m.group(0)), text)
+    if _is_near(periods, match, _MONTHLY):
+        period, assumed = "monthly", False
+    elif _is_near(periods, match, _ANNUAL):
+        period, assumed = "annual", False
+    else:
+        period = "annual" if amount >= ANNUAL_THRESHOLD else "monthly"
+        assumed = True
+
+    return TaxQuery(
+        amount=amount,
+        period=period,
+        annual_income=amount * 12 if period == "monthly" else amount,
+        profession=_PROFESSION_NAMES[profession.group(0)] if profession else None,
+        city=_CITY_NAMES[city.group(0)] if city else None,
+        period_assumed=assumed,
+    )
+
+
+# Labels of the calculation reply, per template language
+REPLY_LABELS = {
+    "en": {
+        "title": "Tax Calculation", "annual_income": "Annual income", "breakdown": "Breakdown",
+        "above": "Above {}", "up_to": "Up to {}", "annual_tax": "Annual tax",
+        "monthly_tax": "Monthly tax", "effective_rate": "Effective rate",
+        "monthly": "monthly", "annual": "annual",
+        "assumed": "Taken as {period} income. Reply with \"{other}\" and the amount if that is wrong.",
+    },
+    "ur": {
+        "title": "ٹیکس کا حساب", "annual_income": "سالانہ آمدن", "breakdown": "تفصیل",
+        "above": "{} سے زیادہ", "up_to": "{} تک", "annual_tax": "سالانہ ٹیکس",
+        "monthly_tax": "ماہانہ ٹیکس", "effective_rate": "مؤثر شرح",
+        "monthly": "ماہانہ", "annual": "سالانہ",
+        "assumed": "اسے {period} آمدن مانا گیا ہے۔ اگر یہ غلط ہے تو \"{other}\" اور رقم دوبارہ لکھیں۔",
+    },
+}
+
+
+def _rs(value):
+    return f"Rs. {value:,.0f}"
+
+
+def format_tax_reply(query, language=DEFAULT_LANGUAGE):
+    """WhatsApp reply with the slab-by-slab calculation"""
+    labels = localized(REPLY_LABELS, language)
+    annual = query.annual_income
+    tax = calculate_tax(annual)
+
+    lines = [f"💰 *{labels['title']} {TAX_YEAR}*", ""]
+    if query.period == "monthly":
+        lines.append(f"{labels['annual_income']}: {_rs(annual)} ({_rs(query.amount)} × 12)")
+    else:
+        lines.append(f"{labels['annual_income']}: {_rs(annual)}")
+
+    details = [d for d in (query.profession, query.city) if d]
+    if details:
+        lines.append(" | ".join(details))
+
+    lines += ["", f"*{labels['breakdown']}:*"]
+    for lower, upper, rate, taxable, slab_tax in tax_breakdown(annual):
+        if upper is None:
+            slab = labels["above"].format(_rs(lower))
+        elif lower == 0:
+            slab = labels["up_to"].format(_rs(upper))
+        else:
+            slab = f"{_rs(lower + 1)} – {upper:,.0f}"
+        lines.append(f"• {slab} @ {rate * 100:g}%: {_rs(slab_tax)}")
+
+    effective = tax / annual * 100 if annual else 0
+    lines += [
+        "",
+        f"*{labels['annual_tax']}: {_rs(tax)}*",
+        f"{labels['monthly_tax']}: {_rs(tax / 12)}",
+        f"{labels['effective_rate']}: {effective:.2f}%",
+    ]
+
+    if query.period_assumed:
+        other = "annual" if query.period == "monthly" else "monthly"
+        note = labels["assumed"].format(period=labels[query.period], other=labels[other])
+        lines += ["", f"_{note}_"]
+
+    return "\n".join(lines)
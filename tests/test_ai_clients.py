@@ -0,0 +1,118 @@
+import sys
+
+import pytest
+
+import ai_clients
+
+SDK_MODULES = ("openai", "google", "google.generativeai")
+
+
+@pytest.fixture
+def fake_sdks(tmp_path, monkeypatch):
+    """Importable stand-ins for the provider SDKs (nothing is called on them)"""
+    (tmp_path / "openai.py").write_text("")
+    (tmp_path / "google" / "generativeai").mkdir(parents=True)
+    (tmp_path / "google" / "generativeai" / "__init__.py").write_text("")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(ai_clients, "_clients", [])
+    for name in SDK_MODULES:
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    yield
+    for name in SDK_MODULES:
+        sys.modules.pop(name, None)
+
+
+def test_clients_do_not_import_their_sdk(fake_sdks):
+    ai_clients.OpenAIClient("key")
+    ai_clients.GeminiClient("key")
+    assert "openai" not in sys.modules
+    assert "google.generativeai" not in sys.modules
+
+
+def test_preload_sdks_imports_every_configured_provider(fake_sdks):
+    ai_clients.OpenAIClient("key")
+    ai_clients.GeminiClient("key")
+
+    ai_clients.preload_sdks()
+
+    assert "openai" in sys.modules
+    assert "google.generativeai" in sys.modules
+
+
+class NotFound(Exception):
+    code = 404
+
+
+class FakeModel:
+    def __init__(self, genai, cached):
+        self.genai = genai
+        self.cached = cached
+
+    def generate_content(self, contents, stream=False):
+        if self.cached is not None and self.cached in self.genai.expired:
+            raise NotFound("cached content not found")
+        response = type("Response", (), {"text": "cached" if self.cached is not None else "inline"})
+        return [response] if stream else response
+
+
+class FakeGenai:
+    """Just enough of google.generativeai for GeminiClient's model handling"""
+
+    def __init__(self):
+        self.created = []
+        self.expired = set()
+        genai = self
+
+        class CachedContent:
+            @staticmethod
+            def create(model, system_instruction, ttl):
+                genai.created.append(ttl.total_seconds())
+                return len(genai.created)
+
+        class GenerativeModel:
+            def __new__(cls, model, system_instruction=None, generation_config=None):
+                return FakeModel(genai, None)
+
+            @staticmethod
+            def from_cached_content(cached, generation_config=None):
+                return FakeModel(genai, cached)
+
+        self.caching = type("caching", (), {"CachedContent": CachedContent})
+        self.GenerativeModel = GenerativeModel
+
+
+@pytest.fixture
+def gemini(fake_sdks):
+    clock = [1000.0]
+    client = ai_clients.GeminiClient("key", context_cache=True, context_cache_ttl=600,
+                                     clock=lambda: clock[0])
+    client._genai_module = FakeGenai()
+    return client, client._genai_module, clock
+
+
+MESSAGES = [{"role": "system", "content": "prompt"}, {"role": "user", "content": "hi"}]
+
+
+def test_cached_content_is_recreated_before_it_expires(gemini):
+    client, genai, clock = gemini
+    assert client.complete(MESSAGES) == "cached"
+    clock[0] += 500
+    client.complete(MESSAGES)
+    assert len(genai.created) == 1
+
+    clock[0] += 50  # inside the refresh margin
+    assert client.complete(MESSAGES) == "cached"
+    assert len(genai.created) == 2
+
+
+def test_missing_cached_content_falls_back_to_inline_prompt(gemini):
+    client, genai, clock = gemini
+    client.complete(MESSAGES)
+    genai.expired.add(1)
+
+    assert client.complete(MESSAGES) == "inline"
+    assert list(client.stream(MESSAGES)) == ["inline"]
+
+    clock[0] += 600
+    assert client.complete(MESSAGES) == "cached"
+    assert len(genai.created) == 2
@@ -0,0 +1,165 @@
+import os
+
+os.environ.setdefault("META_ACCESS_TOKEN", "test")
+os.environ.setdefault("META_PHONE_NUMBER_ID", "0")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+import pytest
+
+import app_cloud_api as bot
+from answers import AnswerSteps
+
+
+class FailingStream:
+    """Streams the given pieces, then fails like a dropped connection"""
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+
+    def stream(self, messages):
+        yield from self.pieces
+        raise ConnectionError("stream reset")
+
+
+@pytest.fixture
+def stub_provider(monkeypatch):
+    def install(client):
+        monkeypatch.setitem(bot.ai_clients, "stub", client)
+        monkeypatch.setattr(bot.ai_router, "first_available", lambda: "stub")
+        monkeypatch.setattr(bot.ai_router, "record", lambda *args: None)
+        monkeypatch.setattr(bot, "STREAM_MIN_CHARS", 50)
+    return install
+
+
+def test_stream_failure_delivers_buffered_paragraphs(stub_provider):
+    stub_provider(FailingStream(["A" * 60 + "\n\n" + "B" * 70 + " more…"]))
+    delivered = []
+
+    bot.stream_ai_response([], lambda chunk, is_last: delivered.append((chunk, is_last)))
+
+    assert [chunk for chunk, _ in delivered] == [
+        "A" * 60,
+        "B" * 70 + " more…",
+        "_(Answer interrupted. Please ask again for the rest.)_",
+    ]
+    assert [is_last for _, is_last in delivered] == [False, False, True]
+
+
+@pytest.fixture
+def stub_complete(monkeypatch):
+    """Fresh sessions and cache; the provider answers with the conversation it saw"""
+    calls = []
+
+    def complete(messages):
+        calls.append(messages)
+        return "stub", " | ".join(msg["content"] for msg in messages[1:])
+
+    monkeypatch.setattr(bot, "AI_PROVIDER", "openai")
+    monkeypatch.setattr(bot, "answer_steps", AnswerSteps(
+        bot.create_session_store(bot.SYSTEM_PROMPT, backend="memory"), bot.ResponseCache("test"),
+        bot.SYSTEM_PROMPTS, bot.history_windows
+    ))
+    monkeypatch.setattr(bot.ai_router, "complete", complete)
+    return calls
+
+
+def test_follow_up_answers_are_not_served_to_other_users(stub_complete):
+    bot.get_ai_response("How do I register for NTN?", "user-a")
+    follow_up = bot.get_ai_response("what about for freelancers?", "user-a")
+
+    answer = bot.get_ai_response("what about for freelancers?", "user-b")
+
+    assert "NTN" in follow_up
+    assert "NTN" not in answer
+    assert len(stub_complete) == 3
+
+
+def test_opening_questions_are_answered_from_the_cache(stub_complete):
+    first = bot.get_ai_response("How do I file my tax return?", "user-a")
+    again = bot.get_ai_response("how do I file my tax return", "user-b")
+
+    assert again == first
+    assert len(stub_complete) == 1
+
+
+def delivery(*messages):
+    return {"object": "whatsapp_business_account", "entry": [{"changes": [
+        {"field": "messages", "value": {"messages": list(messages)}}
+    ]}]}
+
+
+def text_message(message_id, sender, body):
+    return {"id": message_id, "from": sender, "type": "text", "text": {"body": body}}
+
+
+def test_full_queue_asks_meta_to_redeliver_instead_of_processing_inline(monkeypatch):
+    handled = []
+    monkeypatch.setattr(bot, "WEBHOOK_DISPATCH_MODE", "inline")
+    monkeypatch.setattr(bot, "handle_whatsapp_message", lambda message: handled.append(message["id"]))
+    monkeypatch.setattr(bot.dispatcher, "call", lambda key, fn, *args: None)
+    client = bot.app.test_client()
+    body = delivery(text_message("wamid.full-1", "923000000001", "hi"))
+
+    response = client.post("/webhook", json=body)
+
+    assert response.status_code == 503
+    assert handled == []
+    # The redelivery is not dropped as a duplicate
+    monkeypatch.undo()
+    monkeypatch.setattr(bot, "WEBHOOK_DISPATCH_MODE", "inline")
+    monkeypatch.setattr(bot, "handle_whatsapp_message", lambda message: handled.append(message["id"]))
+    assert client.post("/webhook", json=body).status_code == 200
+    assert handled == ["wamid.full-1"]
+
+
+@pytest.mark.parametrize("body, error", [
+    ('{"incomes": [960000, NaN]}', "incomes[1]"),
+    ('{"incomes": [Infinity]}', "incomes[0]"),
+    ('{"incomes": [1, 2, 1e400]}', "incomes[2]"),
+    ('{"incomes": [1%s]}' % ("0" * 400), "incomes[0]"),
+    ('{"incomes": [-960000]}', "incomes[0]"),
+    ('{"incomes": [960000, "960000"]}', "incomes[1]"),
+    ('{"incomes": [960000], "year": ["2024-25"]}', "unknown tax year"),
+    ('{"incomes": [960000], "year": {"y": 1}}', "unknown tax year"),
+    ('{"incomes": [960000], "year": 2025}', "unknown tax year"),
+])
+def test_tax_batch_rejects_bad_rows(body, error):
+    response = bot.app.test_client().post("/api/tax/batch", data=body, content_type="application/json")
+    assert response.status_code == 400
+    assert error in response.get_json()["error"]
+
+
+def test_tax_batch_calculates_valid_incomes():
+    response = bot.app.test_client().post(
+        "/api/tax/batch", json={"incomes": [80000, 0], "period": "monthly", "year": bot.TAX_YEAR}
+    )
+    assert response.status_code == 200
+    assert response.get_json()["annual_tax"] == [18000, 0]
+
+
+def test_background_mode_answers_503_and_forgets_unqueued_messages(monkeypatch):
+    queued = []
+
+    def submit(sender, fn, messages):
+        if sender == "923000000002":
+            return False
+        queued.append(sender)
+        return True
+
+    monkeypatch.setattr(bot, "WEBHOOK_DISPATCH_MODE", "background")
+    monkeypatch.setattr(bot, "deduplicator", bot.MessageDeduplicator())
+    monkeypatch.setattr(bot.dispatcher, "submit", submit)
+    body = delivery(
+        text_message("wamid.bg-1", "923000000001", "hi"),
+        text_message("wamid.bg-2", "923000000002", "hi"),
+        text_message("wamid.bg-3", "923000000003", "hi"),
+    )
+
+    response = bot.app.test_client().post("/webhook", json=body)
+
+    assert response.status_code == 503
+    assert queued == ["923000000001"]
+    # The queued message stays remembered, the others will be redelivered
+    assert bot.deduplicator.seen("wamid.bg-1")
+    assert not bot.deduplicator.seen("wamid.bg-2")
+    assert not bot.deduplicator.seen("wamid.bg-3")
@@ -0,0 +1,47 @@
+import asyncio
+import os
+import threading
+
+os.environ.setdefault("META_ACCESS_TOKEN", "test")
+os.environ.setdefault("META_PHONE_NUMBER_ID", "0")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+import app_cloud_api as bot
+import asgi
+from answers import AnswerSteps
+
+
+class ThreadCheckingSessions:
+    """Session store wrapper that records whether it was used on the event loop thread"""
+
+    def __init__(self, store):
+        self.store = store
+        self.loop_thread_calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+
+        def call(*args, **kwargs):
+            if threading.current_thread() is threading.main_thread():
+                self.loop_thread_calls.append(name)
+            return method(*args, **kwargs)
+        return call
+
+
+def test_get_ai_response_keeps_store_io_off_the_event_loop(monkeypatch):
+    sessions = ThreadCheckingSessions(bot.create_session_store(bot.SYSTEM_PROMPT, backend="memory"))
+    steps = AnswerSteps(sessions, bot.ResponseCache("test"), bot.SYSTEM_PROMPTS, bot.history_windows)
+
+    async def acomplete(calls, messages):
+        return "openai", "File on IRIS before 30 September."
+
+    monkeypatch.setattr(bot, "AI_PROVIDER", "openai")
+    monkeypatch.setattr(bot, "answer_steps", steps)
+    monkeypatch.setattr(bot.ai_router, "acomplete", acomplete)
+
+    answer = asyncio.run(asgi.get_ai_response(bot, "How do I file my return?", "user-a"))
+    again = asyncio.run(asgi.get_ai_response(bot, "How do I file my return?", "user-b"))
+
+    assert answer == again == "File on IRIS before 30 September."
+    assert [turn.content for turn in sessions.store.history("user-a")] == ["How do I file my return?", answer]
+    assert sessions.loop_thread_calls == []
@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+
+import pytest
+
+import dedup
+from dedup import MessageDeduplicator
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(dedup, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_redelivered_ids_are_dropped():
+    deduplicator = MessageDeduplicator()
+    assert not deduplicator.seen("wamid.1")
+    assert deduplicator.seen("wamid.1")
+    assert not deduplicator.seen("")
+    assert deduplicator.stats()["duplicates"] == 1
+
+
+def test_ids_expire_after_the_ttl(clock):
+    deduplicator = MessageDeduplicator(ttl=60)
+    deduplicator.seen("wamid.1")
+    clock.now += 30
+    deduplicator.seen("wamid.2")
+
+    clock.now += 31
+    assert not deduplicator.seen("wamid.1")
+    assert deduplicator.seen("wamid.2")
+
+
+def test_oldest_ids_are_evicted_past_max_size():
+    deduplicator = MessageDeduplicator(max_size=2)
+    for message_id in ("wamid.1", "wamid.2", "wamid.3"):
+        deduplicator.seen(message_id)
+
+    assert deduplicator.stats()["local_ids"] == 2
+    assert deduplicator.seen("wamid.3")
+    assert not deduplicator.seen("wamid.1")
+
+
+def test_forgotten_ids_are_processed_again():
+    deduplicator = MessageDeduplicator()
+    deduplicator.seen("wamid.1")
+    deduplicator.forget(["wamid.1", None])
+    assert not deduplicator.seen("wamid.1")
@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+from dispatcher import WebhookDispatcher
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = WebhookDispatcher("test", workers=2, max_queue=100, max_per_sender=5, drain_timeout=5)
+    yield dispatcher
+    dispatcher.shutdown(drain=False)
+
+
+def test_each_senders_jobs_run_in_order(dispatcher):
+    handled = {}
+    lock = threading.Lock()
+
+    def job(sender, i):
+        with lock:
+            handled.setdefault(sender, []).append(i)
+
+    futures = [dispatcher.call(f"9230{s}", job, f"9230{s}", i) for i in range(5) for s in range(4)]
+    for future in futures:
+        future.result(timeout=5)
+
+    assert handled == {f"9230{s}": list(range(5)) for s in range(4)}
+
+
+def test_senders_on_one_shard_take_turns():
+    dispatcher = WebhookDispatcher("test", workers=1, drain_timeout=5)
+    gate = threading.Event()
+    order = []
+
+    first = dispatcher.call("blocker", gate.wait)
+    futures = [dispatcher.call("chatty", order.append, f"chatty-{i}") for i in range(3)]
+    futures.append(dispatcher.call("quiet", order.append, "quiet-0"))
+    gate.set()
+    for future in [first] + futures:
+        future.result(timeout=5)
+
+    assert order == ["chatty-0", "quiet-0", "chatty-1", "chatty-2"]
+    dispatcher.shutdown()
+
+
+def test_full_queue_rejects_instead_of_queueing(dispatcher):
+    gate = threading.Event()
+    futures = [dispatcher.call("923001", gate.wait) for _ in range(5)]
+
+    assert dispatcher.call("923001", gate.wait) is None
+    assert not dispatcher.submit("923001", gate.wait)
+    assert dispatcher.stats()["rejected"] == 2
+    gate.set()
+    for future in futures:
+        future.result(timeout=5)
+
+
+def test_shutdown_drains_queued_jobs():
+    dispatcher = WebhookDispatcher("test", workers=1, drain_timeout=5)
+    done = []
+    for i in range(3):
+        dispatcher.submit("923001", done.append, i)
+
+    dispatcher.shutdown()
+
+    assert done == [0, 1, 2]
+    assert not dispatcher.submit("923001", done.append, 3)
@@ -0,0 +1,41 @@
+import pytest
+
+from intents import IntentRouter
+
+
+@pytest.fixture(scope="module")
+def router():
+    return IntentRouter(year="2024-25")
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("hi", "welcome"),
+    ("Hi!", "welcome"),
+    ("Assalam o Alaikum", "welcome"),
+    ("thank you", "thanks"),
+    ("calculate my tax", "calculate"),
+    ("hi, calculate my tax", "calculate"),
+    ("hi, am I a filer?", "filer_status"),
+    ("salam, mera ntn kaise banega?", "ntn"),
+    ("thanks! what is the deadline?", "deadline"),
+])
+def test_short_messages_get_canned_replies(router, message, intent):
+    assert router.match(message).name == intent
+
+
+@pytest.mark.parametrize("message", [
+    "hi, how do I file my return late?",
+    "thanks, but how do I file my return late?",
+    "hello, which deductions can a freelancer claim?",
+    "hi, how do I calculate tax on my pension?",
+    "hi there",
+])
+def test_questions_after_a_greeting_go_to_the_ai(router, message):
+    assert router.match(message) is None
+
+
+def test_replies_are_rendered_per_language(router):
+    english = router.match("deadline", "en").reply
+    urdu = router.match("deadline", "ur").reply
+    assert english != urdu
+    assert router.match("deadline", "roman_ur").reply == english
@@ -0,0 +1,75 @@
+import io
+import os
+import tempfile
+
+import pytest
+
+from media import MediaError, MediaPipeline
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = MediaPipeline("http://graph.invalid", "token", max_dimension=100, workers=1)
+    yield pipeline
+    pipeline.shutdown()
+
+
+def test_worker_pool_does_not_fork_the_server(pipeline):
+    assert pipeline._get_pool()._mp_context.get_start_method() in ("forkserver", "spawn")
+
+
+def test_prepare_downscales_in_the_worker_pool(pipeline, tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    path = tmp_path / "receipt.png"
+    Image.new("RGB", (400, 200), "white").save(path)
+
+    data, mime_type = pipeline.prepare(str(path))
+
+    assert mime_type == "image/jpeg"
+    assert Image.open(io.BytesIO(data)).size == (100, 50)
+
+
+def test_broken_worker_pool_is_replaced(pipeline, tmp_path):
+    from concurrent.futures.process import BrokenProcessPool
+
+    path = tmp_path / "receipt.jpg"
+    path.write_bytes(b"\xff\xd8not really a jpeg")
+    broken = pipeline._get_pool()
+    with pytest.raises(BrokenProcessPool):
+        broken.submit(os._exit, 1).result()
+
+    try:
+        pipeline.prepare(str(path))
+    except MediaError:
+        pass  # Pillow refused the bytes, but in a working pool
+
+    assert pipeline._pool is not None and pipeline._pool is not broken
+    assert pipeline._get_pool().submit(abs, -1).result() == 1
+
+
+def test_cached_answers_are_kept_per_caption_and_language(pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, "resolve", lambda media_id: {
+        "url": "http://graph.invalid/file", "mime_type": "image/jpeg", "sha256": "abc", "file_size": 10,
+    })
+    monkeypatch.setattr(pipeline, "download", lambda url: (_temp_file(), "abc"))
+    monkeypatch.setattr(pipeline, "prepare", lambda path: (b"jpeg", "image/jpeg"))
+    calls = []
+
+    def extract(caption, language):
+        def run(data, mime_type):
+            calls.append((caption, language))
+            return f"{caption}/{language}"
+        return run
+
+    assert pipeline.process("m1", extract("", "en"), variant=("", "en")) == "/en"
+    assert pipeline.process("m2", extract("", "ur"), variant=("", "ur")) == "/ur"
+    assert pipeline.process("m3", extract("is it deductible?", "en"),
+                            variant=("is it deductible?", "en")) == "is it deductible?/en"
+    assert pipeline.process("m4", extract("", "en"), variant=("", "en")) == "/en"
+    assert len(calls) == 3
+
+
+def _temp_file():
+    handle, path = tempfile.mkstemp()
+    os.close(handle)
+    return path
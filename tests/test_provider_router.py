@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+from provider_router import CircuitBreaker, ProviderRouter
+
+
+def test_breaker_opens_after_failures_and_closes_after_a_good_trial():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=30)
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == "open" and not breaker.allow()
+
+    breaker.opened_at -= 30
+    assert breaker.allow() and breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+
+
+def test_cancelled_hedge_loser_releases_its_half_open_trial():
+    router = ProviderRouter([("openai", None), ("gemini", None)], hedge_budget=1.0,
+                            hedge_min_delay=0.0, hedge_default_delay=0.01, cooldown=30)
+    breaker = router.breakers["openai"]
+    breaker.state, breaker.opened_at = "open", time.monotonic() - 30
+
+    async def slow(messages):
+        await asyncio.sleep(5)
+        return "late"
+
+    async def fast(messages):
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def run():
+        return await router.acomplete({"openai": slow, "gemini": fast}, [])
+
+    assert asyncio.run(run()) == ("gemini", "answer")
+    assert router.stats()["hedged"] == 1
+
+    # The cancelled trial did not leave openai stuck half-open
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+
+
+def test_unlaunched_secondary_is_not_left_half_open():
+    router = ProviderRouter([("openai", None), ("gemini", None)], hedge=False,
+                            failure_threshold=1, cooldown=30)
+    gemini = router.breakers["gemini"]
+    gemini.record(False)
+    gemini.opened_at -= 30
+
+    primary_up = True
+
+    def primary(messages):
+        if not primary_up:
+            raise RuntimeError("openai down")
+        return "primary"
+
+    router.providers = [("openai", primary), ("gemini", lambda messages: "secondary")]
+
+    # The primary answers, so the cooled-down secondary is never tried
+    assert router.complete([]) == ("openai", "primary")
+    assert gemini.state == "open"
+
+    # The next primary failure still fails over
+    primary_up = False
+    assert router.complete([]) == ("gemini", "secondary")
+    assert gemini.state == "closed"
+    assert router.stats()["failovers"] == 1
+
+
+def test_acomplete_skips_a_refusing_provider_at_launch():
+    router = ProviderRouter([("openai", None), ("gemini", None)], hedge=False,
+                            failure_threshold=1, cooldown=30)
+    router.breakers["gemini"].record(False)
+
+    async def down(messages):
+        raise RuntimeError("openai down")
+
+    async def up(messages):
+        return "secondary"
+
+    async def run():
+        return await router.acomplete({"openai": down, "gemini": up}, [])
+
+    try:
+        asyncio.run(run())
+    except RuntimeError as e:
+        assert str(e) == "openai down"
+    else:
+        raise AssertionError("gemini is open and should not have been called")
+    assert router.breakers["gemini"].state == "open"
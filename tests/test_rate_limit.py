@@ -0,0 +1,41 @@
+from rate_limit import AdmissionControl, KeyedRateLimiter
+
+
+def admission(**overrides):
+    settings = dict(per_sender_rate=0.001, per_sender_burst=2, global_rate=0.001, global_burst=100,
+                    shed_depth=10)
+    settings.update(overrides)
+    return AdmissionControl(**settings)
+
+
+def test_each_sender_has_their_own_limit():
+    control = admission()
+    assert [control.check("923001") for _ in range(3)] == ["ok", "ok", "limited"]
+    assert control.check("923002") == "ok"
+    assert control.stats()["limited"] == 1
+
+
+def test_global_rate_sheds_load():
+    control = admission(global_burst=2)
+    assert [control.check(f"9230{i}") for i in range(3)] == ["ok", "ok", "shed"]
+
+
+def test_queued_and_in_flight_work_sheds_load():
+    queued = [8]
+    control = admission(depth_fn=lambda: queued[0])
+    assert control.check("923001") == "ok"
+
+    with control.track(), control.track():
+        assert control.depth() == 10
+        assert control.check("923002") == "shed"
+    assert control.stats()["in_flight"] == 0
+
+    queued[0] = 0
+    assert control.check("923003") == "ok"
+
+
+def test_idle_sender_buckets_are_dropped():
+    limiter = KeyedRateLimiter(1, 1, max_keys=2)
+    for sender in ("923001", "923002", "923003"):
+        limiter.allow(sender)
+    assert len(limiter) == 2
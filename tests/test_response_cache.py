@@ -0,0 +1,45 @@
+from response_cache import ResponseCache, normalize_question
+from session_store import Turn
+
+
+def test_normalize_question_ignores_case_punctuation_and_spelling():
+    assert normalize_question("Tax kaise file karein?") == normalize_question("tax kesay file karen")
+
+
+def test_only_opening_questions_without_personal_details_are_cacheable():
+    cache = ResponseCache("v1")
+    assert cache.cacheable("How do I file my tax return?")
+    assert not cache.cacheable("My salary is 80000, how much tax?")
+    assert not cache.cacheable("what about for freelancers?", [
+        Turn("user", "How do I register for NTN?"),
+        Turn("assistant", "Register on IRIS..."),
+    ])
+
+
+def test_answers_are_kept_per_variant():
+    cache = ResponseCache("v1")
+    cache.put("How do I file?", "File on IRIS", variant="en")
+    assert cache.get("how do i file", variant="en") == "File on IRIS"
+    assert cache.get("how do i file", variant="ur") is None
+
+
+def test_persistent_hit_keeps_the_stored_expiry(tmp_path):
+    path = str(tmp_path / "responses.db")
+    writer = ResponseCache("v1", ttl=100, path=path)
+    writer.put("How do I file?", "File on IRIS")
+    expires = writer._conn().execute("SELECT expires FROM responses").fetchone()[0]
+
+    reader = ResponseCache("v1", ttl=100000, path=path)
+    assert reader.get("How do I file?") == "File on IRIS"
+    assert reader._entries[reader.key("How do I file?")][0] == expires
+
+
+def test_writes_delete_expired_rows(tmp_path):
+    cache = ResponseCache("v1", ttl=-1, path=str(tmp_path / "responses.db"))
+    cache.put("How do I file?", "File on IRIS")
+    cache._purged_at = 0.0
+    cache.ttl = 100
+    cache.put("What is NTN?", "Your tax number")
+
+    keys = [row[0] for row in cache._conn().execute("SELECT key FROM responses")]
+    assert keys == [cache.key("What is NTN?")]
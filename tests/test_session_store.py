@@ -0,0 +1,222 @@
+import fnmatch
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import session_store
+from session_store import RedisSessionStore, SessionStore, SQLiteSessionStore
+
+
+class FakeRedis:
+    """The part of redis-py RedisSessionStore uses: lists, strings, TTL and SCAN
+
+    Values come back as bytes like redis-py's; `now` is advanced by the
+    tests instead of sleeping.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.data = {}
+        self.expires = {}
+
+    def _alive(self, key):
+        if key in self.expires and self.expires[key] <= self.now:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def rpush(self, key, *values):
+        self._alive(key)  # drops an expired list first
+        items = self.data.setdefault(key, [])
+        items.extend(v.encode("utf-8") for v in values)
+        return len(items)
+
+    def ltrim(self, key, start, end):
+        if self._alive(key):
+            items = self.data[key]
+            end = len(items) if end == -1 else end + 1
+            self.data[key] = items[start:end]
+
+    def lrange(self, key, start, end):
+        if not self._alive(key):
+            return []
+        items = self.data[key]
+        return items[start:] if end == -1 else items[start:end + 1]
+
+    def expire(self, key, seconds):
+        if self._alive(key):
+            self.expires[key] = self.now + seconds
+            return True
+        return False
+
+    def ttl(self, key):
+        if not self._alive(key):
+            return -2
+        return -1 if key not in self.expires else int(self.expires[key] - self.now)
+
+    def get(self, key):
+        return self.data[key] if self._alive(key) else None
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode("utf-8")
+        self.expires.pop(key, None)
+        if ex is not None:
+            self.expires[key] = self.now + ex
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+    def scan_iter(self, match="*", count=None):
+        for key in list(self.data):
+            if self._alive(key) and fnmatch.fnmatchcase(key, match):
+                yield key.encode("utf-8")
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def close(self):
+        pass
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+@pytest.fixture
+def redis_client():
+    return FakeRedis()
+
+
+@pytest.fixture(params=["redis", "sqlite"])
+def store(request, redis_client, tmp_path):
+    if request.param == "redis":
+        store = RedisSessionStore("system", client=redis_client, idle_ttl=60, max_turns=4)
+    else:
+        store = SQLiteSessionStore("system", path=str(tmp_path / "sessions.db"), idle_ttl=60, max_turns=4)
+    yield store
+    store.close()
+
+
+def test_extend_and_get_history(store):
+    store.extend("923001", [("user", "How do I file?"), ("assistant", "On IRIS")])
+    store.append("923001", "user", "شکریہ")
+
+    history = store.history("923001")
+    assert [(t.role, t.content) for t in history] == [
+        ("user", "How do I file?"), ("assistant", "On IRIS"), ("user", "شکریہ"),
+    ]
+    assert all(t.tokens for t in history)
+    assert store.history("923002") == []
+
+
+def test_history_is_trimmed_to_max_turns(store):
+    for i in range(6):
+        store.extend("923001", [("user", f"q{i}"), ("assistant", f"a{i}")])
+    assert [t.content for t in store.history("923001")] == ["q4", "a4", "q5", "a5"]
+
+
+def test_language_is_kept_with_the_conversation(store):
+    assert store.language("923001") is None
+    store.set_language("923001", "ur")
+    store.extend("923001", [("user", "ٹیکس کیسے فائل کریں؟")])
+    assert store.language("923001") == "ur"
+
+    store.clear("923001")
+    assert store.history("923001") == []
+    assert store.language("923001") is None
+
+
+def test_user_ids_lists_every_conversation(store):
+    for user_id in ("923001", "923002", "923003"):
+        store.extend(user_id, [("user", "hi")])
+    store.set_language("923004", "en")
+
+    expected = {"923001", "923002", "923003"}
+    if store.backend == "sqlite":
+        expected.add("923004")  # the language row is a session row
+    assert set(store.user_ids()) == expected
+
+
+def test_redis_conversation_and_language_expire_together(redis_client):
+    store = RedisSessionStore("system", client=redis_client, idle_ttl=60, prefix="t:")
+    store.set_language("923001", "ur")
+    redis_client.now += 50
+    store.extend("923001", [("user", "hi")])
+
+    # Each write pushes both keys' expiry out by idle_ttl
+    assert redis_client.ttl("t:923001") == 60
+    assert redis_client.ttl("t-language:923001") == 60
+
+    redis_client.now += 61
+    assert store.history("923001") == []
+    assert store.language("923001") is None
+    assert list(store.user_ids()) == []
+
+
+def test_sqlite_drops_idle_conversations(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_store, "time", SimpleNamespace(time=lambda: now[0]))
+    store = SQLiteSessionStore("system", path=str(tmp_path / "sessions.db"), idle_ttl=60)
+    store.extend("923001", [("user", "hi")])
+
+    now[0] += 61
+    assert store.history("923001") == []
+    store.purge_idle()
+    assert list(store.user_ids()) == []
+    store.close()
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = SessionStore("system", max_sessions=2)
+    store.extend("923001", [("user", "hi")])
+    store.extend("923002", [("user", "hi")])
+    store.history("923001")  # now the most recently used
+
+    store.extend("923003", [("user", "hi")])
+
+    assert store.user_ids() == ["923001", "923003"]
+    assert store.stats()["evictions"] == 1
+
+
+def test_memory_store_stays_within_its_byte_cap():
+    store = SessionStore("system", max_bytes=4000)
+    for i in range(20):
+        store.extend(f"9230{i:02}", [("user", "x" * 500)])
+
+    stats = store.stats()
+    assert stats["approx_bytes"] - sys.getsizeof(store.system_prompt) <= 4000
+    assert 0 < stats["sessions"] < 20
+    assert "923019" in store
+    assert "923000" not in store
+
+
+def test_memory_store_keeps_the_conversation_being_written():
+    store = SessionStore("system", max_bytes=100)
+    store.extend("923001", [("user", "x" * 500)])
+    assert [t.content for t in store.history("923001")] == ["x" * 500]
+
+
+def test_memory_store_drops_idle_sessions(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_store, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    store = SessionStore("system", idle_ttl=60)
+    store.extend("923001", [("user", "hi")])
+
+    now[0] += 61
+    store.extend("923002", [("user", "hi")])
+
+    assert store.user_ids() == ["923002"]
@@ -0,0 +1,45 @@
+import pytest
+
+from tax_query import parse_tax_query
+
+
+@pytest.mark.parametrize("message, amount, period", [
+    ("Monthly income 80000, software engineer, Islamabad", 80000, "monthly"),
+    ("salary 80000 per month, teacher, Lahore", 80000, "monthly"),
+    ("meri tankhwah 80 hazar hai", 80000, "monthly"),
+    ("My salary is Rs. 1,20,000 per month", 120000, "monthly"),
+    ("annual income 2.4 million", 2400000, "annual"),
+    ("میری تنخواہ ۸۰ ہزار ماہانہ ہے", 80000, "monthly"),
+    ("salary 80000 and rent 25000", 80000, "monthly"),
+    ("My salary is 200000 per month, how much zakat do I pay?", 200000, "monthly"),
+])
+def test_income_queries(message, amount, period):
+    query = parse_tax_query(message)
+    assert query is not None
+    assert query.amount == amount
+    assert query.period == period
+
+
+@pytest.mark.parametrize("message", [
+    "I pay 25000 rent in Karachi, which deductions can I claim?",
+    "What is the penalty of 10000 for late filing in Lahore?",
+    "I paid 50000 zakat, can I deduct it from my income?",
+    "software engineer 150000 Islamabad",
+    "House rent is 40000 a month, is it deductible from salary?",
+    "What deductions can I claim?",
+])
+def test_other_amounts_are_not_income(message):
+    assert parse_tax_query(message) is None
+
+
+@pytest.mark.parametrize("message, amount, period, assumed", [
+    ("How much tax this year on my salary of 150000?", 150000, "monthly", True),
+    ("salary 150000 and tax year 2025-26", 150000, "monthly", True),
+    ("My income was 1200000 last year, what about this month?", 1200000, "annual", True),
+    ("salary 150000, I joined last month and get a yearly bonus", 150000, "monthly", True),
+    ("monthly salary 150000 for tax year 2025-26", 150000, "monthly", False),
+])
+def test_period_word_must_be_next_to_the_amount(message, amount, period, assumed):
+    query = parse_tax_query(message)
+    assert query is not None
+    assert (query.amount, query.period, query.period_assumed) == (amount, period, assumed)
@@ -0,0 +1,27 @@
+from types import SimpleNamespace
+
+from whatsapp_sender import WhatsAppSender
+
+
+class CountingBucket:
+    def __init__(self):
+        self.taken = 0
+
+    def acquire(self):
+        self.taken += 1
+        return True
+
+
+def test_every_attempt_takes_a_token():
+    sender = WhatsAppSender("http://graph.invalid/messages", "token", phone_number_id="1",
+                            backoff_base=0, backoff_max=0, send_workers=1)
+    bucket = sender._buckets["1"] = CountingBucket()
+    statuses = iter([429, 503, 200])
+    sender.session.post = lambda url, json, timeout: SimpleNamespace(
+        status_code=next(statuses), headers={}, text=""
+    )
+
+    assert sender.send_text("923001234567", "hello")
+    assert bucket.taken == 3
+    assert sender.stats()["retries"] == 2
+    sender.close()
@@ -0,0 +1,326 @@
+"""
+TaxGuard AI - Pooled WhatsApp Cloud API sender
+
+Keeps one keep-alive HTTP session to graph.facebook.com instead of a new
+TCP+TLS handshake per reply, bounds every call with connect/read timeouts,
+retries 429/5xx with jittered backoff and paces sends to Meta's
+per-phone-number throughput limit. Every attempt takes a token, retries
+included, so backing off from a 429 never sends faster than the limit.
+
+Environment Variables (.env file):
+WHATSAPP_POOL_SIZE=keep-alive connections to the Graph API (default: 10)
+WHATSAPP_CONNECT_TIMEOUT=seconds (default: 3.05)
+WHATSAPP_READ_TIMEOUT=seconds (default: 10)
+WHATSAPP_MAX_RETRIES=retries for 429/5xx and connection errors (default: 3)
+WHATSAPP_RATE_LIMIT=messages per second per phone number (default: 80)
+WHATSAPP_SEND_WORKERS=background delivery threads (default: 4)
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import SEND_RETRIES, record_send
+from rate_limit import TokenBucket
+
+log = logging.getLogger(__name__)
+
+# Status codes worth retrying (throttling and Meta-side failures)
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def text_payload(recipient_phone, message_text):
+    """Cloud API payload for a plain text message"""
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": recipient_phone,
+        "type": "text",
+        "text": {
+            "preview_url": False,
+            "body": message_text
+        }
+    }
+
+
+def template_payload(recipient_phone, template_name, language_code="en"):
+    """Cloud API payload for an approved message template (no parameters)"""
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": recipient_phone,
+        "type": "template",
+        "template": {
+            "name": template_name,
+            "language": {"code": language_code}
+        }
+    }
+
+
+def backoff_delay(attempt, retry_after=None, base=0.5, maximum=8.0):
+    """Full-jitter exponential backoff, honouring Retry-After when given"""
+    if retry_after:
+        try:
+            return min(maximum, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+
+class WhatsAppSender:
+    """Sends Cloud API messages over a pooled, rate-limited session"""
+
+    def __init__(self, api_url, access_token, phone_number_id=None, pool_size=10,
+                 connect_timeout=3.05, read_timeout=10.0, max_retries=3,
+                 backoff_base=0.5, backoff_max=8.0, rate_per_second=80, send_workers=4):
+        self.api_url = api_url
+        self.phone_number_id = phone_number_id
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_per_second = rate_per_second
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json"
+        })
+
+        # One bucket per business phone number; Meta's limit is per number
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+
+        # Single-thread lanes so one recipient's messages are delivered in order
+        self._lanes = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"wa-send-{i}")
+            for i in range(max(1, send_workers))
+        ]
+
+        self._stats_lock = threading.Lock()
+        self._sent = 0
+        self._failed = 0
+        self._retries = 0
+        self._latency_total = 0.0
+
+    def _bucket(self, phone_number_id):
+        with self._buckets_lock:
+            bucket = self._buckets.get(phone_number_id)
+            if bucket is None:
+                bucket = self._buckets[phone_number_id] = TokenBucket(self.rate_per_second)
+            return bucket
+
+    def send_text(self, recipient_phone, message_text):
+        """Send a text message and wait for the result (True on success)"""
+        return self.post(text_payload(recipient_phone, message_text))
+
+    def submit(self, recipient_phone, message_text):
+        """Queue a text message for background delivery; returns a Future"""
+        lane = self._lanes[zlib.crc32(str(recipient_phone).encode()) % len(self._lanes)]
+        try:
+            return lane.submit(self.send_text, recipient_phone, message_text)
+        except RuntimeError:
+            # Interpreter is shutting down: deliver inline instead
+            future = Future()
+            future.set_result(self.send_text(recipient_phone, message_text))
+            return future
+
+    def post(self, payload):
+        """POST a message payload with pacing, timeouts and retries"""
+        recipient = payload.get("to")
+        started = time.perf_counter()
+        bucket = self._bucket(self.phone_number_id)
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            bucket.acquire()
+            try:
+                response = self.session.post(self.api_url, json=payload, timeout=self.timeout)
+
+                if response.status_code == 200:
+                    self._record(True, started)
+                    log.info("Message sent", extra={"recipient": recipient})
+                    return True
+
+                if response.status_code not in RETRYABLE_STATUS or attempt == self.max_retries:
+                    self._record(False, started)
+                    log.error("Error sending message", extra={
+                        "recipient": recipient, "status": response.status_code, "error": response.text
+                    })
+                    return False
+
+                retry_after = response.headers.get("Retry-After")
+
+            except requests.exceptions.ConnectionError as e:
+                # Nothing reached Meta, so retrying cannot double-send
+                if attempt == self.max_retries:
+                    self._record(False, started)
+                    log.error("Exception while sending message", extra={"recipient": recipient, "error": str(e)})
+                    return False
+
+            except Exception as e:
+                # Read timeouts are not retried: Meta may already have delivered it
+                self._record(False, started)
+                log.error("Exception while sending message", extra={"recipient": recipient, "error": str(e)})
+                return False
+
+            with self._stats_lock:
+                self._retries += 1
+            SEND_RETRIES.labels("whatsapp").inc()
+            time.sleep(self._backoff(attempt, retry_after))
+
+        return False
+
+    def _backoff(self, attempt, retry_after=None):
+        return backoff_delay(attempt, retry_after, self.backoff_base, self.backoff_max)
+
+    def _record(self, ok, started):
+        elapsed = time.perf_counter() - started
+        record_send("whatsapp", ok, elapsed)
+        with self._stats_lock:
+            if ok:
+                self._sent += 1
+            else:
+                self._failed += 1
+            self._latency_total += elapsed
+
+    def stats(self):
+        """Delivery counters for /health"""
+        with self._stats_lock:
+            total = self._sent + self._failed
+            avg = self._latency_total / total if total else 0.0
+            return {
+                "sent": self._sent,
+                "failed": self._failed,
+                "retries": self._retries,
+                "avg_send_ms": round(avg * 1000, 2),
+                "pending": sum(lane._work_queue.qsize() for lane in self._lanes),
+            }
+
+    def close(self):
+        """Finish queued deliveries and close pooled connections"""
+        for lane in self._lanes:
+            lane.shutdown(wait=True)
+        self.session.close()
+
+
+class AsyncWhatsAppSender:
+    """asyncio counterpart of WhatsAppSender on a pooled aiohttp session
+
+    Same pacing, timeouts and retry rules; used by the asyncio serving mode
+    (asgi_cloud_api.py). The session is created on first use so it belongs
+    to the running event loop.
+    """
+
+    def __init__(self, api_url, access_token, phone_number_id=None, pool_size=10,
+                 connect_timeout=3.05, read_timeout=10.0, max_retries=3,
+                 backoff_base=0.5, backoff_max=8.0, rate_per_second=80):
+        import aiohttp
+        self._aiohttp = aiohttp
+        self.api_url = api_url
+        self.access_token = access_token
+        self.phone_number_id = phone_number_id
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._bucket = TokenBucket(rate_per_second)
+        self._session = None
+
+        self._sent = 0
+        self._failed = 0
+        self._retries = 0
+        self._latency_total = 0.0
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = self._aiohttp.ClientSession(
+                connector=self._aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=self.timeout,
+                headers={"Authorization": f"Bearer {self.access_token}"}
+            )
+        return self._session
+
+    async def send_text(self, recipient_phone, message_text):
+        """Send a text message (True on success)"""
+        return await self.post(text_payload(recipient_phone, message_text))
+
+    async def post(self, payload):
+        """POST a message payload with pacing, timeouts and retries"""
+        recipient = payload.get("to")
+        started = time.perf_counter()
+
+        session = self._get_session()
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            while not self._bucket.try_acquire():
+                await asyncio.sleep(1.0 / max(self._bucket.rate, 1.0))
+            try:
+                async with session.post(self.api_url, json=payload) as response:
+                    if response.status == 200:
+                        self._record(True, started)
+                        log.info("Message sent", extra={"recipient": recipient})
+                        return True
+
+                    if response.status not in RETRYABLE_STATUS or attempt == self.max_retries:
+                        self._record(False, started)
+                        log.error("Error sending message", extra={
+                            "recipient": recipient, "status": response.status, "error": await response.text()
+                        })
+                        return False
+
+                    retry_after = response.headers.get("Retry-After")
+
+            except self._aiohttp.ClientConnectorError as e:
+                # Nothing reached Meta, so retrying cannot double-send
+                if attempt == self.max_retries:
+                    self._record(False, started)
+                    log.error("Exception while sending message", extra={"recipient": recipient, "error": str(e)})
+                    return False
+
+            except Exception as e:
+                # Read timeouts are not retried: Meta may already have delivered it
+                self._record(False, started)
+                log.error("Exception while sending message", extra={"recipient": recipient, "error": str(e)})
+                return False
+
+            self._retries += 1
+            SEND_RETRIES.labels("whatsapp").inc()
+            await asyncio.sleep(backoff_delay(attempt, retry_after, self.backoff_base, self.backoff_max))
+
+        return False
+
+    def _record(self, ok, started):
+        elapsed = time.perf_counter() - started
+        record_send("whatsapp", ok, elapsed)
+        if ok:
+            self._sent += 1
+        else:
+            self._failed += 1
+        self._latency_total += elapsed
+
+    def stats(self):
+        """Delivery counters for /health"""
+        total = self._sent + self._failed
+        avg = self._latency_total / total if total else 0.0
+        return {
+            "sent": self._sent,
+            "failed": self._failed,
+            "retries": self._retries,
+            "avg_send_ms": round(avg * 1000, 2),
+        }
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()